@@ -2,6 +2,9 @@ import cv2
 import numpy as np
 from tkinter import Tk, filedialog
 import sys
+import processing
+from mask_cache import default_cache
+from export_stage import ExportStage
 print(sys.executable)
 
 
@@ -40,21 +43,13 @@ def process_and_display(image_path):
     print("Image loaded successfully!")
 
     original = image.copy()
-    mask = np.zeros(image.shape[:2], dtype=np.uint8)
 
     # Define the initial rectangle for GrabCut
     height, width = image.shape[:2]
     rect = (10, 10, width - 20, height - 20)  # Slight margin from image borders
 
-    # Initialize models needed by GrabCut
-    bg_model = np.zeros((1, 65), np.float64)
-    fg_model = np.zeros((1, 65), np.float64)
-
-    # Apply GrabCut algorithm
-    cv2.grabCut(image, mask, rect, bg_model, fg_model, 5, cv2.GC_INIT_WITH_RECT)
-
-    # Refine the mask: Convert possible foreground/unknown to definite foreground
-    mask2 = np.where((mask == 2) | (mask == 0), 0, 1).astype(np.uint8)
+    # Apply GrabCut, reusing the mask from an earlier run on the same image
+    mask2 = processing.grabcut_mask(image, rect, 5, cache=default_cache())
 
     # Apply the mask to the original image
     result = image * mask2[:, :, np.newaxis]
@@ -78,8 +73,10 @@ def process_and_display(image_path):
     cv2.namedWindow("Final Result", cv2.WINDOW_NORMAL)
     cv2.imshow("Final Result", result_resized)
 
-    # Save the processed result
-    cv2.imwrite("grabcut_result.png", white_background)
+    # Save the cutout, mask, white-background image and thumbnail in one pass
+    with ExportStage() as exporter:
+        for path in exporter.export(image, mask2, ".", "grabcut_result").values():
+            print(f"Saved {path}")
 
     print("Press any key in the image windows to close them...")
     cv2.waitKey(0)
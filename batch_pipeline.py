@@ -0,0 +1,350 @@
+import argparse
+import glob
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import metrics
+import processing
+from export_stage import OUTPUTS, ExportStage
+from job_manifest import JobManifest, process
+from mask_cache import default_cache
+from mask_dedup import MaskDeduplicator
+
+# Tells a stage's workers that no more items will arrive
+_DONE = object()
+
+
+class Stage:
+    """A pool of worker threads between two bounded queues.
+
+    Each worker calls func(item, state) on items from the input queue and
+    puts the result on the next stage's queue; state comes from setup(),
+    called once per worker (e.g. a model that is not thread-safe). Workers
+    record the time spent in func (busy) and the time spent waiting for room
+    downstream (blocked), from which utilisation is reported.
+    """
+
+    def __init__(self, name, func, workers=1, setup=None, queue_size=8):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.setup = setup
+        self.input = queue.Queue(maxsize=queue_size)
+        self.output = None
+        self.on_error = None  # Called with (item, message) when func raises
+        self.threads = []
+        self.lock = threading.Lock()
+        self.finished = 0
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.errors = []
+
+    def start(self):
+        self.threads = [threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+                        for i in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def _run(self):
+        state = None
+        setup_error = None
+        if self.setup is not None:
+            try:
+                state = self.setup()
+            except Exception as e:
+                # Keep draining so the stages downstream still finish
+                setup_error = f"{type(e).__name__}: {e}"
+        while True:
+            item = self.input.get()
+            if item is _DONE:
+                with self.lock:
+                    self.finished += 1
+                    last = self.finished == self.workers
+                if last:
+                    if self.output is not None:
+                        self.output.put(_DONE)
+                else:
+                    self.input.put(_DONE)  # Let the sibling workers see it too
+                return
+
+            start = time.perf_counter()
+            try:
+                if setup_error is not None:
+                    raise RuntimeError(f"{self.name} setup failed: {setup_error}")
+                result = self.func(item, state)
+            except Exception as e:
+                result = None
+                message = f"{type(e).__name__}: {e}"
+                with self.lock:
+                    self.errors.append((item.get("path"), message))
+                if self.on_error is not None:
+                    self.on_error(item, message)
+            done = time.perf_counter()
+
+            if result is not None and self.output is not None:
+                self.output.put(result)
+            with self.lock:
+                self.items += 1
+                self.busy += done - start
+                self.blocked += time.perf_counter() - done
+
+    def utilisation(self, elapsed):
+        """Fraction of the workers' wall time spent in func."""
+        return self.busy / (self.workers * elapsed) if elapsed > 0 else 0.0
+
+
+class BatchPipeline:
+    """Decode, segment and encode images concurrently, connected by bounded queues.
+
+    While one image is being segmented the next ones are decoded and the
+    previous ones encoded and written. Queues hold at most queue_size
+    images, so a slow stage makes the stages before it wait instead of
+    buffering the whole batch in memory.
+    """
+
+    def __init__(self, stages, on_error=None):
+        self.stages = stages
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.output = next_stage.input
+        for stage in stages:
+            stage.on_error = on_error
+        self.started = None
+        self.elapsed = 0.0
+
+    def start(self):
+        self.started = time.perf_counter()
+        for stage in self.stages:
+            metrics.QUEUE_DEPTH.set_function(stage.input.qsize, queue=stage.name)
+            metrics.UTILISATION.set_function(lambda stage=stage: stage.utilisation(self._elapsed()), stage=stage.name)
+            stage.start()
+
+    def submit(self, path, **fields):
+        """Queue one image; blocks while the pipeline is full."""
+        self.stages[0].input.put(dict(fields, path=path))
+
+    def finish(self):
+        """Wait until everything submitted has gone through every stage."""
+        self.stages[0].input.put(_DONE)
+        for stage in self.stages:
+            stage.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def run(self, paths):
+        self.start()
+        for path in paths:
+            self.submit(path)
+        self.finish()
+
+    def errors(self):
+        return [error for stage in self.stages for error in stage.errors]
+
+    def _elapsed(self):
+        return self.elapsed or (time.perf_counter() - self.started if self.started else 0.0)
+
+    def report(self):
+        elapsed = self._elapsed()
+        lines = [f"{self.stages[-1].items} images in {elapsed:.2f} s"]
+        for stage in self.stages:
+            lines.append(
+                f"{stage.name:8s} {stage.workers:2d} workers  {stage.utilisation(elapsed):6.1%} busy"
+                f"  {stage.blocked / (stage.workers * elapsed) if elapsed else 0:6.1%} blocked downstream"
+            )
+        return "\n".join(lines)
+
+
+def decode(item, _):
+    with metrics.STAGE_SECONDS.time(stage="decode"):
+        if "data" in item:
+            # Encoded bytes read from an archive or a stream rather than a file
+            image = cv2.imdecode(np.frombuffer(item.pop("data"), np.uint8), cv2.IMREAD_COLOR)
+        else:
+            image = cv2.imread(item["path"])
+    if image is None:
+        raise ValueError("Unable to read the image")
+    item["image"] = image
+    return item
+
+
+def grabcut_segmenter(cache=None, dedup=None):
+    def segment(image):
+        # Same slight margin as Background_removal.py
+        height, width = image.shape[:2]
+        return processing.grabcut_mask(image, (10, 10, width - 20, height - 20), 5, cache=cache, dedup=dedup)
+    return segment
+
+
+def mediapipe_segmenter(cache=None, dedup=None):
+    import mediapipe as mp
+    segmenter = mp.solutions.selfie_segmentation.SelfieSegmentation(model_selection=1)
+    return lambda image: processing.mediapipe_mask(image, segmenter, cache=cache, dedup=dedup)
+
+
+def u2net_segmenter(cache=None, dedup=None, weights=None, backend="torch", architecture="u2net", batch_size=1,
+                    batch_wait=0.02, latency_budget_ms=None):
+    """Segment with U2-Net, or with architecture "auto" pick u2net or u2netp per image.
+
+    The automatic choice (U2NetSelector, with each architecture's default
+    weights) fits latency_budget_ms, which segment(image, budget) can
+    override for one image.
+    """
+    from u2net_engine import ARCHITECTURES, U2NetSelector, get_engine
+    if architecture == "auto":
+        if batch_size > 1:
+            raise ValueError("U2-Net batching needs a fixed architecture, not auto")
+        selector = U2NetSelector(backend=backend)
+
+        def segment(image, budget=latency_budget_ms):
+            chosen = selector.choose(image.shape, budget)
+            return processing.u2net_mask(image, selector.engine(chosen), cache=cache, dedup=dedup,
+                                         predict=lambda image: selector.run(image, chosen))
+        return segment
+
+    engine = get_engine(weights or ARCHITECTURES[architecture][1], backend=backend, architecture=architecture)
+    batcher = None
+    if batch_size > 1:
+        # Shared by every segment worker, whose concurrent images then go through one forward pass
+        from u2net_batcher import get_batcher
+        batcher = get_batcher(engine, batch_size, batch_wait)
+    return lambda image: processing.u2net_mask(image, engine, cache=cache, dedup=dedup, batcher=batcher)
+
+
+def threshold_segmenter(cache=None, dedup=None, value=127):
+    # Foreground is everything brighter than value; cheap enough not to cache
+    def segment(image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        return (processing.threshold_image(gray, value, 1) > 0).astype("uint8")
+    return segment
+
+
+SEGMENTERS = {
+    "grabcut": grabcut_segmenter,
+    "threshold": threshold_segmenter,
+    "mediapipe": mediapipe_segmenter,
+    "u2net": u2net_segmenter,
+}
+
+
+def create_pipeline(output_dir, engine="grabcut", decode_workers=2, segment_workers=1, encode_workers=2,
+                    queue_size=8, exporter=None, cache=None, dedup=None, on_done=None, on_error=None,
+                    shard_writer=None, before_write=None, **engine_options):
+    """Build the decode -> segment -> encode pipeline for one of SEGMENTERS.
+
+    Items carry a path, or encoded bytes under "data" and an output name
+    under "name". Outputs go to output_dir, or into shard_writer (a
+    tar_shards.ShardWriter) when given. on_done(item) is called from an
+    encode worker after an image's outputs are written, on_error(item,
+    message) from any worker whose stage failed. before_write(item), when
+    given, is called just before an image's outputs are written and may
+    raise to skip the image.
+    """
+    exporter = exporter or ExportStage()
+    make_segmenter = SEGMENTERS[engine]
+
+    def segment(item, segmenter):
+        with metrics.STAGE_SECONDS.time(stage="segment"):
+            item["mask"] = segmenter(item["image"])
+        return item
+
+    def failed(item, message):
+        metrics.IMAGES.inc(engine=engine, status="failed")
+        if on_error is not None:
+            on_error(item, message)
+
+    def encode(item, _):
+        if before_write is not None:
+            before_write(item)
+        name = item.get("name") or os.path.splitext(os.path.basename(item["path"]))[0]
+        if shard_writer is None:
+            item["outputs"] = exporter.write(item["image"], item["mask"], output_dir, name)
+        else:
+            item["outputs"] = {output: shard_writer.add(name + OUTPUTS[output], data)
+                               for output, data in exporter.encode(item["image"], item["mask"]).items()}
+        del item["image"], item["mask"]
+        metrics.IMAGES.inc(engine=engine, status="ok")
+        if on_done is not None:
+            on_done(item)
+        return None
+
+    return BatchPipeline([
+        Stage("decode", decode, decode_workers, queue_size=queue_size),
+        # One segmenter per worker: MediaPipe graphs are not thread-safe
+        Stage("segment", segment, segment_workers, lambda: make_segmenter(cache, dedup, **engine_options),
+              queue_size=queue_size),
+        Stage("encode", encode, encode_workers, queue_size=queue_size),
+    ], failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove backgrounds from many images with overlapped stages")
+    parser.add_argument("images", nargs="*", default=sorted(glob.glob(os.path.join("data", "*"))))
+    parser.add_argument("--output-dir", default="output")
+    parser.add_argument("--engine", default="grabcut", choices=sorted(SEGMENTERS))
+    parser.add_argument("--decode-workers", type=int, default=2)
+    parser.add_argument("--segment-workers", type=int, default=1)
+    parser.add_argument("--encode-workers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=8, help="Images buffered between stages")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the on-disk mask cache")
+    parser.add_argument("--dedup", action="store_true", help="Reuse the masks of near-duplicate images")
+    parser.add_argument("--dedup-memory", type=int, default=64, help="Megabytes of masks kept for --dedup")
+    parser.add_argument("--u2net-weights", default=None)
+    parser.add_argument("--backend", default="torch", help="U2-Net backend")
+    parser.add_argument("--architecture", default="u2net", help="u2net, u2netp or auto (see --latency-budget)")
+    parser.add_argument("--latency-budget", type=float, default=None,
+                        help="Milliseconds per image; with --architecture auto, u2netp is used for images "
+                             "that u2net would not segment in time")
+    parser.add_argument("--u2net-batch", type=int, default=1,
+                        help="Batch up to this many U2-Net images from concurrent segment workers")
+    parser.add_argument("--manifest", default=None, help="SQLite file recording progress; rerun to resume")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Tries per image with --manifest")
+    parser.add_argument("--metrics-file", default=None, help="Write Prometheus-format metrics here at the end")
+    args = parser.parse_args()
+
+    engine_options = {}
+    if args.engine == "u2net":
+        engine_options = {"weights": args.u2net_weights, "backend": args.backend, "architecture": args.architecture,
+                          "batch_size": args.u2net_batch, "latency_budget_ms": args.latency_budget}
+
+    cache = None if args.no_cache else default_cache()
+    dedup = MaskDeduplicator(max_bytes=args.dedup_memory * 1024 * 1024) if args.dedup else None
+    metrics.watch_caches(cache, dedup)
+    if args.manifest is None:
+        pipeline = create_pipeline(args.output_dir, args.engine, args.decode_workers, args.segment_workers,
+                                   args.encode_workers, args.queue_size, cache=cache, dedup=dedup, **engine_options)
+        pipeline.run(args.images)
+    else:
+        params = dict(engine_options, engine=args.engine, output_dir=os.path.abspath(args.output_dir))
+        manifest = JobManifest(args.manifest, params, args.max_attempts)
+        if manifest.requeued:
+            print(f"Requeued {manifest.requeued} images finished with other parameters")
+        print(f"Added {manifest.add(args.images)} new images to {args.manifest}")
+        pipeline = create_pipeline(args.output_dir, args.engine, args.decode_workers, args.segment_workers,
+                                   args.encode_workers, args.queue_size, cache=cache, dedup=dedup,
+                                   on_done=manifest.item_done, on_error=manifest.item_failed, **engine_options)
+        pipeline.start()
+        process(manifest, pipeline)
+        counts = manifest.counts()
+        print(f"Manifest: {counts['done']} done, {counts['failed']} failed, {counts['pending']} pending")
+
+    print(pipeline.report())
+    if cache is not None:
+        print(f"Mask cache hit rate: {cache.hit_rate():.1%}")
+    if dedup is not None:
+        print(f"Near-duplicate hit rate: {dedup.hit_rate():.1%}")
+    for path, error in pipeline.errors():
+        print(f"Failed {path}: {error}")
+    if args.metrics_file:
+        metrics.REGISTRY.write(args.metrics_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import glob
+import os
+import time
+
+import cv2
+
+import processing
+
+
+def load_segmenters(u2net_weights, threads):
+    """Create one mask function per available engine."""
+    segmenters = {}
+
+    def grabcut(image):
+        # Same slight margin as Background_removal.py
+        height, width = image.shape[:2]
+        return processing.grabcut_mask(image, (10, 10, width - 20, height - 20), 5)
+    segmenters["grabcut"] = grabcut
+
+    try:
+        import mediapipe as mp
+        segmenter = mp.solutions.selfie_segmentation.SelfieSegmentation(model_selection=1)
+        segmenters["mediapipe"] = lambda image: processing.mediapipe_mask(image, segmenter)
+    except ImportError:
+        print("MediaPipe not installed, skipping")
+
+    try:
+        from u2net_engine import U2NetEngine
+        if u2net_weights is not None and not os.path.exists(u2net_weights):
+            print(f"{u2net_weights} not found, using random U2-Net weights")
+            u2net_weights = None
+        engine = U2NetEngine(u2net_weights, num_threads=threads)
+        segmenters["u2net"] = lambda image: processing.u2net_mask(image, engine)
+    except ImportError:
+        print("PyTorch not installed, skipping U2-Net")
+
+    return segmenters
+
+
+def benchmark(image_paths, segmenters, repeats=3):
+    """Time every engine on every image and return {engine: mean seconds per image}."""
+    images = [cv2.imread(path) for path in image_paths]
+    images = [image for image in images if image is not None]
+    results = {}
+    for name, segment in segmenters.items():
+        segment(images[0])  # Warm-up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for image in images:
+                segment(image)
+        results[name] = (time.perf_counter() - start) / (repeats * len(images))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare segmentation engines on the same inputs")
+    parser.add_argument("images", nargs="*", default=sorted(glob.glob(os.path.join("data", "*"))))
+    parser.add_argument("--u2net-weights", default=os.path.join("saved_models", "u2net_portrait", "u2net_portrait.pth"))
+    parser.add_argument("--threads", type=int, default=None, help="PyTorch intra-op threads")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    segmenters = load_segmenters(args.u2net_weights, args.threads)
+    for name, seconds in benchmark(args.images, segmenters, args.repeats).items():
+        print(f"{name:10s} {seconds * 1000:8.1f} ms/image")
+
+
+if __name__ == "__main__":
+    main()
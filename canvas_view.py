@@ -0,0 +1,73 @@
+import tkinter as tk
+from PIL import Image, ImageTk
+
+
+class CanvasView:
+    """Keep one PhotoImage and one image item per canvas and update them in place."""
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.photo = None
+        self.item = None
+        self.mode = None
+        self.size = None
+        self.allocations = 0  # Number of PhotoImage objects created so far
+        self.updates = 0
+
+    def show(self, image_rgb, x, y, anchor=tk.CENTER):
+        """Show an RGB (or grayscale) array at (x, y), reusing Tk resources when possible."""
+        pil_image = Image.fromarray(image_rgb)
+
+        # Only reallocate the Tk image when its size or mode changes
+        if self.photo is None or pil_image.size != self.size or pil_image.mode != self.mode:
+            self.photo = ImageTk.PhotoImage(pil_image)
+            self.size = pil_image.size
+            self.mode = pil_image.mode
+            self.allocations += 1
+        else:
+            self.photo.paste(pil_image)
+        self.updates += 1
+
+        # Reuse the canvas item unless someone deleted it
+        if self.item is None or not self.canvas.type(self.item):
+            self.item = self.canvas.create_image(x, y, image=self.photo, anchor=anchor)
+            self.canvas.tag_lower(self.item)
+        else:
+            self.canvas.itemconfigure(self.item, image=self.photo, anchor=anchor)
+            self.canvas.coords(self.item, x, y)
+
+        self.canvas.image = self.photo  # Keep a reference to prevent garbage collection
+        return self.item
+
+    def clear(self):
+        """Remove the image item; the PhotoImage is kept for the next show()."""
+        if self.item is not None:
+            self.canvas.delete(self.item)
+            self.item = None
+
+
+def get_view(canvas):
+    """Return the CanvasView attached to a canvas, creating it on first use."""
+    view = getattr(canvas, "view", None)
+    if view is None:
+        view = CanvasView(canvas)
+        canvas.view = view
+    return view
+
+
+def show_image(canvas, image_rgb, x, y, anchor=tk.CENTER):
+    """Display an RGB array on a canvas through its persistent CanvasView."""
+    return get_view(canvas).show(image_rgb, x, y, anchor)
+
+
+def clear_image(canvas):
+    get_view(canvas).clear()
+
+
+def show_line(canvas, tag, x0, y0, x1, y1, **options):
+    """Move a tagged line item, creating it only if it does not exist yet."""
+    if canvas.find_withtag(tag):
+        canvas.coords(tag, x0, y0, x1, y1)
+        canvas.tag_raise(tag)
+    else:
+        canvas.create_line(x0, y0, x1, y1, tags=tag, **options)
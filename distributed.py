@@ -0,0 +1,374 @@
+import argparse
+import glob
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+import metrics
+from batch_pipeline import SEGMENTERS, create_pipeline
+from mask_cache import default_cache
+
+# Layout of a job directory on the shared filesystem:
+#   job.json                 engine, output directory and number of chunks
+#   chunks/00000.txt         input paths of each chunk, one per line
+#   leases/00000.lease       held by the node working on the chunk, touched as a heartbeat
+#   done/00000.json          completion marker with counts and failures
+#   clock/<node>             touched to read the file server's clock
+
+
+def _chunk_name(index):
+    return f"{index:05d}"
+
+
+def _write_atomic(path, text):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def create_job(job_dir, paths, output_dir, engine="grabcut", chunk_size=100, **engine_options):
+    """Split paths into chunks under job_dir; returns the number of chunks."""
+    if os.path.exists(os.path.join(job_dir, "job.json")):
+        raise FileExistsError(f"{job_dir} already holds a job")
+    for sub in ("chunks", "leases", "done", "clock"):
+        os.makedirs(os.path.join(job_dir, sub), exist_ok=True)
+    paths = [os.path.abspath(path) for path in paths]
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    for index, chunk in enumerate(chunks):
+        _write_atomic(os.path.join(job_dir, "chunks", _chunk_name(index) + ".txt"), "\n".join(chunk) + "\n")
+    job = {"chunks": len(chunks), "images": len(paths), "output_dir": os.path.abspath(output_dir),
+           "engine": engine, "engine_options": engine_options}
+    # Written last: nodes wait for it, so they never see a partial job
+    _write_atomic(os.path.join(job_dir, "job.json"), json.dumps(job, indent=1))
+    return len(chunks)
+
+
+def load_job(job_dir):
+    with open(os.path.join(job_dir, "job.json")) as f:
+        return json.load(f)
+
+
+def server_time(job_dir, node):
+    """Current time on the file server, so lease ages do not depend on clock skew between nodes."""
+    probe = os.path.join(job_dir, "clock", node.replace(os.sep, "_"))
+    with open(probe, "a"):
+        pass
+    os.utime(probe)
+    return os.stat(probe).st_mtime
+
+
+class Lease:
+    """A chunk claimed by one node through an exclusive lease file.
+
+    The lease is created with link(2), which is atomic on NFS, and its
+    modification time is refreshed as a heartbeat. A lease whose heartbeat
+    is older than expire seconds belongs to a dead node and may be taken
+    over; the token written in the file tells the old owner it was lost.
+    """
+
+    def __init__(self, job_dir, chunk, node):
+        self.chunk = chunk
+        self.path = os.path.join(job_dir, "leases", _chunk_name(chunk) + ".lease")
+        self.token = f"{node} {uuid.uuid4().hex}"
+
+    def acquire(self):
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.token)
+        try:
+            os.link(tmp_path, self.path)
+        except OSError:
+            pass  # Taken, or an NFS retransmit of a link that did succeed: the link count tells
+        try:
+            return os.stat(tmp_path).st_nlink == 2
+        finally:
+            os.unlink(tmp_path)
+
+    def held(self):
+        try:
+            with open(self.path) as f:
+                return f.read() == self.token
+        except FileNotFoundError:
+            return False
+
+    def heartbeat(self):
+        """Refresh the lease; False when another node has taken it over."""
+        if not self.held():
+            return False
+        os.utime(self.path)
+        return True
+
+    def release(self):
+        if self.held():
+            os.unlink(self.path)
+
+
+def break_lease(path, expire, now):
+    """Remove a lease file whose heartbeat is older than expire seconds at server time now.
+
+    Only one of several nodes breaking it at once succeeds. The file is
+    moved aside before it is checked again: when it turns out to be fresh
+    (another node broke the expired lease and took the chunk since we
+    looked, or the owner's heartbeat came in), it is put back.
+    """
+    stale_path = f"{path}.{uuid.uuid4().hex}.stale"
+    try:
+        os.rename(path, stale_path)
+    except FileNotFoundError:
+        return False
+    try:
+        if now - os.stat(stale_path).st_mtime < expire:
+            try:
+                os.link(stale_path, path)
+            except FileExistsError:
+                pass  # Yet another node has leased it; the owner we moved aside will notice
+            return False
+    finally:
+        os.unlink(stale_path)
+    return True
+
+
+def _lease_age(path, now):
+    try:
+        return now - os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def chunk_states(job_dir, expire, now):
+    """{chunk: "done" | "leased" | "expired" | "pending"} for every chunk of the job."""
+    job = load_job(job_dir)
+    done = {name[:-len(".json")] for name in os.listdir(os.path.join(job_dir, "done")) if name.endswith(".json")}
+    states = {}
+    for chunk in range(job["chunks"]):
+        name = _chunk_name(chunk)
+        if name in done:
+            states[chunk] = "done"
+            continue
+        age = _lease_age(os.path.join(job_dir, "leases", name + ".lease"), now)
+        if age is None:
+            states[chunk] = "pending"
+        else:
+            states[chunk] = "leased" if age < expire else "expired"
+    return states
+
+
+class Node:
+    """Process chunks of a shared job until every chunk has a completion marker.
+
+    Each claimed chunk is fed into one local decode -> segment -> encode
+    pipeline (see batch_pipeline) that lives for the whole run, so the
+    segmenters load once per node. A heartbeat thread keeps the node's
+    leases fresh and every image checks that its chunk is still leased
+    before its outputs are written; once every image of a chunk is done, a
+    completion marker with its counts and failures is written and the
+    lease is released. Chunks of nodes that stopped heartbeating are
+    claimed once their leases expire.
+    """
+
+    def __init__(self, job_dir, name=None, heartbeat=10.0, expire=60.0, log=print, **pipeline_options):
+        self.job_dir = job_dir
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.heartbeat_interval = heartbeat
+        self.expire = expire
+        self.log = log
+        self.pipeline_options = pipeline_options
+        self.lock = threading.Lock()
+        self.chunks = {}  # chunk -> {"lease", "remaining", "failures", "started"}
+        self.processed = 0
+        self.stopped = threading.Event()
+
+    def _finish_image(self, item, error=None):
+        chunk = item["chunk"]
+        with self.lock:
+            state = self.chunks[chunk]
+            state["remaining"] -= 1
+            if error is not None:
+                state["failures"].append([item["path"], error])
+            else:
+                self.processed += 1
+            if state["remaining"] > 0:
+                return
+            del self.chunks[chunk]
+        lease = state["lease"]
+        if not lease.held():
+            self.log(f"chunk {chunk}: lease lost, leaving it to its new owner")
+            return
+        marker = {"node": self.name, "images": state["images"], "failures": state["failures"],
+                  "seconds": round(time.time() - state["started"], 3)}
+        _write_atomic(os.path.join(self.job_dir, "done", _chunk_name(chunk) + ".json"), json.dumps(marker))
+        lease.release()
+        self.log(f"chunk {chunk}: {state['images']} images, {len(state['failures'])} failed")
+
+    def _check_lease(self, item):
+        # Called before an image's outputs are written: a node that lost the chunk leaves it to the new owner
+        with self.lock:
+            lease = self.chunks[item["chunk"]]["lease"]
+        if not lease.held():
+            raise RuntimeError(f"lease of chunk {item['chunk']} lost")
+
+    def _heartbeat(self):
+        while not self.stopped.wait(self.heartbeat_interval):
+            with self.lock:
+                leases = [state["lease"] for state in self.chunks.values()]
+            for lease in leases:
+                if not lease.heartbeat():
+                    self.log(f"chunk {lease.chunk}: lease lost")
+
+    def _claim(self):
+        """Lease the next chunk without a marker or a live lease, or return None."""
+        now = server_time(self.job_dir, self.name)
+        for chunk, state in sorted(chunk_states(self.job_dir, self.expire, now).items()):
+            with self.lock:
+                if chunk in self.chunks:
+                    continue
+            if state == "expired":
+                path = os.path.join(self.job_dir, "leases", _chunk_name(chunk) + ".lease")
+                if break_lease(path, self.expire, now):
+                    self.log(f"chunk {chunk}: reclaimed expired lease")
+            elif state != "pending":
+                continue
+            lease = Lease(self.job_dir, chunk, self.name)
+            if lease.acquire():
+                # Another node may have finished it between the scan and the claim
+                if os.path.exists(os.path.join(self.job_dir, "done", _chunk_name(chunk) + ".json")):
+                    lease.release()
+                    continue
+                return lease
+        return None
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        job = load_job(self.job_dir)
+        pipeline = create_pipeline(job["output_dir"], job["engine"], on_done=self._finish_image,
+                                   on_error=lambda item, message: self._finish_image(item, message),
+                                   before_write=self._check_lease,
+                                   **self.pipeline_options, **job["engine_options"])
+        pipeline.start()
+        heartbeat = threading.Thread(target=self._heartbeat, name="lease-heartbeat", daemon=True)
+        heartbeat.start()
+        try:
+            while not self.stopped.is_set():
+                lease = self._claim()
+                if lease is None:
+                    now = server_time(self.job_dir, self.name)
+                    if all(state == "done" for state in chunk_states(self.job_dir, self.expire, now).values()):
+                        break
+                    # Everything left is leased (possibly by us); wait for it to finish or expire
+                    self.stopped.wait(min(self.heartbeat_interval, 1.0))
+                    continue
+                with open(os.path.join(self.job_dir, "chunks", _chunk_name(lease.chunk) + ".txt")) as f:
+                    paths = [line for line in f.read().splitlines() if line]
+                with self.lock:
+                    self.chunks[lease.chunk] = {"lease": lease, "remaining": len(paths), "images": len(paths),
+                                                "failures": [], "started": time.time()}
+                self.log(f"chunk {lease.chunk}: claimed ({len(paths)} images)")
+                for path in paths:
+                    pipeline.submit(path, chunk=lease.chunk)
+        finally:
+            pipeline.finish()
+            self.stopped.set()
+            heartbeat.join()
+        return self.processed
+
+
+def status(job_dir, expire=60.0, reclaim=False):
+    """Summarise the progress of a job; with reclaim, break the leases of dead nodes."""
+    job = load_job(job_dir)
+    now = server_time(job_dir, "coordinator")
+    states = chunk_states(job_dir, expire, now)
+    lines = []
+    if reclaim:
+        expired = [chunk for chunk, state in states.items() if state == "expired"]
+        broken = sum(break_lease(os.path.join(job_dir, "leases", _chunk_name(chunk) + ".lease"), expire, now)
+                     for chunk in expired)
+        lines.append(f"Reclaimed {broken} expired leases")
+        states = chunk_states(job_dir, expire, now)
+
+    images = failed = 0
+    per_node = {}
+    for path in glob.glob(os.path.join(job_dir, "done", "*.json")):
+        with open(path) as f:
+            marker = json.load(f)
+        images += marker["images"]
+        failed += len(marker["failures"])
+        node = per_node.setdefault(marker["node"], [0, 0])
+        node[0] += 1
+        node[1] += marker["images"]
+
+    counts = {state: 0 for state in ("done", "leased", "expired", "pending")}
+    for state in states.values():
+        counts[state] += 1
+    lines.append(f"{counts['done']}/{job['chunks']} chunks done, {counts['leased']} leased, "
+                 f"{counts['expired']} expired, {counts['pending']} pending")
+    lines.append(f"{images}/{job['images']} images processed, {failed} failed")
+    for chunk, state in sorted(states.items()):
+        if state in ("leased", "expired"):
+            path = os.path.join(job_dir, "leases", _chunk_name(chunk) + ".lease")
+            try:
+                with open(path) as f:
+                    owner = f.read().split()[0]
+            except (FileNotFoundError, IndexError):
+                continue
+            age = _lease_age(path, now)
+            lines.append(f"  chunk {chunk}: {state} by {owner}, heartbeat {age:.0f} s ago"
+                         if age is not None else f"  chunk {chunk}: released")
+    for node, (chunks, count) in sorted(per_node.items()):
+        lines.append(f"  {node}: {chunks} chunks, {count} images")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spread a batch over several machines sharing a filesystem")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    init = commands.add_parser("init", help="Create a job from a list of images")
+    init.add_argument("job_dir")
+    init.add_argument("images", nargs="+")
+    init.add_argument("--output-dir", required=True)
+    init.add_argument("--engine", default="grabcut", choices=sorted(SEGMENTERS))
+    init.add_argument("--chunk-size", type=int, default=100)
+
+    work = commands.add_parser("work", help="Process chunks of a job on this machine")
+    work.add_argument("job_dir")
+    work.add_argument("--node", default=None, help="Node name (default host:pid)")
+    work.add_argument("--heartbeat", type=float, default=10.0)
+    work.add_argument("--expire", type=float, default=60.0, help="Seconds without heartbeat before a lease is dead")
+    work.add_argument("--decode-workers", type=int, default=2)
+    work.add_argument("--segment-workers", type=int, default=1)
+    work.add_argument("--encode-workers", type=int, default=2)
+    work.add_argument("--no-cache", action="store_true")
+    work.add_argument("--metrics-file", default=None, help="Write Prometheus-format metrics here at the end")
+
+    coordinator = commands.add_parser("status", help="Show progress and optionally reclaim dead nodes' chunks")
+    coordinator.add_argument("job_dir")
+    coordinator.add_argument("--expire", type=float, default=60.0)
+    coordinator.add_argument("--reclaim", action="store_true", help="Break expired leases")
+    args = parser.parse_args()
+
+    if args.command == "init":
+        chunks = create_job(args.job_dir, args.images, args.output_dir, args.engine, args.chunk_size)
+        print(f"Created {chunks} chunks in {args.job_dir}")
+    elif args.command == "work":
+        cache = None if args.no_cache else default_cache()
+        metrics.watch_caches(cache)
+        node = Node(args.job_dir, args.node, args.heartbeat, args.expire,
+                    decode_workers=args.decode_workers, segment_workers=args.segment_workers,
+                    encode_workers=args.encode_workers, cache=cache)
+        start = time.perf_counter()
+        count = node.run()
+        print(f"{node.name}: {count} images in {time.perf_counter() - start:.2f} s")
+        if args.metrics_file:
+            metrics.REGISTRY.write(args.metrics_file)
+    else:
+        print(status(args.job_dir, args.expire, args.reclaim))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import mask_format
+import metrics
+
+# Output name -> file suffix
+OUTPUTS = {
+    "cutout": "_cutout.png",     # BGRA, alpha from the mask
+    "mask": "_mask.mask",        # mask_format file
+    "white": "_white.jpg",       # flat white background
+    "thumbnail": "_thumb.jpg",   # downscaled white-background image
+}
+
+
+def alpha_from_mask(mask):
+    """uint8 alpha (0-255) from a 0/1 or float [0, 1] mask."""
+    if mask.dtype == np.uint8 and mask.max(initial=0) <= 1:
+        return mask * np.uint8(255)
+    return np.clip(np.rint(mask.astype(np.float32) * 255), 0, 255).astype(np.uint8)
+
+
+def _write(path, data):
+    # Rename into place so readers never see a partial file; the temporary
+    # name is unique so concurrent writers of the same output never share it
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "xb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+class ExportStage:
+    """Write every configured rendition of one image and mask in a single pass.
+
+    The alpha channel, the foreground condition and the white-background
+    composite are computed once and shared by the outputs that need them
+    (the thumbnail is downscaled from the composite). Encoding and writing
+    run on a thread pool; cv2.imencode releases the GIL, so the outputs of
+    one or several images are encoded in parallel.
+    """
+
+    def __init__(self, outputs=tuple(OUTPUTS), thumbnail_size=256, jpeg_quality=90,
+                 background_color=(255, 255, 255), threshold=0.5, max_workers=None):
+        unknown = set(outputs) - set(OUTPUTS)
+        if unknown:
+            raise ValueError(f"Unknown outputs {sorted(unknown)}, expected some of {list(OUTPUTS)}")
+        self.outputs = tuple(outputs)
+        self.thumbnail_size = thumbnail_size
+        self.jpeg_quality = jpeg_quality
+        self.background_color = background_color
+        self.threshold = threshold
+        self.max_workers = max_workers
+        self.pool = None  # Created on first submit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+
+    def _thumbnail(self, image):
+        height, width = image.shape[:2]
+        scale = self.thumbnail_size / max(height, width)
+        if scale >= 1:
+            return image
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+    def _encode(self, output, array):
+        with metrics.STAGE_SECONDS.time(stage="encode"):
+            if output == "mask":
+                return mask_format.encode(array)
+            if output == "cutout":
+                ok, encoded = cv2.imencode(".png", array, [cv2.IMWRITE_PNG_COMPRESSION, 3])
+            else:
+                ok, encoded = cv2.imencode(".jpg", array, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise ValueError(f"Could not encode {output}")
+        return encoded.tobytes()
+
+    def renditions(self, image, mask):
+        """Return {output: array} for the configured outputs, sharing intermediates."""
+        results = {}
+        alpha = None
+        white = None
+        with metrics.STAGE_SECONDS.time(stage="composite"):
+            if "cutout" in self.outputs or "white" in self.outputs or "thumbnail" in self.outputs:
+                alpha = alpha_from_mask(mask)
+            if "cutout" in self.outputs:
+                results["cutout"] = cv2.merge((*cv2.split(image), alpha))
+            if "white" in self.outputs or "thumbnail" in self.outputs:
+                condition = alpha > round(self.threshold * 255)
+                white = np.empty_like(image)
+                white[:] = self.background_color
+                np.copyto(white, image, where=condition[:, :, None])
+            if "white" in self.outputs:
+                results["white"] = white
+            if "thumbnail" in self.outputs:
+                results["thumbnail"] = self._thumbnail(white)
+        if "mask" in self.outputs:
+            results["mask"] = mask
+        return results
+
+    def submit(self, image, mask, output_dir, name):
+        """Start writing output_dir/<name><suffix> for every output; returns {output: Future of path}."""
+        os.makedirs(output_dir, exist_ok=True)
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = {}
+        for output, array in self.renditions(image, mask).items():
+            path = os.path.join(output_dir, name + OUTPUTS[output])
+            futures[output] = self.pool.submit(lambda o=output, a=array, p=path: _write(p, self._encode(o, a)))
+        return futures
+
+    def export(self, image, mask, output_dir, name):
+        """Write every output and return {output: path}."""
+        return {output: future.result() for output, future in self.submit(image, mask, output_dir, name).items()}
+
+    def encode(self, image, mask):
+        """Return {output: encoded bytes}, encoding on the calling thread."""
+        return {output: self._encode(output, array) for output, array in self.renditions(image, mask).items()}
+
+    def write(self, image, mask, output_dir, name):
+        """Like export(), but encode on the calling thread (for callers with their own workers)."""
+        os.makedirs(output_dir, exist_ok=True)
+        return {output: _write(os.path.join(output_dir, name + OUTPUTS[output]), data)
+                for output, data in self.encode(image, mask).items()}
@@ -1,8 +1,16 @@
 import tkinter as tk
 from tkinter import filedialog, ttk
 import cv2
-from PIL import Image, ImageTk
-import numpy as np
+from canvas_view import show_image, show_line
+from viewport import TilePyramid, Viewport, ZoomPanControls
+from image_loader import ProgressiveLoader
+from pipeline_graph import ProcessingGraph
+from mask_cache import default_cache
+from mask_dedup import default_deduplicator
+from export_stage import ExportStage
+from renditions import AreaPyramid
+import processing
+import os
 import mediapipe as mp
 
 
@@ -14,7 +22,10 @@ class ImageProcessor:
         # Initialize all variables
         self.original_image = None
         self.processed_image = None
+        self.image_path = None
         self.thresholded_image = None
+        self.original_pyramid = None
+        self.thresholded_pyramid = None
         self.max_width = 1920
         self.max_height = 1080
         self.aspect_ratio = 1.0
@@ -29,15 +40,31 @@ class ImageProcessor:
         self.segmenter = self.mp_selfie_segmentation.SelfieSegmentation(model_selection=1)
 
         # Threshold types
-        self.threshold_types = {
-            "Binary": cv2.THRESH_BINARY,
-            "Binary Inverted": cv2.THRESH_BINARY_INV,
-            "Truncate": cv2.THRESH_TRUNC,
-            "To Zero": cv2.THRESH_TOZERO,
-            "To Zero Inverted": cv2.THRESH_TOZERO_INV
-        }
+        self.threshold_types = processing.THRESHOLD_TYPES
         self.current_threshold_type = tk.StringVar(value="Binary")
 
+        # Reduced preview first, full-resolution decode in the background
+        self.loader = ProgressiveLoader(self.root, self.on_preview_loaded, self.on_image_loaded)
+
+        # Masks persist on disk across runs, keyed by pixels and parameters
+        self.mask_cache = default_cache()
+        # Re-encoded or resized copies of an image reuse its mask
+        self.mask_dedup = default_deduplicator()
+
+        # Writes every output of an image in one pass
+        self.exporter = ExportStage()
+
+        # Stages only re-run when their inputs or parameters change
+        self.graph = ProcessingGraph()
+        self.graph.add_source("image")
+        self.graph.add("pyramid", AreaPyramid, ["image"])
+        self.graph.add("resized", processing.resize_image, ["pyramid"], ["width", "height"])
+        self.graph.add("thresholded", processing.threshold_image, ["image"],
+                       ["threshold_value", "max_value", "threshold_type"])
+        self.graph.add("mediapipe_mask", lambda image: processing.mediapipe_mask(
+            image, self.segmenter, cache=self.mask_cache, dedup=self.mask_dedup), ["image"])
+        self.graph.add("mediapipe_result", processing.replace_background, ["image", "mediapipe_mask"])
+
         self.setup_ui()
 
     def setup_ui(self):
@@ -52,6 +79,7 @@ class ImageProcessor:
         # Create notebook for tabs
         self.notebook = ttk.Notebook(self.main_frame)
         self.notebook.grid(row=1, column=0, pady=5, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.notebook.bind('<<NotebookTabChanged>>', lambda e: self.refresh_visible_tab())
 
         # Create tabs
         self.preview_tab = ttk.Frame(self.notebook)
@@ -82,6 +110,8 @@ class ImageProcessor:
 
         self.preview_canvas = tk.Canvas(self.preview_tab, width=400, height=400, bg='lightgray')
         self.preview_canvas.grid(row=1, column=0, padx=5, pady=5)
+        self.preview_view = Viewport(400, 400)
+        ZoomPanControls(self.preview_canvas, self.preview_view, self.update_preview)
 
         self.resolution_label = ttk.Label(self.preview_tab, text="Resolution: -")
         self.resolution_label.grid(row=2, column=0, pady=5)
@@ -163,17 +193,37 @@ class ImageProcessor:
     def resize_image(self):
         if self.original_image is None:
             return
-            
-        new_width = self.width_var.get()
-        new_height = self.height_var.get()
-        
-        # Perform the actual resize using cv2
-        self.processed_image = cv2.resize(self.original_image, (new_width, new_height))
-        
-        # Display the resized image
-        self.display_image(self.processed_image, self.resized_canvas, 300)
+
+        self.graph.set_params(width=self.width_var.get(), height=self.height_var.get())
+        self.refresh_visible_tab()
+
+    def refresh_visible_tab(self):
+        """Pull the outputs the visible tab shows from the graph, computing only stale stages."""
+        if self.original_image is None:
+            return
+        current = self.notebook.select()
+
+        if current == str(self.resize_tab):
+            self.processed_image = self.graph.get("resized")
+            self.display_image(self.processed_image, self.resized_canvas, 300)
+
+        elif current in (str(self.threshold_tab), str(self.comparison_tab)):
+            thresholded = self.graph.get("thresholded")
+            if thresholded is not self.thresholded_image:
+                self.thresholded_image = thresholded
+                self.thresholded_pyramid = TilePyramid(self.thresholded_image)
+                self.display_image(self.thresholded_image, self.threshold_result_canvas, 300)
+            self.update_comparison()
+
+        elif current == str(self.mediapipe_tab):
+            self.apply_mediapipe()
 
     def save_image(self):
+        # Both save buttons share this method; save what the visible tab shows
+        if self.notebook.select() == str(self.mediapipe_tab):
+            self.processed_image = self.graph.get("mediapipe_result")
+        else:
+            self.processed_image = self.graph.get("resized")
         if self.processed_image is None:
             return
             
@@ -247,27 +297,17 @@ class ImageProcessor:
     def apply_threshold(self):
         if self.original_image is None:
             return
-            
-        if len(self.original_image.shape) == 3:
-            gray = cv2.cvtColor(self.original_image, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = self.original_image
-            
-        _, self.thresholded_image = cv2.threshold(
-            gray,
-            self.threshold_value.get(),
-            self.max_value.get(),
-            self.threshold_types[self.current_threshold_type.get()]
+
+        self.graph.set_params(
+            threshold_value=self.threshold_value.get(),
+            max_value=self.max_value.get(),
+            threshold_type=self.current_threshold_type.get()
         )
-        
-        if len(self.original_image.shape) == 3:
-            self.thresholded_image = cv2.cvtColor(self.thresholded_image, cv2.COLOR_GRAY2BGR)
-            
-        self.display_image(self.thresholded_image, self.threshold_result_canvas, 300)
-        self.update_comparison()
+        self.refresh_visible_tab()
 
         
     def save_threshold_image(self):
+        self.thresholded_image = self.graph.get("thresholded")
         if self.thresholded_image is None:
             return
         file_path = filedialog.asksaveasfilename(
@@ -280,40 +320,36 @@ class ImageProcessor:
     def update_comparison(self, *args):
         if self.original_image is None or self.thresholded_image is None:
             return
-        canvas_width = self.comparison_canvas.winfo_width()
-        canvas_height = self.comparison_canvas.winfo_height()
+        canvas_width = self.comparison_view.width
+        canvas_height = self.comparison_view.height
         split_position = int((self.comparison_value.get() / 100) * canvas_width)
         
-        original_display = self.prepare_image_for_display(self.original_image, canvas_width, canvas_height)
-        thresholded_display = self.prepare_image_for_display(self.thresholded_image, canvas_width, canvas_height)
+        # Both sides come from the same zoomed region of their pyramids
+        original_display = self.comparison_view.render(self.original_pyramid)
+        thresholded_display = self.comparison_view.render(self.thresholded_pyramid)
         
-        combined = np.copy(original_display)
+        combined = original_display
         combined[:, split_position:] = thresholded_display[:, split_position:]
+        combined = cv2.cvtColor(combined, cv2.COLOR_BGR2RGB)
         
-        photo = ImageTk.PhotoImage(Image.fromarray(combined))
-        self.comparison_canvas.delete("all")
-        self.comparison_canvas.create_image(canvas_width//2, canvas_height//2, image=photo, anchor=tk.CENTER)
-        self.comparison_canvas.image = photo
-        self.comparison_canvas.create_line(split_position, 0, split_position, canvas_height, fill='white', width=2)
+        # Update the comparison view in place
+        show_image(self.comparison_canvas, combined, canvas_width//2, canvas_height//2)
+        show_line(self.comparison_canvas, "split", split_position, 0, split_position, canvas_height, fill='white', width=2)
 
     def on_comparison_drag(self, event):
-        canvas_width = self.comparison_canvas.winfo_width()
+        canvas_width = self.comparison_view.width
         value = max(0, min(100, (event.x / canvas_width) * 100))
         self.comparison_value.set(value)
         self.update_comparison()
 
-    def prepare_image_for_display(self, image, canvas_width, canvas_height):
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        height, width = image_rgb.shape[:2]
-        scale = min(canvas_width/width, canvas_height/height)
-        new_width = int(width * scale)
-        new_height = int(height * scale)
-        resized = cv2.resize(image_rgb, (new_width, new_height))
-        display = np.zeros((canvas_height, canvas_width, 3), dtype=np.uint8)
-        y_offset = (canvas_height - new_height) // 2
-        x_offset = (canvas_width - new_width) // 2
-        display[y_offset:y_offset+new_height, x_offset:x_offset+new_width] = resized
-        return display
+    def render_view(self, view, pyramid, canvas):
+        if pyramid is None:
+            return
+        display = cv2.cvtColor(view.render(pyramid), cv2.COLOR_BGR2RGB)
+        show_image(canvas, display, view.width//2, view.height//2)
+
+    def update_preview(self):
+        self.render_view(self.preview_view, self.original_pyramid, self.preview_canvas)
 
 
     def setup_comparison_tab(self):
@@ -322,6 +358,8 @@ class ImageProcessor:
 
         self.comparison_canvas = tk.Canvas(self.comparison_frame, width=600, height=400, bg='lightgray')
         self.comparison_canvas.grid(row=0, column=0, padx=5, pady=5)
+        self.comparison_view = Viewport(600, 400)
+        ZoomPanControls(self.comparison_canvas, self.comparison_view, self.update_comparison)
 
         self.comparison_slider = ttk.Scale(
             self.comparison_frame,
@@ -346,6 +384,8 @@ class ImageProcessor:
         self.mediapipe_result_canvas.grid(row=1, column=1, padx=5, pady=5)
         self.save_btn = ttk.Button(controls_frame, text="Save Image", command=self.save_image)
         self.save_btn.grid(row=3, column=0, columnspan=3, pady=10)
+        export_btn = ttk.Button(controls_frame, text="Export All", command=self.export_mediapipe)
+        export_btn.grid(row=4, column=0, columnspan=3, pady=5)
 
     # ---------- MediaPipe Methods ----------
     def apply_mediapipe(self):
@@ -353,19 +393,21 @@ class ImageProcessor:
         if self.original_image is None:
             return
 
-        # Convert to RGB for MediaPipe
-        img_rgb = cv2.cvtColor(self.original_image, cv2.COLOR_BGR2RGB)
-        result = self.segmenter.process(img_rgb)
-        mask = result.segmentation_mask > 0.5
-
-        # Replace background with white
-        bg_color = (255, 255, 255)  # White background
-        bg_image = np.zeros(self.original_image.shape, dtype=np.uint8)
-        bg_image[:] = bg_color
-
-        self.processed_image = np.where(mask[:, :, None], self.original_image, bg_image)
+        # Segmentation and white background, reused until a new image is loaded
+        self.processed_image = self.graph.get("mediapipe_result")
         self.display_image(self.processed_image, self.mediapipe_result_canvas, 300)
 
+    def export_mediapipe(self):
+        """Write the cutout, mask, white-background image and thumbnail in one pass."""
+        mask = self.graph.get("mediapipe_mask")
+        if mask is None:
+            return
+        output_dir = filedialog.askdirectory()
+        if output_dir:
+            name = os.path.splitext(os.path.basename(self.image_path))[0]
+            for path in self.exporter.export(self.original_image, mask, output_dir, name).values():
+                print(f"Saved {path}")
+
     # The rest of the methods (load_image, resize_image, display_image, etc.) remain unchanged.
 
     def load_image(self):
@@ -373,30 +415,46 @@ class ImageProcessor:
             filetypes=[("Image files", "*.png *.jpg *.jpeg *.bmp *.gif *.tiff")]
     )
         if file_path:
-            self.original_image = cv2.imread(file_path)
-            if self.original_image is not None:
+            self.image_path = file_path
+            self.loader.load(file_path)
+
+    def on_preview_loaded(self, preview, full_size):
+        width, height = full_size
+        self.preview_view.fit(preview.shape[1], preview.shape[0])
+        self.render_view(self.preview_view, TilePyramid(preview), self.preview_canvas)
+        self.resolution_label.config(text=f"Resolution: {width}x{height} (loading...)")
+
+    def on_image_loaded(self, image):
+        self.original_image = image
+        if self.original_image is not None:
             # Calculate aspect ratio
-                height, width = self.original_image.shape[:2]
-                self.aspect_ratio = width / height
-            
+            height, width = self.original_image.shape[:2]
+            self.aspect_ratio = width / height
+
+            self.graph.set_source("image", self.original_image)
+
+            # Zoomable views share one tiled pyramid of the original
+            self.original_pyramid = TilePyramid(self.original_image)
+            self.preview_view.fit(width, height)
+            self.comparison_view.fit(width, height)
+
             # Update all displays
-                self.display_image(self.original_image, self.preview_canvas, 400)
-                self.display_image(self.original_image, self.original_canvas, 300)
-                self.display_image(self.original_image, self.mediapipe_original_canvas, 300)
-                self.display_image(self.original_image, self.threshold_original_canvas, 300)
-            
-                self.resolution_label.config(text=f"Resolution: {width}x{height}")
-            
+            self.update_preview()
+            self.display_image(self.original_image, self.original_canvas, 300)
+            self.display_image(self.original_image, self.mediapipe_original_canvas, 300)
+            self.display_image(self.original_image, self.threshold_original_canvas, 300)
+
+            self.resolution_label.config(text=f"Resolution: {width}x{height}")
+
             # Update sliders
-                self.width_var.set(width)
-                self.height_var.set(height)
-                self.width_label.config(text=str(width))
-                self.height_label.config(text=str(height))
-            
-            # Process images
-                self.resize_image()
-                self.apply_threshold()
-                self.apply_mediapipe()
+            self.width_var.set(width)
+            self.height_var.set(height)
+            self.width_label.config(text=str(width))
+            self.height_label.config(text=str(height))
+
+            # Derived images are computed when their tab is shown
+            self.resize_image()
+            self.apply_threshold()
 
     def display_image(self, image, canvas, max_size):
         """Display an image on a given canvas with resizing."""
@@ -408,10 +466,8 @@ class ImageProcessor:
         new_width = int(width * scale)
         new_height = int(height * scale)
         resized_image = cv2.resize(image_rgb, (new_width, new_height))
-        photo = ImageTk.PhotoImage(Image.fromarray(resized_image))
-        canvas.delete("all")
-        canvas.create_image(max_size // 2, max_size // 2, image=photo, anchor=tk.CENTER)
-        canvas.image = photo
+        # Reuse the canvas' PhotoImage and image item
+        show_image(canvas, resized_image, max_size // 2, max_size // 2)
 
 
 if __name__ == "__main__":
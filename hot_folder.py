@@ -0,0 +1,272 @@
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import shutil
+import signal
+import struct
+import threading
+import time
+
+import metrics
+from batch_pipeline import SEGMENTERS, create_pipeline
+from export_stage import OUTPUTS
+from mask_cache import default_cache
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+
+class InotifyWatcher:
+    """Report names written or moved into a directory, using Linux inotify through libc."""
+
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO
+        if self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"Cannot watch {directory}")
+
+    def changes(self, timeout):
+        """Wait up to timeout seconds and return the names that changed."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        names = set()
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Report names whose size or modification time changed since the last scan.
+
+    Used where inotify is missing, and for network shares, where changes
+    made by other machines do not raise inotify events.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.seen = {}
+
+    def changes(self, timeout):
+        time.sleep(timeout)
+        current = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    current[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        changed = {name for name, signature in current.items() if self.seen.get(name) != signature}
+        self.seen = current
+        return changed
+
+    def close(self):
+        pass
+
+
+class HotFolder:
+    """Watch a directory and remove the background of every image dropped into it.
+
+    A file is treated as complete once its size and modification time have
+    not changed for settle seconds, so copies still in progress are left
+    alone. Complete files go through the decode -> segment -> encode
+    pipeline; outputs are written under a temporary name and renamed into
+    output_dir, so consumers never see partial files. Inputs are moved to
+    done_dir (or failed_dir) when given; otherwise a file is skipped while
+    its outputs are newer than it. The latency from first seeing a file to
+    its outputs being in place is logged per file and summarised.
+    """
+
+    def __init__(self, input_dir, output_dir, engine="grabcut", settle=1.0, poll_interval=0.5,
+                 use_inotify=True, done_dir=None, failed_dir=None, extensions=IMAGE_EXTENSIONS,
+                 log=print, **pipeline_options):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.done_dir = done_dir
+        self.failed_dir = failed_dir
+        self.extensions = extensions
+        self.log = log
+        self.pending = {}  # name -> [first seen, last change, (size, mtime)]
+        self.in_flight = set()
+        self.latencies = []
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+        os.makedirs(output_dir, exist_ok=True)
+        self.watcher = None
+        if use_inotify:
+            try:
+                self.watcher = InotifyWatcher(input_dir)
+            except (OSError, AttributeError) as e:
+                self.log(f"inotify unavailable ({e}), polling every {poll_interval} s")
+        if self.watcher is None:
+            self.watcher = PollingWatcher(input_dir)
+
+        self.pipeline = create_pipeline(output_dir, engine, on_done=self._done, on_error=self._failed,
+                                        **pipeline_options)
+
+    def _wanted(self, name):
+        return name.lower().endswith(self.extensions) and not name.startswith(".")
+
+    def _up_to_date(self, name):
+        # Outputs newer than the input mean it was handled by an earlier run
+        stem = os.path.splitext(name)[0]
+        marker = os.path.join(self.output_dir, stem + OUTPUTS["mask"])
+        try:
+            return os.path.getmtime(marker) >= os.path.getmtime(os.path.join(self.input_dir, name))
+        except OSError:
+            return False
+
+    def _signature(self, name):
+        try:
+            stat = os.stat(os.path.join(self.input_dir, name))
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _note_changes(self, names, now):
+        for name in names:
+            if not self._wanted(name) or name in self.in_flight:
+                continue
+            entry = self.pending.setdefault(name, [now, now, None])
+            entry[1] = now
+
+    def _ready(self, now):
+        """Names whose size and mtime stayed the same for settle seconds."""
+        ready = []
+        for name, entry in list(self.pending.items()):
+            signature = self._signature(name)
+            if signature is None:
+                del self.pending[name]  # Removed or renamed away
+            elif signature != entry[2]:
+                entry[1] = now
+                entry[2] = signature
+            elif now - entry[1] >= self.settle and signature[0] > 0:
+                del self.pending[name]
+                if not self._up_to_date(name):
+                    ready.append((name, entry[0]))
+        return ready
+
+    def _move_input(self, item, directory):
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            shutil.move(item["path"], os.path.join(directory, os.path.basename(item["path"])))
+
+    def _done(self, item):
+        latency = time.time() - item["seen"]
+        with self.lock:
+            self.latencies.append(latency)
+            self.in_flight.discard(os.path.basename(item["path"]))
+        self._move_input(item, self.done_dir)
+        self.log(f"{os.path.basename(item['path'])}: done in {latency:.2f} s")
+
+    def _failed(self, item, message):
+        with self.lock:
+            self.failures += 1
+            self.in_flight.discard(os.path.basename(item["path"]))
+        self._move_input(item, self.failed_dir)
+        self.log(f"{os.path.basename(item['path'])}: failed ({message})")
+
+    def summary(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            failures = self.failures
+        if not latencies:
+            return f"0 files processed, {failures} failed"
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return (f"{len(latencies)} files processed, {failures} failed, "
+                f"latency p50 {p50:.2f} s, p95 {p95:.2f} s, max {latencies[-1]:.2f} s")
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        """Process files until stop() is called."""
+        self.pipeline.start()
+        # Files already waiting when the watcher starts
+        self._note_changes(os.listdir(self.input_dir), time.time())
+        try:
+            while not self.stopped.is_set():
+                names = self.watcher.changes(self.poll_interval)
+                now = time.time()
+                self._note_changes(names, now)
+                for name, seen in self._ready(now):
+                    with self.lock:
+                        self.in_flight.add(name)
+                    self.pipeline.submit(os.path.join(self.input_dir, name), seen=seen)
+        finally:
+            self.pipeline.finish()
+            self.watcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove backgrounds from images dropped into a folder")
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--engine", default="grabcut", choices=sorted(SEGMENTERS))
+    parser.add_argument("--settle", type=float, default=1.0, help="Seconds a file must stay unchanged")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--poll", action="store_true", help="Poll instead of inotify (network shares)")
+    parser.add_argument("--done-dir", default=None, help="Move processed inputs here")
+    parser.add_argument("--failed-dir", default=None, help="Move inputs that failed here")
+    parser.add_argument("--decode-workers", type=int, default=1)
+    parser.add_argument("--segment-workers", type=int, default=1)
+    parser.add_argument("--encode-workers", type=int, default=1)
+    parser.add_argument("--metrics-file", default=None, help="Write Prometheus-format metrics here when stopped")
+    args = parser.parse_args()
+
+    cache = default_cache()
+    metrics.watch_caches(cache)
+    folder = HotFolder(args.input_dir, args.output_dir, args.engine, args.settle, args.poll_interval,
+                       not args.poll, args.done_dir, args.failed_dir, cache=cache,
+                       decode_workers=args.decode_workers, segment_workers=args.segment_workers,
+                       encode_workers=args.encode_workers)
+    signal.signal(signal.SIGTERM, lambda *_: folder.stop())
+    print(f"Watching {args.input_dir}, Ctrl+C to stop")
+    try:
+        folder.run()
+    except KeyboardInterrupt:
+        folder.stop()
+    finally:
+        if args.metrics_file:
+            metrics.REGISTRY.write(args.metrics_file)
+    print(folder.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 import tkinter as tk
 from tkinter import filedialog, ttk
 import cv2
-from PIL import Image, ImageTk
+from canvas_view import show_image
+from renditions import resize
 
 class ImageProcessor:
     def __init__(self, root):
@@ -186,8 +187,8 @@ class ImageProcessor:
         new_width = self.width_var.get()
         new_height = self.height_var.get()
         
-        # Perform the actual resize using cv2
-        self.processed_image = cv2.resize(self.original_image, (new_width, new_height))
+        # Area averaging to shrink, bicubic/Lanczos to enlarge
+        self.processed_image = resize(self.original_image, new_width, new_height)
         
         # Display the resized image
         self.display_image(self.processed_image, self.resized_canvas, 300)
@@ -218,18 +219,8 @@ class ImageProcessor:
         
         display_image = cv2.resize(image_rgb, (display_width, display_height))
         
-        # Convert to PhotoImage
-        photo = ImageTk.PhotoImage(Image.fromarray(display_image))
-        
-        # Update canvas
-        canvas.delete("all")
-        canvas.create_image(
-            max_size//2,
-            max_size//2,
-            image=photo,
-            anchor=tk.CENTER
-        )
-        canvas.image = photo  # Keep a reference to prevent garbage collection
+        # Reuse the canvas' PhotoImage and image item
+        show_image(canvas, display_image, max_size//2, max_size//2)
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,103 @@
+import queue
+import threading
+
+import cv2
+from PIL import Image
+
+# cv2.imread flags that let the JPEG decoder downscale in the DCT domain
+REDUCED_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def read_image_size(file_path):
+    """Return (width, height) from the file header without decoding pixels."""
+    try:
+        with Image.open(file_path) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+def choose_reduction(width, height, target_width, target_height):
+    """Pick the largest decoder reduction that still covers the target size."""
+    for factor in (8, 4, 2):
+        if width // factor >= target_width and height // factor >= target_height:
+            return factor
+    return 1
+
+
+def decode_reduced(file_path, max_size):
+    """Decode an image so that its longest side is at least max_size, as cheaply as possible."""
+    size = read_image_size(file_path)
+    if size is None:
+        return cv2.imread(file_path)
+    width, height = size
+    scale = max_size / max(width, height)
+    factor = choose_reduction(width, height, int(width * scale), int(height * scale))
+    return cv2.imread(file_path, REDUCED_COLOR_FLAGS[factor])
+
+
+def decode_at_size(file_path, width, height):
+    """Decode an image at exactly (width, height), letting the decoder do most of the downscale."""
+    size = read_image_size(file_path)
+    factor = choose_reduction(size[0], size[1], width, height) if size else 1
+    image = cv2.imread(file_path, REDUCED_COLOR_FLAGS[factor])
+    if image is None:
+        return None
+    if image.shape[1] == width and image.shape[0] == height:
+        return image
+    interpolation = cv2.INTER_AREA if image.shape[1] > width else cv2.INTER_CUBIC
+    return cv2.resize(image, (width, height), interpolation=interpolation)
+
+
+class ProgressiveLoader:
+    """Show a reduced decode immediately and deliver the full decode from a background thread.
+
+    Both callbacks run on the Tk main loop: on_preview(preview, (width, height))
+    as soon as the reduced image is decoded, on_loaded(image) once the
+    full-resolution decode finishes (image is None if decoding failed).
+    """
+
+    def __init__(self, root, on_preview, on_loaded, preview_size=400, poll_ms=30):
+        self.root = root
+        self.on_preview = on_preview
+        self.on_loaded = on_loaded
+        self.preview_size = preview_size
+        self.poll_ms = poll_ms
+        self.results = queue.Queue()
+        self.generation = 0
+
+    def load(self, file_path):
+        # Results from an earlier, slower load are dropped
+        self.generation += 1
+        generation = self.generation
+
+        size = read_image_size(file_path)
+        if size is not None:
+            preview = decode_reduced(file_path, self.preview_size)
+            if preview is not None:
+                self.on_preview(preview, size)
+
+        thread = threading.Thread(target=self._decode_full, args=(file_path, generation), daemon=True)
+        thread.start()
+        self.root.after(self.poll_ms, self._poll)
+
+    def cancel(self):
+        """Drop the result of any load still in flight."""
+        self.generation += 1
+
+    def _decode_full(self, file_path, generation):
+        self.results.put((generation, cv2.imread(file_path)))
+
+    def _poll(self):
+        try:
+            generation, image = self.results.get_nowait()
+        except queue.Empty:
+            self.root.after(self.poll_ms, self._poll)
+            return
+        if generation == self.generation:
+            self.on_loaded(image)
@@ -3,7 +3,7 @@ import tkinter as tk
 from tkinter import filedialog, ttk
 import cv2
 import numpy as np
-from PIL import Image, ImageTk
+from canvas_view import show_image
 
 class ImageProcessor:
     def __init__(self, root):
@@ -114,12 +114,8 @@ class ImageProcessor:
         
         resized = cv2.resize(image_rgb, (new_width, new_height))
       
-        photo = ImageTk.PhotoImage(Image.fromarray(resized))
-        
-        
-        canvas.delete("all")
-        canvas.create_image(max_size//2, max_size//2, image=photo, anchor=tk.CENTER)
-        canvas.image = photo  # Keep a reference to prevent garbage collection
+        # Reuse the canvas' PhotoImage and image item
+        show_image(canvas, resized, max_size//2, max_size//2)
 
 if __name__ == "__main__":
     root = tk.Tk()
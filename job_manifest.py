@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    path TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease_expires REAL,
+    params TEXT,
+    outputs TEXT,
+    error TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (status);
+"""
+
+STATUSES = ("pending", "running", "done", "failed")
+
+
+def default_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobManifest:
+    """Per-image progress of a batch job in an SQLite file.
+
+    Every image is a row with its status (pending, running, done, failed),
+    the number of attempts, the engine parameters and output paths of a
+    finished image, and the last error. Workers claim pending images under
+    a lease that they renew while working; images whose lease ran out
+    (their worker died) and failed images with fewer than max_attempts
+    attempts are claimed again. Claims run in an immediate transaction, so
+    several threads or processes can share one manifest. A restarted job
+    only reads the images that are not done; when it is given different
+    params, images done under the old ones go back to pending.
+    """
+
+    def __init__(self, path, params=None, max_attempts=3, lease_seconds=120.0):
+        self.path = path
+        self.params = json.dumps(params or {}, sort_keys=True)
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        # Autocommit; transactions are opened explicitly where needed
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+        self.requeued = 0
+        if params is not None:
+            self.requeued = self._transaction(lambda db: db.execute(
+                "UPDATE items SET status = 'pending', attempts = 0, outputs = NULL"
+                " WHERE status = 'done' AND params IS NOT ?", (self.params,)).rowcount)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _transaction(self, statements):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self.db)
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return result
+
+    def add(self, paths):
+        """Add images not yet in the manifest; returns how many were new."""
+        def insert(db):
+            before = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO items (path, updated) VALUES (?, ?)",
+                           ((path, time.time()) for path in paths))
+            return db.total_changes - before
+        return self._transaction(insert)
+
+    def claim(self, owner, limit=32):
+        """Lease up to limit images to owner and return their paths."""
+        def take(db):
+            now = time.time()
+            rows = db.execute(
+                "SELECT path FROM items WHERE status = 'pending'"
+                " OR (status = 'failed' AND attempts < ?)"
+                " OR (status = 'running' AND lease_expires < ?) LIMIT ?",
+                (self.max_attempts, now, limit)).fetchall()
+            paths = [row[0] for row in rows]
+            db.executemany(
+                "UPDATE items SET status = 'running', owner = ?, lease_expires = ?,"
+                " attempts = attempts + 1, updated = ? WHERE path = ?",
+                ((owner, now + self.lease_seconds, now, path) for path in paths))
+            return paths
+        return self._transaction(take)
+
+    def renew(self, owner):
+        """Extend the leases of every image owner is still working on."""
+        now = time.time()
+        with self.lock:
+            self.db.execute("UPDATE items SET lease_expires = ? WHERE owner = ? AND status = 'running'",
+                            (now + self.lease_seconds, owner))
+
+    def complete(self, path, outputs, owner):
+        """Mark an image owner leased as done; False if the lease was lost to another worker."""
+        with self.lock:
+            return self.db.execute(
+                "UPDATE items SET status = 'done', owner = NULL, lease_expires = NULL, params = ?,"
+                " outputs = ?, error = NULL, updated = ? WHERE path = ? AND owner = ? AND status = 'running'",
+                (self.params, json.dumps(outputs), time.time(), path, owner)).rowcount == 1
+
+    def fail(self, path, error, owner):
+        """Mark an image owner leased as failed; False if the lease was lost to another worker."""
+        with self.lock:
+            return self.db.execute(
+                "UPDATE items SET status = 'failed', owner = NULL, lease_expires = NULL, error = ?,"
+                " updated = ? WHERE path = ? AND owner = ? AND status = 'running'",
+                (error, time.time(), path, owner)).rowcount == 1
+
+    def reclaim(self, owner=None):
+        """Return running images (of owner, or all) to pending, e.g. after a crash."""
+        with self.lock:
+            if owner is None:
+                cursor = self.db.execute("UPDATE items SET status = 'pending', owner = NULL,"
+                                         " lease_expires = NULL WHERE status = 'running'")
+            else:
+                cursor = self.db.execute("UPDATE items SET status = 'pending', owner = NULL,"
+                                         " lease_expires = NULL WHERE status = 'running' AND owner = ?", (owner,))
+            return cursor.rowcount
+
+    def reclaim_dead_local(self):
+        """Reclaim the leases of processes on this host that no longer exist.
+
+        Lets a restarted job continue at once instead of waiting for the
+        leases of the crashed run to expire.
+        """
+        host = socket.gethostname()
+        with self.lock:
+            owners = [row[0] for row in self.db.execute(
+                "SELECT DISTINCT owner FROM items WHERE status = 'running'")]
+        reclaimed = 0
+        for owner in owners:
+            owner_host, _, pid = (owner or "").rpartition(":")
+            if owner_host != host or not pid.isdigit():
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                reclaimed += self.reclaim(owner)
+            except PermissionError:
+                pass  # Alive, owned by another user
+        return reclaimed
+
+    def counts(self):
+        with self.lock:
+            rows = self.db.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall()
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(rows)
+        return counts
+
+    def failures(self):
+        """(path, attempts, error) of images that failed max_attempts times."""
+        with self.lock:
+            return self.db.execute("SELECT path, attempts, error FROM items WHERE status = 'failed'"
+                                   " AND attempts >= ? ORDER BY path", (self.max_attempts,)).fetchall()
+
+    # Callbacks for batch_pipeline.create_pipeline; process() submits each item with its owner.
+    # An image whose lease was taken over keeps the other worker's result.
+    def item_done(self, item):
+        self.complete(item["path"], item["outputs"], item["owner"])
+
+    def item_failed(self, item, message):
+        self.fail(item["path"], message, item["owner"])
+
+
+def process(manifest, pipeline, owner=None, batch_size=32):
+    """Feed every claimable image of manifest through a started pipeline, then finish it.
+
+    The pipeline must report back through manifest.item_done/item_failed.
+    Leases are renewed in the background while images are in flight. When
+    nothing is left to claim but other workers still hold leases, waits for
+    them to finish or expire so images of dead workers are picked up.
+    """
+    owner = owner or default_owner()
+    manifest.reclaim_dead_local()
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(manifest.lease_seconds / 3):
+            manifest.renew(owner)
+
+    renewer = threading.Thread(target=heartbeat, name="manifest-heartbeat", daemon=True)
+    renewer.start()
+    try:
+        while True:
+            paths = manifest.claim(owner, batch_size)
+            if paths:
+                for path in paths:
+                    pipeline.submit(path, owner=owner)
+                continue
+            if manifest.counts()["running"] == 0:
+                break
+            # Ours may still fail and be retried; other workers' leases are renewed or run out
+            time.sleep(1.0)
+    finally:
+        pipeline.finish()
+        stop.set()
+        renewer.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or repair a batch job manifest")
+    parser.add_argument("manifest")
+    parser.add_argument("--reclaim", action="store_true", help="Return all running images to pending")
+    parser.add_argument("--max-attempts", type=int, default=3)
+    args = parser.parse_args()
+
+    manifest = JobManifest(args.manifest, max_attempts=args.max_attempts)
+    if args.reclaim:
+        print(f"Reclaimed {manifest.reclaim()} images")
+    counts = manifest.counts()
+    total = sum(counts.values())
+    print(f"{counts['done']}/{total} done, " + ", ".join(f"{counts[s]} {s}" for s in STATUSES if s != "done"))
+    for path, attempts, error in manifest.failures():
+        print(f"Gave up on {path} after {attempts} attempts: {error}")
+
+
+if __name__ == "__main__":
+    main()
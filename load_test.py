@@ -0,0 +1,76 @@
+import argparse
+import http.client
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlencode, urlparse
+
+
+def run_load(url, body, concurrency=8, duration=10.0, params=None):
+    """POST body from concurrency clients for duration seconds; returns (statuses, latencies, elapsed)."""
+    target = urlparse(url)
+    path = target.path + ("?" + urlencode(params) if params else "")
+    statuses = Counter()
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=120)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request("POST", path, body, {"Content-Type": "application/octet-stream"})
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+                if response.getheader("Connection", "").lower() == "close":
+                    connection.close()
+            except (OSError, http.client.HTTPException) as e:
+                status = type(e).__name__
+                connection.close()
+            latency = time.perf_counter() - start
+            with lock:
+                statuses[status] += 1
+                if status == 200:
+                    latencies.append(latency)
+        connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses, sorted(latencies), time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the background removal service")
+    parser.add_argument("image")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/remove-background")
+    parser.add_argument("--engine", default=None)
+    parser.add_argument("--output", default="cutout")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        body = f.read()
+    params = {"output": args.output}
+    if args.engine:
+        params["engine"] = args.engine
+    statuses, latencies, elapsed = run_load(args.url, body, args.concurrency, args.duration, params)
+    ok = statuses.get(200, 0)
+    print(f"{sum(statuses.values())} requests in {elapsed:.1f} s with {args.concurrency} clients")
+    print(f"{ok / elapsed:.1f} successful requests/s; statuses: {dict(statuses)}")
+    print(f"latency p50 {percentile(latencies, 0.5) * 1000:.0f} ms, p95 {percentile(latencies, 0.95) * 1000:.0f} ms,"
+          f" p99 {percentile(latencies, 0.99) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
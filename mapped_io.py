@@ -0,0 +1,340 @@
+import argparse
+import struct
+
+import numpy as np
+
+import processing
+
+# TIFF field type -> size in bytes
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 16: 8, 17: 8, 18: 8}
+TIFF_TYPE_CODES = {1: "B", 3: "H", 4: "I", 16: "Q"}
+
+# SampleFormat -> numpy kind
+SAMPLE_KINDS = {1: "u", 2: "i", 3: "f"}
+
+
+class _Block:
+    """One strip or tile: where its samples live in the file and which pixels they cover."""
+
+    def __init__(self, offset, y, x, rows, width, channels, plane):
+        self.offset = offset
+        self.y = y
+        self.x = x
+        self.rows = rows  # Rows stored (tiles are padded to the full tile)
+        self.width = width  # Columns stored
+        self.channels = channels
+        self.plane = plane  # First channel held by the block
+
+
+class MappedImage:
+    """Pixels of an uncompressed TIFF or raw file, read and written through np.memmap.
+
+    Rows are mapped only for as long as a call needs them, so working over
+    a multi-gigabyte file in strips keeps a small, fixed resident set.
+    Three-channel data is stored RGB and exposed BGR like cv2.imread.
+    """
+
+    def __init__(self, path, width, height, channels, dtype, blocks, contiguous_offset=None, writable=False, rgb=True):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.dtype = np.dtype(dtype)
+        self.blocks = blocks
+        self.contiguous_offset = contiguous_offset  # Interleaved rows back to back from here
+        self.mode = "r+" if writable else "r"
+        self.rgb = rgb and channels in (3, 4)
+
+    @property
+    def shape(self):
+        if self.channels == 1:
+            return self.height, self.width
+        return self.height, self.width, self.channels
+
+    @property
+    def nbytes(self):
+        return self.height * self.width * self.channels * self.dtype.itemsize
+
+    def _map(self, offset, shape, mode=None):
+        return np.memmap(self.path, dtype=self.dtype, mode=mode or self.mode, offset=offset, shape=shape)
+
+    def _to_bgr(self, rows):
+        if self.rgb:
+            rows = rows[..., [2, 1, 0] + list(range(3, self.channels))]
+        return rows if self.channels > 1 else rows[..., 0]
+
+    def read_rows(self, y0, y1):
+        """Return rows y0 .. y1 as an in-memory array (BGR for colour images)."""
+        y1 = min(y1, self.height)
+        row_samples = self.width * self.channels
+        if self.contiguous_offset is not None:
+            offset = self.contiguous_offset + y0 * row_samples * self.dtype.itemsize
+            mapped = self._map(offset, (y1 - y0, self.width, self.channels), "r")
+            rows = np.array(mapped)
+            del mapped
+            return self._to_bgr(rows)
+
+        rows = np.empty((y1 - y0, self.width, self.channels), dtype=self.dtype)
+        for block in self.blocks:
+            top = max(y0, block.y)
+            bottom = min(y1, block.y + block.rows)
+            if top >= bottom:
+                continue
+            mapped = self._map(block.offset, (block.rows, block.width, block.channels), "r")
+            right = min(block.x + block.width, self.width)
+            rows[top - y0:bottom - y0, block.x:right, block.plane:block.plane + block.channels] = \
+                mapped[top - block.y:bottom - block.y, :right - block.x]
+            del mapped
+        return self._to_bgr(rows)
+
+    def write_rows(self, y0, rows):
+        """Write rows starting at y0 (BGR for colour images) straight into the file."""
+        if self.contiguous_offset is None:
+            raise ValueError("Only contiguous images can be written in place")
+        rows = np.asarray(rows).reshape(rows.shape[0], self.width, self.channels)
+        if self.rgb:
+            rows = rows[..., [2, 1, 0] + list(range(3, self.channels))]
+        offset = self.contiguous_offset + y0 * self.width * self.channels * self.dtype.itemsize
+        mapped = self._map(offset, rows.shape)
+        mapped[:] = rows
+        mapped.flush()
+        del mapped
+
+    def memmap(self):
+        """The whole image as one np.memmap in stored channel order (RGB), e.g. as tiled_resize's out."""
+        if self.contiguous_offset is None:
+            raise ValueError("Only contiguous images map as a single array")
+        return self._map(self.contiguous_offset, (self.height, self.width, self.channels))
+
+    def strips(self, rows=256):
+        """Yield (y0, rows) over the whole image, rows at a time."""
+        for y0 in range(0, self.height, rows):
+            yield y0, self.read_rows(y0, y0 + rows)
+
+
+def _read_tiff_entries(f):
+    byte_order = f.read(2)
+    endian = {b"II": "<", b"MM": ">"}.get(byte_order)
+    if endian is None:
+        raise ValueError("Not a TIFF file")
+    (magic,) = struct.unpack(endian + "H", f.read(2))
+    if magic == 42:
+        (ifd_offset,) = struct.unpack(endian + "I", f.read(4))
+        count_format, entry_format, entry_size = "H", "HHII", 12
+    elif magic == 43:
+        f.read(4)  # Offset byte size and padding
+        (ifd_offset,) = struct.unpack(endian + "Q", f.read(8))
+        count_format, entry_format, entry_size = "Q", "HHQQ", 20
+    else:
+        raise ValueError("Not a TIFF file")
+
+    f.seek(ifd_offset)
+    (count,) = struct.unpack(endian + count_format, f.read(struct.calcsize(count_format)))
+    inline_size = entry_size - 4 - struct.calcsize(entry_format[2])
+    entries = {}
+    for _ in range(count):
+        raw = f.read(entry_size)
+        tag, field_type, value_count = struct.unpack(endian + entry_format[:3], raw[:entry_size - inline_size])
+        if field_type not in TIFF_TYPE_CODES:
+            continue
+        size = TIFF_TYPE_SIZES[field_type] * value_count
+        data = raw[entry_size - inline_size:]
+        if size > inline_size:
+            (offset,) = struct.unpack(endian + entry_format[3], data)
+            position = f.tell()
+            f.seek(offset)
+            data = f.read(size)
+            f.seek(position)
+        entries[tag] = list(struct.unpack(endian + TIFF_TYPE_CODES[field_type] * value_count, data[:size]))
+    return endian, entries
+
+
+def open_tiff(path, writable=False):
+    """Map the first image of an uncompressed, stripped or tiled, TIFF or BigTIFF."""
+    with open(path, "rb") as f:
+        endian, tags = _read_tiff_entries(f)
+
+    if tags.get(259, [1])[0] != 1:
+        raise ValueError(f"{path} is compressed; only uncompressed TIFF can be memory-mapped")
+    width, height = tags[256][0], tags[257][0]
+    channels = tags.get(277, [1])[0]
+    bits = tags.get(258, [1])[0]
+    if bits % 8:
+        raise ValueError(f"{bits}-bit samples are not supported")
+    kind = SAMPLE_KINDS[tags.get(339, [1])[0]]
+    dtype = np.dtype(f"{endian}{kind}{bits // 8}")
+    planar = tags.get(284, [1])[0] == 2
+    block_channels = 1 if planar else channels
+    photometric = tags.get(262, [2 if channels >= 3 else 1])[0]
+
+    blocks = []
+    if 322 in tags:
+        tile_width, tile_height = tags[322][0], tags[323][0]
+        across = -(-width // tile_width)
+        down = -(-height // tile_height)
+        for index, offset in enumerate(tags[324]):
+            plane, tile = divmod(index, across * down)
+            y, x = divmod(tile, across)
+            blocks.append(_Block(offset, y * tile_height, x * tile_width, tile_height, tile_width,
+                                 block_channels, plane))
+    else:
+        rows_per_strip = min(tags.get(278, [height])[0], height)
+        strips_per_plane = -(-height // rows_per_strip)
+        for index, offset in enumerate(tags[273]):
+            plane, strip = divmod(index, strips_per_plane)
+            y = strip * rows_per_strip
+            blocks.append(_Block(offset, y, 0, min(rows_per_strip, height - y), width, block_channels, plane))
+
+    # Interleaved strips stored back to back map as one array
+    contiguous_offset = None
+    if 322 not in tags and not planar:
+        row_bytes = width * channels * dtype.itemsize
+        if all(block.offset == blocks[0].offset + block.y * row_bytes for block in blocks):
+            contiguous_offset = blocks[0].offset
+
+    return MappedImage(path, width, height, channels, dtype, blocks, contiguous_offset, writable, photometric == 2)
+
+
+def open_raw(path, width, height, channels=3, dtype=np.uint8, planar=False, offset=0, writable=False, rgb=True):
+    """Map a headerless raw file, interleaved (HxWxC) or planar (CxHxW)."""
+    dtype = np.dtype(dtype)
+    if planar:
+        plane_bytes = width * height * dtype.itemsize
+        blocks = [_Block(offset + c * plane_bytes, 0, 0, height, width, 1, c) for c in range(channels)]
+        return MappedImage(path, width, height, channels, dtype, blocks, None, writable, rgb)
+    return MappedImage(path, width, height, channels, dtype, [], offset, writable, rgb)
+
+
+def create_raw(path, width, height, channels=3, dtype=np.uint8, rgb=True):
+    """Create an interleaved raw file of the right size and map it for writing."""
+    dtype = np.dtype(dtype)
+    with open(path, "wb") as f:
+        f.truncate(width * height * channels * dtype.itemsize)
+    return open_raw(path, width, height, channels, dtype, writable=True, rgb=rgb)
+
+
+def create_tiff(path, width, height, channels=3, dtype=np.uint8, rows_per_strip=64, bigtiff=None):
+    """Create an uncompressed TIFF with contiguous strips and map it for writing.
+
+    bigtiff defaults to True only when the pixels do not fit classic TIFF's 4 GB offsets.
+    """
+    dtype = np.dtype(dtype)
+    row_bytes = width * channels * dtype.itemsize
+    data_bytes = row_bytes * height
+    big = data_bytes > 0xFFFFFFFF - (1 << 20) if bigtiff is None else bigtiff
+    rows_per_strip = min(rows_per_strip, height)
+    strips = -(-height // rows_per_strip)
+    offset_type = 16 if big else 4
+
+    entries = [
+        (256, 4, [width]),
+        (257, 4, [height]),
+        (258, 3, [dtype.itemsize * 8] * channels),
+        (259, 3, [1]),
+        (262, 3, [2 if channels >= 3 else 1]),
+        (273, offset_type, [0] * strips),  # Filled in below
+        (277, 3, [channels]),
+        (278, 4, [rows_per_strip]),
+        (279, offset_type, [min(rows_per_strip, height - i * rows_per_strip) * row_bytes for i in range(strips)]),
+        (284, 3, [1]),
+        (339, 3, [{"u": 1, "i": 2, "f": 3}[dtype.kind]] * channels),
+    ]
+    if channels == 4:
+        entries.append((338, 3, [2]))  # Unassociated alpha
+    entries.sort()
+
+    if big:
+        header = struct.pack("<2sHHHQ", b"II", 43, 8, 0, 16)
+        count_format, entry_format, inline_size, ifd_offset = "<Q", "<HHQ", 8, 16
+    else:
+        header = struct.pack("<2sHI", b"II", 42, 8)
+        count_format, entry_format, inline_size, ifd_offset = "<H", "<HHI", 4, 8
+    ifd_size = struct.calcsize(count_format) + len(entries) * (struct.calcsize(entry_format) + inline_size) \
+        + inline_size
+    extra_offset = ifd_offset + ifd_size
+
+    # Out-of-line values come right after the IFD, then the pixel data
+    extra_size = sum(TIFF_TYPE_SIZES[t] * len(v) for _, t, v in entries if TIFF_TYPE_SIZES[t] * len(v) > inline_size)
+    data_offset = extra_offset + extra_size
+    data_offset += -data_offset % 16
+    for tag, _, values in entries:
+        if tag == 273:
+            values[:] = [data_offset + i * rows_per_strip * row_bytes for i in range(strips)]
+
+    ifd = struct.pack(count_format, len(entries))
+    extra = b""
+    for tag, field_type, values in entries:
+        packed = struct.pack("<" + TIFF_TYPE_CODES[field_type] * len(values), *values)
+        ifd += struct.pack(entry_format, tag, field_type, len(values))
+        if len(packed) > inline_size:
+            ifd += struct.pack("<" + ("Q" if big else "I"), extra_offset + len(extra))
+            extra += packed
+        else:
+            ifd += packed.ljust(inline_size, b"\0")
+    ifd += b"\0" * inline_size  # No next IFD
+
+    with open(path, "wb") as f:
+        f.write(header + ifd + extra)
+        f.truncate(data_offset + data_bytes)
+    return open_tiff(path, writable=True)
+
+
+def stream(func, sources, output, rows=256, overlap=0):
+    """Apply func to matching strips of every source and write the results into output.
+
+    overlap extra rows of context are read above and below each strip and
+    cropped from func's result, for operations that look at neighbours.
+    """
+    height = sources[0].height
+    for y0 in range(0, height, rows):
+        y1 = min(y0 + rows, height)
+        top = max(0, y0 - overlap)
+        bottom = min(height, y1 + overlap)
+        result = func(*[source.read_rows(top, bottom) for source in sources])
+        output.write_rows(y0, result[y0 - top:y1 - top])
+
+
+def threshold_file(args):
+    source = open_tiff(args.input)
+    output = create_tiff(args.output, source.width, source.height, source.channels, source.dtype)
+    stream(lambda strip: processing.threshold_image(strip, args.value, args.max_value, args.type),
+           [source], output, args.rows)
+
+
+def composite_file(args):
+    source = open_tiff(args.input)
+    mask = open_tiff(args.mask)
+    scale = np.iinfo(mask.dtype).max if mask.dtype.kind in "ui" and args.mask_range == "full" else 1
+    output = create_tiff(args.output, source.width, source.height, source.channels, source.dtype)
+    stream(lambda strip, mask_strip: processing.replace_background(strip, mask_strip / scale, threshold=args.threshold),
+           [source, mask], output, args.rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream operations over memory-mapped uncompressed TIFF files")
+    parser.add_argument("--rows", type=int, default=256, help="Rows resident per strip")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    threshold_parser = subparsers.add_parser("threshold")
+    threshold_parser.add_argument("input")
+    threshold_parser.add_argument("output")
+    threshold_parser.add_argument("--value", type=int, default=127)
+    threshold_parser.add_argument("--max-value", type=int, default=255)
+    threshold_parser.add_argument("--type", default="Binary", choices=sorted(processing.THRESHOLD_TYPES))
+    threshold_parser.set_defaults(func=threshold_file)
+
+    composite_parser = subparsers.add_parser("composite", help="White background where the mask is off")
+    composite_parser.add_argument("input")
+    composite_parser.add_argument("mask")
+    composite_parser.add_argument("output")
+    composite_parser.add_argument("--threshold", type=float, default=0.5)
+    composite_parser.add_argument("--mask-range", default="full", choices=["full", "binary"],
+                                  help="full: 0-255 (or dtype max) masks, binary: 0/1 masks")
+    composite_parser.set_defaults(func=composite_file)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
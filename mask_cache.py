@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import mask_format
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "MASK_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "background_removal", "masks")
+)
+
+
+def image_digest(image):
+    """Fast content hash of decoded pixels (shape and dtype included)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.shape}{image.dtype}".encode())
+    h.update(np.ascontiguousarray(image).data)
+    return h.hexdigest()
+
+
+class MaskCache:
+    """Persistent mask cache keyed by image content, engine, engine version and parameters.
+
+    Entries are single files written with an atomic rename, so several
+    worker processes can share one directory. Hits refresh the file's
+    modification time and the least recently used files are removed once
+    the directory grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_since_scan = max_bytes  # Scan on the first put
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, image, engine, version, params=None):
+        description = json.dumps([image_digest(image), engine, str(version), params or {}], sort_keys=True, default=str)
+        return hashlib.blake2b(description.encode(), digest_size=20).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".mask")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return mask_format.decode(data)
+
+    def put(self, key, mask):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = mask_format.encode(mask)
+
+        # Write to a temporary file in the same directory, then rename into place
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.bytes_since_scan += len(data)
+        if self.bytes_since_scan >= self.max_bytes // 10:
+            self.evict()
+
+    def get_or_compute(self, image, engine, version, params, compute):
+        """Return the cached mask for these inputs, or compute and store it."""
+        key = self.key(image, engine, version, params)
+        mask = self.get(key)
+        if mask is None:
+            mask = compute()
+            self.put(key, mask)
+        return mask
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        self.bytes_since_scan = 0
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".mask"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue  # Removed by another process
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+_default_cache = None
+
+
+def default_cache():
+    """Process-wide cache in DEFAULT_CACHE_DIR."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = MaskCache()
+    return _default_cache
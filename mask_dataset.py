@@ -0,0 +1,134 @@
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+import metrics
+from batch_pipeline import SEGMENTERS, BatchPipeline, Stage
+from export_stage import alpha_from_mask
+from image_loader import decode_at_size
+from mask_cache import default_cache
+
+
+def index_path(path):
+    return os.path.splitext(path)[0] + ".json"
+
+
+def create_dataset(path, sources, height, width, packed=False, **info):
+    """Preallocate an N x H x W mask array as a .npy file, with a sidecar index.
+
+    Row i holds the mask of sources[i]: alpha values 0-255, or with packed
+    one bit per pixel (np.packbits along the width, 1 = foreground). The
+    sidecar <path>.json records the shape, the sources and any extra info.
+    """
+    columns = -(-width // 8) if packed else width
+    masks = open_memmap(path, mode="w+", dtype=np.uint8, shape=(len(sources), height, columns))
+    index = dict(info, shape=[len(sources), height, width], packed=packed, sources=list(sources), failed=[])
+    with open(index_path(path), "w") as f:
+        json.dump(index, f)
+    return masks, index
+
+
+def load_dataset(path):
+    """(read-only memmap, index) of a dataset written by export_dataset."""
+    with open(index_path(path)) as f:
+        index = json.load(f)
+    return np.load(path, mmap_mode="r"), index
+
+
+def unpack(rows, width):
+    """0/1 masks from bit-packed rows (the last axis holds the packed width)."""
+    return np.unpackbits(rows, axis=-1)[..., :width]
+
+
+def export_dataset(path, sources, height, width, engine="grabcut", packed=False, decode_workers=2,
+                   segment_workers=1, store_workers=2, queue_size=8, cache=None, **engine_options):
+    """Segment every source image at height x width and store its mask in row i.
+
+    Images are stretched to the fixed shape as they are decoded (see
+    image_loader.decode_at_size), so the JPEG decoder does most of the
+    downscaling and segmentation runs at the stored size. Each item knows
+    its row, so the store workers write into disjoint parts of the memmap
+    without locking. Rows of images that failed stay zero and are listed
+    under "failed" in the index. Returns the pipeline for its report.
+    """
+    masks, index = create_dataset(path, sources, height, width, packed, engine=engine,
+                                  engine_options=engine_options)
+    make_segmenter = SEGMENTERS[engine]
+
+    def decode(item, _):
+        with metrics.STAGE_SECONDS.time(stage="decode"):
+            image = decode_at_size(item["path"], width, height)
+        if image is None:
+            raise ValueError("Unable to read the image")
+        item["image"] = image
+        return item
+
+    def segment(item, segmenter):
+        with metrics.STAGE_SECONDS.time(stage="segment"):
+            item["mask"] = segmenter(item.pop("image"))
+        return item
+
+    def store(item, _):
+        alpha = alpha_from_mask(item.pop("mask"))
+        if packed:
+            masks[item["row"]] = np.packbits(alpha > 127, axis=-1)
+        else:
+            masks[item["row"]] = alpha
+        metrics.IMAGES.inc(engine=engine, status="ok")
+        return None
+
+    def failed_row(item, message):
+        metrics.IMAGES.inc(engine=engine, status="failed")
+        failed.append(item["row"])
+
+    failed = []
+    pipeline = BatchPipeline([
+        Stage("decode", decode, decode_workers, queue_size=queue_size),
+        Stage("segment", segment, segment_workers, lambda: make_segmenter(cache, None, **engine_options),
+              queue_size=queue_size),
+        Stage("store", store, store_workers, queue_size=queue_size),
+    ], failed_row)
+    pipeline.start()
+    for row, source in enumerate(sources):
+        pipeline.submit(source, row=row)
+    pipeline.finish()
+
+    masks.flush()
+    index["failed"] = sorted(failed)
+    with open(index_path(path), "w") as f:
+        json.dump(index, f)
+    return pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export segmentation masks as one memory-mapped N x H x W array")
+    parser.add_argument("images", nargs="*", default=sorted(glob.glob(os.path.join("data", "*"))))
+    parser.add_argument("--output", default="masks.npy", help=".npy file; the index goes next to it as .json")
+    parser.add_argument("--size", default="256x256", help="WIDTHxHEIGHT every mask is resized to")
+    parser.add_argument("--packed", action="store_true", help="Store one bit per pixel instead of 0-255 alpha")
+    parser.add_argument("--engine", default="grabcut", choices=sorted(SEGMENTERS))
+    parser.add_argument("--decode-workers", type=int, default=2)
+    parser.add_argument("--segment-workers", type=int, default=1)
+    parser.add_argument("--store-workers", type=int, default=2)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--metrics-file", default=None, help="Write Prometheus-format metrics here at the end")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    cache = None if args.no_cache else default_cache()
+    metrics.watch_caches(cache)
+    pipeline = export_dataset(args.output, args.images, height, width, args.engine, args.packed,
+                              args.decode_workers, args.segment_workers, args.store_workers, cache=cache)
+    print(pipeline.report())
+    for source, error in pipeline.errors():
+        print(f"Failed {source}: {error}")
+    if args.metrics_file:
+        metrics.REGISTRY.write(args.metrics_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import json
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+import mask_format
+
+
+def _gray(image):
+    if image.ndim == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
+
+def _to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def dhash(image, hash_size=8):
+    """Difference hash: sign of horizontal gradients on a (hash_size+1) x hash_size downscale."""
+    small = cv2.resize(_gray(image), (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return _to_int(small[:, 1:] > small[:, :-1])
+
+
+def phash(image, hash_size=8):
+    """DCT hash: low frequencies of a 32x32 downscale compared with their median."""
+    small = cv2.resize(_gray(image), (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:hash_size, :hash_size].ravel()
+    return _to_int(low > np.median(low[1:]))
+
+
+HASHES = {"dhash": dhash, "phash": phash}
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes with Hamming distance."""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, key, value):
+        self.size += 1
+        if self.root is None:
+            self.root = (key, [value], {})
+            return
+        node = self.root
+        while True:
+            distance = hamming(key, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            if distance not in node[2]:
+                node[2][distance] = (key, [value], {})
+                return
+            node = node[2][distance]
+
+    def search(self, key, max_distance):
+        """Return [(distance, value)] for every stored hash within max_distance, nearest first."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_key, values, children = stack.pop()
+            distance = hamming(key, node_key)
+            if distance <= max_distance:
+                found.extend((distance, value) for value in values)
+            # Triangle inequality: only these subtrees can hold matches
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+def resize_mask(mask, width, height):
+    """Resize a 0/1 mask with nearest neighbour and a soft mask bilinearly."""
+    interpolation = cv2.INTER_NEAREST if mask.dtype == np.uint8 else cv2.INTER_LINEAR
+    return cv2.resize(mask, (width, height), interpolation=interpolation)
+
+
+class MaskDeduplicator:
+    """Reuse masks across near-duplicate images (re-encoded or resized copies).
+
+    Every computed mask is indexed by a perceptual hash of its image in one
+    BK-tree per namespace (engine, version and parameters). A later image
+    whose hash is within max_distance bits, and whose aspect ratio matches,
+    gets the stored mask resized to its own dimensions instead of being
+    segmented again.
+
+    Masks are kept encoded with mask_format (bit-packed or RLE, soft masks
+    as uint8 alpha), and the least recently used ones are dropped once they
+    take more than max_bytes, so a long run stays within a fixed memory
+    budget.
+    """
+
+    def __init__(self, max_distance=4, hash_name="phash", max_aspect_change=0.02, max_bytes=64 * 1024 * 1024):
+        self.max_distance = max_distance
+        self.hash = HASHES[hash_name]
+        self.max_aspect_change = max_aspect_change
+        self.max_bytes = max_bytes
+        self.trees = {}
+        self.entries = OrderedDict()  # id -> (namespace, hash, encoded mask, aspect), oldest first
+        self.next_id = 0
+        self.bytes = 0
+        self.dropped = 0  # Ids still in the trees whose entry was evicted
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _namespace(self, engine, version, params):
+        return json.dumps([engine, str(version), params or {}], sort_keys=True, default=str)
+
+    def lookup(self, image, namespace, image_hash=None):
+        """Return the mask of a near-duplicate resized to image, or None."""
+        tree = self.trees.get(namespace)
+        if tree is None:
+            return None
+        if image_hash is None:
+            image_hash = self.hash(image)
+        height, width = image.shape[:2]
+        for _, entry_id in tree.search(image_hash, self.max_distance):
+            entry = self.entries.get(entry_id)
+            if entry is None:
+                continue  # Evicted
+            _, _, data, aspect = entry
+            if abs(aspect - width / height) <= self.max_aspect_change * aspect:
+                self.entries.move_to_end(entry_id)
+                return resize_mask(mask_format.decode(data), width, height)
+        return None
+
+    def add(self, image, namespace, mask, image_hash=None):
+        if image_hash is None:
+            image_hash = self.hash(image)
+        height, width = image.shape[:2]
+        data = mask_format.encode(mask)
+        entry_id = self.next_id
+        self.next_id += 1
+        self.entries[entry_id] = (namespace, image_hash, data, width / height)
+        self.bytes += len(data)
+        self.trees.setdefault(namespace, BKTree()).add(image_hash, entry_id)
+        self._evict()
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            _, (_, _, data, _) = self.entries.popitem(last=False)
+            self.bytes -= len(data)
+            self.dropped += 1
+        # BK-trees cannot remove keys; rebuild them once evicted ids outnumber live ones
+        if self.dropped > len(self.entries):
+            self.trees = {}
+            for entry_id, (namespace, image_hash, _, _) in self.entries.items():
+                self.trees.setdefault(namespace, BKTree()).add(image_hash, entry_id)
+            self.dropped = 0
+
+    def get_or_compute(self, image, engine, version, params, compute):
+        """Return a near-duplicate's mask, or compute this image's mask and index it."""
+        namespace = self._namespace(engine, version, params)
+        image_hash = self.hash(image)
+        with self.lock:
+            mask = self.lookup(image, namespace, image_hash)
+            if mask is not None:
+                self.hits += 1
+                return mask
+            self.misses += 1
+        mask = compute()
+        with self.lock:
+            self.add(image, namespace, mask, image_hash)
+        return mask
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate(),
+                "indexed": len(self.entries), "bytes": self.bytes}
+
+
+_default_deduplicator = None
+
+
+def default_deduplicator():
+    """Process-wide deduplicator shared by the mask functions."""
+    global _default_deduplicator
+    if _default_deduplicator is None:
+        _default_deduplicator = MaskDeduplicator()
+    return _default_deduplicator
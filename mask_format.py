@@ -0,0 +1,134 @@
+import struct
+
+import numpy as np
+
+# File layout: header, then the payload of one of FORMATS
+#   packed: rows of np.packbits(mask, axis=1), ceil(width / 8) bytes each
+#   rle:    first value (1 byte), then uint32 run lengths over the row-major pixels
+#   soft:   uint8 alpha rows (mask * 255, rounded)
+MAGIC = b"MSK1"
+HEADER = struct.Struct("<4sBxxxII")  # magic, format, padding, height, width
+FORMATS = {"packed": 0, "rle": 1, "soft": 2}
+_FORMAT_NAMES = {code: name for name, code in FORMATS.items()}
+
+
+def is_binary(mask):
+    return mask.dtype in (np.uint8, np.bool_) and mask.max(initial=0) <= 1
+
+
+def choose_format(mask):
+    """RLE when it is smaller than bit-packing, soft for non-binary masks."""
+    if not is_binary(mask):
+        return "soft"
+    flat = mask.reshape(-1)
+    runs = np.count_nonzero(flat[1:] != flat[:-1]) + 1
+    return "rle" if 1 + 4 * runs < mask.shape[0] * ((mask.shape[1] + 7) // 8) else "packed"
+
+
+def encode(mask, fmt=None):
+    """Serialise a 2D mask. 0/1 masks are bit-packed or RLE, soft masks quantised to uint8."""
+    if mask.ndim != 2:
+        raise ValueError(f"Expected a 2D mask, got shape {mask.shape}")
+    if fmt is None:
+        fmt = choose_format(mask)
+    height, width = mask.shape
+    header = HEADER.pack(MAGIC, FORMATS[fmt], height, width)
+
+    if fmt == "soft":
+        if mask.dtype == np.uint8 and not is_binary(mask):
+            alpha = mask  # Already 0-255
+        else:
+            alpha = np.clip(np.rint(mask.astype(np.float32) * 255), 0, 255).astype(np.uint8)
+        return header + np.ascontiguousarray(alpha).tobytes()
+
+    binary = mask.astype(bool, copy=False)
+    if fmt == "packed":
+        return header + np.packbits(binary, axis=1).tobytes()
+
+    flat = binary.reshape(-1)
+    boundaries = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    lengths = np.diff(np.concatenate(([0], boundaries, [flat.size]))).astype("<u4")
+    return header + bytes([int(flat[0]) if flat.size else 0]) + lengths.tobytes()
+
+
+def read_header(data):
+    """Return (format name, height, width) from the start of an encoded mask."""
+    magic, code, height, width = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not an encoded mask")
+    return _FORMAT_NAMES[code], height, width
+
+
+def _roi(roi, height, width):
+    if roi is None:
+        return 0, 0, width, height
+    x, y, w, h = roi
+    if x < 0 or y < 0 or w <= 0 or h <= 0 or x + w > width or y + h > height:
+        raise ValueError(f"ROI {roi} outside a {width}x{height} mask")
+    return x, y, w, h
+
+
+def _unpack_rows(rows, x, w):
+    """Unpack only the bytes covering columns x .. x + w of bit-packed rows."""
+    first = x // 8
+    last = (x + w + 7) // 8
+    bits = np.unpackbits(rows[:, first:last], axis=1)
+    offset = x - first * 8
+    return bits[:, offset:offset + w]
+
+
+def _decode_rle(payload, height, width, x, y, w, h):
+    first_value = payload[0]
+    lengths = np.frombuffer(payload, dtype="<u4", offset=1).astype(np.int64)
+    ends = np.cumsum(lengths)
+    values = (np.arange(lengths.size) + first_value) % 2
+
+    # Expand only the runs overlapping rows y .. y + h
+    start, stop = y * width, (y + h) * width
+    i0 = np.searchsorted(ends, start, side="right")
+    i1 = np.searchsorted(ends, stop, side="left") + 1
+    run_ends = np.minimum(ends[i0:i1], stop)
+    run_starts = np.maximum(ends[i0:i1] - lengths[i0:i1], start)
+    rows = np.repeat(values[i0:i1].astype(np.uint8), run_ends - run_starts).reshape(h, width)
+    return rows[:, x:x + w]
+
+
+def decode(data, roi=None):
+    """Decode a mask, or only roi = (x, y, w, h) of it.
+
+    Binary formats decode to a uint8 0/1 mask, soft masks to float32 in [0, 1].
+    """
+    fmt, height, width = read_header(data)
+    x, y, w, h = _roi(roi, height, width)
+    payload = memoryview(data)[HEADER.size:]
+
+    if fmt == "rle":
+        return _decode_rle(payload, height, width, x, y, w, h)
+    if fmt == "packed":
+        row_bytes = (width + 7) // 8
+        rows = np.frombuffer(payload, dtype=np.uint8, count=h * row_bytes, offset=y * row_bytes)
+        return _unpack_rows(rows.reshape(h, row_bytes), x, w)
+    rows = np.frombuffer(payload, dtype=np.uint8, count=h * width, offset=y * width)
+    return rows.reshape(h, width)[:, x:x + w].astype(np.float32) / 255
+
+
+def save(path, mask, fmt=None):
+    with open(path, "wb") as f:
+        f.write(encode(mask, fmt))
+
+
+def load(path, roi=None):
+    """Read a mask file. For packed and soft masks only the rows in roi are read."""
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+        fmt, height, width = read_header(header)
+        if roi is None or fmt == "rle":
+            return decode(header + f.read(), roi)
+
+        x, y, w, h = _roi(roi, height, width)
+        row_bytes = (width + 7) // 8 if fmt == "packed" else width
+        f.seek(HEADER.size + y * row_bytes)
+        rows = np.frombuffer(f.read(h * row_bytes), dtype=np.uint8).reshape(h, row_bytes)
+    if fmt == "packed":
+        return _unpack_rows(rows, x, w)
+    return rows[:, x:x + w].astype(np.float32) / 255
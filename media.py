@@ -1,6 +1,8 @@
 import cv2
 import mediapipe as mp
 import numpy as np
+import processing
+from mask_cache import default_cache
 
 # Initialize MediaPipe Selfie Segmentation
 mp_selfie_segmentation = mp.solutions.selfie_segmentation
@@ -10,14 +12,8 @@ segmenter = mp_selfie_segmentation.SelfieSegmentation(model_selection=1)
 
 # Replace the background with a solid color
 def remove_background(image, background_color=(255, 255, 255)):
-    # Convert BGR image to RGB for MediaPipe processing
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-    # Perform segmentation
-    result = segmenter.process(image_rgb)
-
-    # Create a mask
-    mask = result.segmentation_mask
+    # Perform segmentation, reusing the mask from an earlier run on the same image
+    mask = processing.mediapipe_mask(image, segmenter, cache=default_cache())
     condition = mask > 0.5  # Threshold for the mask
 
     # Create a background with the given color
@@ -0,0 +1,195 @@
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+
+# Seconds; wide enough for a 1 ms threshold and a multi-second GrabCut
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """A value that is set, or read from a function each time metrics are collected."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def set_function(self, function, **labels):
+        self.set(function, **labels)
+
+    def _samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        lines = []
+        for key, value in items:
+            if callable(value):
+                try:
+                    value = value()
+                except Exception:
+                    continue  # The object behind it has gone away
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * len(self.buckets), 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+                    break
+            counts[1] += value
+
+    def time(self, **labels):
+        """Context manager observing the seconds spent inside it."""
+        return _Timer(self, labels)
+
+    def _samples(self):
+        with self.lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self.values.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    """Metrics rendered together in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Dump every metric to path (e.g. for node_exporter's textfile collector)."""
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Kilobytes on Linux
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = Registry()
+IMAGES = REGISTRY.register(Counter(
+    "background_removal_images_total", "Images handled, by engine and outcome (ok, failed, invalid, rejected, timeout)",
+    ("engine", "status")))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "background_removal_stage_seconds", "Seconds per call of each stage (decode, segment, composite, encode)",
+    ("stage",)))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "background_removal_queue_depth", "Items waiting in each queue", ("queue",)))
+UTILISATION = REGISTRY.register(Gauge(
+    "background_removal_worker_utilisation", "Fraction of worker time spent working, per stage or engine",
+    ("stage",)))
+CACHE_HIT_RATIO = REGISTRY.register(Gauge(
+    "background_removal_cache_hit_ratio", "Hit rate of the mask cache and the near-duplicate index", ("cache",)))
+PEAK_RSS = REGISTRY.register(Gauge(
+    "process_peak_rss_bytes", "Peak resident set size of this process"))
+PEAK_RSS.set_function(peak_rss_bytes)
+
+
+def watch_caches(cache=None, dedup=None):
+    """Report the hit rates of a MaskCache and a MaskDeduplicator."""
+    if cache is not None:
+        CACHE_HIT_RATIO.set_function(cache.hit_rate, cache="mask")
+    if dedup is not None:
+        CACHE_HIT_RATIO.set_function(dedup.hit_rate, cache="dedup")
@@ -2,7 +2,8 @@ import tkinter as tk
 from tkinter import filedialog, ttk
 import cv2
 import numpy as np
-from PIL import Image, ImageTk
+from canvas_view import show_image
+from renditions import resize
 
 class ImageProcessor:
     def __init__(self, root):
@@ -100,7 +101,7 @@ class ImageProcessor:
         height, width = self.original_image.shape[:2]
         new_width = int(width * self.resize_percentage / 100)
         new_height = int(height * self.resize_percentage / 100)
-        resized = cv2.resize(self.original_image, (new_width, new_height))
+        resized = resize(self.original_image, new_width, new_height)
         
         # Convert to grayscale
         gray = cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)
@@ -153,13 +154,8 @@ class ImageProcessor:
         
         resized = cv2.resize(image_rgb, (new_width, new_height))
         
-        # Convert to PhotoImage
-        photo = ImageTk.PhotoImage(Image.fromarray(resized))
-        
-        # Update canvas
-        canvas.delete("all")
-        canvas.create_image(max_size//2, max_size//2, image=photo, anchor=tk.CENTER)
-        canvas.image = photo  # Keep a reference to prevent garbage collection
+        # Reuse the canvas' PhotoImage and image item
+        show_image(canvas, resized, max_size//2, max_size//2)
 
 if __name__ == "__main__":
     root = tk.Tk()
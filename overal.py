@@ -1,8 +1,17 @@
 import tkinter as tk
 from tkinter import filedialog, ttk
 import cv2
-from PIL import Image, ImageTk
-import numpy as np
+from canvas_view import clear_image, show_image, show_line
+from viewport import TilePyramid, Viewport, ZoomPanControls
+from image_loader import ProgressiveLoader
+from pipeline_graph import ProcessingGraph
+from session import ImageSession
+from mask_cache import default_cache
+from mask_dedup import default_deduplicator
+from export_stage import ExportStage
+from renditions import AreaPyramid
+import processing
+import os
 
 class ImageProcessor:
     def __init__(self, root):
@@ -13,6 +22,8 @@ class ImageProcessor:
         self.original_image = None
         self.processed_image = None
         self.thresholded_image = None
+        self.original_pyramid = None
+        self.thresholded_pyramid = None
         self.max_width = 1920
         self.max_height = 1080
         self.aspect_ratio = 1.0
@@ -34,16 +45,40 @@ class ImageProcessor:
         self.grab_rect = None
 
         # Threshold types
-        self.threshold_types = {
-            "Binary": cv2.THRESH_BINARY,
-            "Binary Inverted": cv2.THRESH_BINARY_INV,
-            "Truncate": cv2.THRESH_TRUNC,
-            "To Zero": cv2.THRESH_TOZERO,
-            "To Zero Inverted": cv2.THRESH_TOZERO_INV
-        }
+        self.threshold_types = processing.THRESHOLD_TYPES
         self.current_threshold_type = tk.StringVar(value="Binary")
+
+        # Reduced preview first, full-resolution decode in the background
+        self.loader = ProgressiveLoader(self.root, self.on_preview_loaded, self.on_image_loaded)
+
+        # Masks persist on disk across runs, keyed by pixels and parameters
+        self.mask_cache = default_cache()
+        # Re-encoded or resized copies of an image reuse its mask
+        self.mask_dedup = default_deduplicator()
+
+        # Writes every output of an image in one pass
+        self.exporter = ExportStage()
+
+        # Open images, each with its own processing graph, within a memory budget
+        self.session = ImageSession(self.build_graph, memory_budget=1024 * 1024 * 1024)
+        self.image_paths = []
+        self.active_path = None
+        self.graph = self.build_graph()
         
         self.setup_ui()
+
+    def build_graph(self):
+        # Stages only re-run when their inputs or parameters change
+        graph = ProcessingGraph()
+        graph.add_source("image")
+        graph.add("pyramid", AreaPyramid, ["image"])
+        graph.add("resized", processing.resize_image, ["pyramid"], ["width", "height"])
+        graph.add("thresholded", processing.threshold_image, ["image"],
+                  ["threshold_value", "max_value", "threshold_type"])
+        graph.add("grabcut_mask", lambda image, rect, iterations: processing.grabcut_mask(
+            image, rect, iterations, cache=self.mask_cache, dedup=self.mask_dedup), ["image"], ["rect", "iterations"])
+        graph.add("grabcut_result", processing.replace_background, ["image", "grabcut_mask"])
+        return graph
     
     def setup_ui(self):
         # Main frame
@@ -52,11 +87,17 @@ class ImageProcessor:
         
         # Load Image Button
         self.load_btn = ttk.Button(self.main_frame, text="Load Image", command=self.load_image)
-        self.load_btn.grid(row=0, column=0, pady=5)
+        self.load_btn.grid(row=0, column=0, pady=5, sticky=tk.W)
+
+        # Switch between the open images
+        self.image_selector = ttk.Combobox(self.main_frame, state="readonly", width=40)
+        self.image_selector.grid(row=0, column=0, pady=5, sticky=tk.E)
+        self.image_selector.bind('<<ComboboxSelected>>', lambda e: self.switch_image(self.image_paths[self.image_selector.current()]))
         
         # Create notebook for tabs
         self.notebook = ttk.Notebook(self.main_frame)
         self.notebook.grid(row=1, column=0, pady=5, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.notebook.bind('<<NotebookTabChanged>>', lambda e: self.refresh_visible_tab())
         
         # Create tabs
         self.preview_tab = ttk.Frame(self.notebook)
@@ -176,48 +217,100 @@ class ImageProcessor:
             self.resize_image()
     
     def load_image(self):
-        file_path = filedialog.askopenfilename(
+        file_paths = filedialog.askopenfilenames(
             filetypes=[("Image files", "*.png *.jpg *.jpeg *.bmp *.gif *.tiff")]
     )
-        if file_path:
-            self.original_image = cv2.imread(file_path)
-            if self.original_image is not None:
+        for file_path in file_paths:
+            self.session.open(file_path)
+            if file_path not in self.image_paths:
+                self.image_paths.append(file_path)
+        if file_paths:
+            self.image_selector.config(values=[os.path.basename(path) for path in self.image_paths])
+            self.switch_image(file_paths[-1])
+
+    def switch_image(self, path):
+        self.active_path = path
+        self.image_selector.current(self.image_paths.index(path))
+        entry = self.session.entries[path]
+        if entry.image is None and entry.graph.nodes["image"].version == 0:
+            # First time this image is shown: preview now, full decode in the background
+            self.loader.load(path)
+        else:
+            # Rebuilt from the session's compressed copy if it was evicted
+            self.loader.cancel()
+            self.on_image_loaded(self.session.activate(path).image)
+
+    def on_preview_loaded(self, preview, full_size):
+        width, height = full_size
+        self.preview_view.fit(preview.shape[1], preview.shape[0])
+        self.render_view(self.preview_view, TilePyramid(preview), self.preview_canvas)
+        self.resolution_label.config(text=f"Resolution: {width}x{height} (loading...)")
+
+    def on_image_loaded(self, image):
+        self.original_image = image
+        if self.original_image is not None:
             # Calculate aspect ratio
-                height, width = self.original_image.shape[:2]
-                self.aspect_ratio = width / height
-            
+            height, width = self.original_image.shape[:2]
+            self.aspect_ratio = width / height
+
+            # Derived results live in the image's own graph
+            self.graph = self.session.activate(self.active_path, self.original_image).graph
+            self.processed_image = None
+            self.thresholded_image = None
+
+            # Zoomable views share one tiled pyramid of the original
+            self.original_pyramid = TilePyramid(self.original_image)
+            for view in (self.preview_view, self.grabcut_view, self.comparison_view):
+                view.fit(width, height)
+            self.restore_grabcut()
+
             # Update all displays
-                self.display_image(self.original_image, self.preview_canvas, 400)
-                self.display_image(self.original_image, self.original_canvas, 300)
-                self.display_image(self.original_image, self.grabcut_canvas, 600)
-                self.display_image(self.original_image, self.threshold_original_canvas, 300)
-            
-                self.resolution_label.config(text=f"Resolution: {width}x{height}")
-            
+            self.update_preview()
+            self.display_image(self.original_image, self.original_canvas, 300)
+            self.update_grabcut_view()
+            self.display_image(self.original_image, self.threshold_original_canvas, 300)
+
+            self.resolution_label.config(text=f"Resolution: {width}x{height}")
+
             # Update sliders
-                self.width_var.set(width)
-                self.height_var.set(height)
-                self.width_label.config(text=str(width))
-                self.height_label.config(text=str(height))
-            
-            # Process images
-                self.resize_image()
-                self.apply_threshold()
-    
+            self.width_var.set(width)
+            self.height_var.set(height)
+            self.width_label.config(text=str(width))
+            self.height_label.config(text=str(height))
+
+            # Derived images are computed when their tab is shown
+            self.resize_image()
+            self.apply_threshold()
+
     def resize_image(self):
         if self.original_image is None:
             return
-            
-        new_width = self.width_var.get()
-        new_height = self.height_var.get()
-        
-        # Perform the actual resize using cv2
-        self.processed_image = cv2.resize(self.original_image, (new_width, new_height))
-        
-        # Display the resized image
-        self.display_image(self.processed_image, self.resized_canvas, 300)
-    
+
+        self.graph.set_params(width=self.width_var.get(), height=self.height_var.get())
+        self.refresh_visible_tab()
+
+    def refresh_visible_tab(self):
+        """Pull the outputs the visible tab shows from the graph, computing only stale stages."""
+        if self.original_image is None:
+            return
+        current = self.notebook.select()
+
+        if current == str(self.resize_tab):
+            resized = self.graph.get("resized")
+            if resized is not self.processed_image:
+                self.processed_image = resized
+                self.display_image(self.processed_image, self.resized_canvas, 300)
+
+        elif current in (str(self.threshold_tab), str(self.comparison_tab)):
+            thresholded = self.graph.get("thresholded")
+            if thresholded is not self.thresholded_image:
+                self.thresholded_image = thresholded
+                self.thresholded_pyramid = TilePyramid(self.thresholded_image)
+                self.display_image(self.thresholded_image, self.threshold_result_canvas, 300)
+            self.update_comparison()
+
     def save_image(self):
+        self.processed_image = self.graph.get("resized")
         if self.processed_image is None:
             return
             
@@ -244,18 +337,8 @@ class ImageProcessor:
     
         display_image = cv2.resize(image_rgb, (display_width, display_height))
     
-    # Convert to PhotoImage
-        photo = ImageTk.PhotoImage(Image.fromarray(display_image))
-    
-    # Update canvas
-        canvas.delete("all")
-        canvas.create_image(
-            max_size//2,
-            max_size//2,
-            image=photo,
-            anchor=tk.CENTER
-    )
-        canvas.image = photo
+    # Reuse the canvas' PhotoImage and image item
+        show_image(canvas, display_image, max_size//2, max_size//2)
     
 
         
@@ -266,6 +349,8 @@ class ImageProcessor:
         
         self.preview_canvas = tk.Canvas(self.preview_tab, width=400, height=400, bg='lightgray')
         self.preview_canvas.grid(row=1, column=0, padx=5, pady=5)
+        self.preview_view = Viewport(400, 400)
+        ZoomPanControls(self.preview_canvas, self.preview_view, self.update_preview)
         
         self.resolution_label = ttk.Label(self.preview_tab, text="Resolution: -")
         self.resolution_label.grid(row=2, column=0, pady=5)
@@ -315,6 +400,8 @@ class ImageProcessor:
             bg='lightgray'
         )
         self.comparison_canvas.grid(row=0, column=0, padx=5, pady=5)
+        self.comparison_view = Viewport(600, 400)
+        ZoomPanControls(self.comparison_canvas, self.comparison_view, self.update_comparison)
         
         self.comparison_slider = ttk.Scale(
             self.comparison_frame,
@@ -332,27 +419,17 @@ class ImageProcessor:
     def apply_threshold(self):
         if self.original_image is None:
             return
-            
-        if len(self.original_image.shape) == 3:
-            gray = cv2.cvtColor(self.original_image, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = self.original_image
-            
-        _, self.thresholded_image = cv2.threshold(
-            gray,
-            self.threshold_value.get(),
-            self.max_value.get(),
-            self.threshold_types[self.current_threshold_type.get()]
+
+        self.graph.set_params(
+            threshold_value=self.threshold_value.get(),
+            max_value=self.max_value.get(),
+            threshold_type=self.current_threshold_type.get()
         )
-        
-        if len(self.original_image.shape) == 3:
-            self.thresholded_image = cv2.cvtColor(self.thresholded_image, cv2.COLOR_GRAY2BGR)
-            
-        self.display_image(self.thresholded_image, self.threshold_result_canvas, 300)
-        self.update_comparison()
+        self.refresh_visible_tab()
 
         
     def save_threshold_image(self):
+        self.thresholded_image = self.graph.get("thresholded")
         if self.thresholded_image is None:
             return
         file_path = filedialog.asksaveasfilename(
@@ -365,40 +442,47 @@ class ImageProcessor:
     def update_comparison(self, *args):
         if self.original_image is None or self.thresholded_image is None:
             return
-        canvas_width = self.comparison_canvas.winfo_width()
-        canvas_height = self.comparison_canvas.winfo_height()
+        canvas_width = self.comparison_view.width
+        canvas_height = self.comparison_view.height
         split_position = int((self.comparison_value.get() / 100) * canvas_width)
         
-        original_display = self.prepare_image_for_display(self.original_image, canvas_width, canvas_height)
-        thresholded_display = self.prepare_image_for_display(self.thresholded_image, canvas_width, canvas_height)
+        # Both sides come from the same zoomed region of their pyramids
+        original_display = self.comparison_view.render(self.original_pyramid)
+        thresholded_display = self.comparison_view.render(self.thresholded_pyramid)
         
-        combined = np.copy(original_display)
+        combined = original_display
         combined[:, split_position:] = thresholded_display[:, split_position:]
+        combined = cv2.cvtColor(combined, cv2.COLOR_BGR2RGB)
         
-        photo = ImageTk.PhotoImage(Image.fromarray(combined))
-        self.comparison_canvas.delete("all")
-        self.comparison_canvas.create_image(canvas_width//2, canvas_height//2, image=photo, anchor=tk.CENTER)
-        self.comparison_canvas.image = photo
-        self.comparison_canvas.create_line(split_position, 0, split_position, canvas_height, fill='white', width=2)
+        # Update the comparison view in place
+        show_image(self.comparison_canvas, combined, canvas_width//2, canvas_height//2)
+        show_line(self.comparison_canvas, "split", split_position, 0, split_position, canvas_height, fill='white', width=2)
 
     def on_comparison_drag(self, event):
-        canvas_width = self.comparison_canvas.winfo_width()
+        canvas_width = self.comparison_view.width
         value = max(0, min(100, (event.x / canvas_width) * 100))
         self.comparison_value.set(value)
         self.update_comparison()
 
-    def prepare_image_for_display(self, image, canvas_width, canvas_height):
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        height, width = image_rgb.shape[:2]
-        scale = min(canvas_width/width, canvas_height/height)
-        new_width = int(width * scale)
-        new_height = int(height * scale)
-        resized = cv2.resize(image_rgb, (new_width, new_height))
-        display = np.zeros((canvas_height, canvas_width, 3), dtype=np.uint8)
-        y_offset = (canvas_height - new_height) // 2
-        x_offset = (canvas_width - new_width) // 2
-        display[y_offset:y_offset+new_height, x_offset:x_offset+new_width] = resized
-        return display
+    def render_view(self, view, pyramid, canvas):
+        if pyramid is None:
+            return
+        display = cv2.cvtColor(view.render(pyramid), cv2.COLOR_BGR2RGB)
+        show_image(canvas, display, view.width//2, view.height//2)
+
+    def update_preview(self):
+        self.render_view(self.preview_view, self.original_pyramid, self.preview_canvas)
+
+    def update_grabcut_view(self):
+        self.render_view(self.grabcut_view, self.original_pyramid, self.grabcut_canvas)
+
+        # Keep the selection attached to the image while zooming and panning
+        self.grabcut_canvas.delete("rect")
+        if self.grab_rect is not None:
+            x, y, w, h = self.grab_rect
+            x0, y0 = self.grabcut_view.image_to_canvas(x, y)
+            x1, y1 = self.grabcut_view.image_to_canvas(x + w, y + h)
+            self.grabcut_canvas.create_rectangle(x0, y0, x1, y1, outline="red", tag="rect")
 
     def setup_grabcut_tab(self):
         controls_frame = ttk.LabelFrame(self.grabcut_tab, text="GrabCut Controls", padding="5")
@@ -419,9 +503,12 @@ class ImageProcessor:
         ttk.Button(controls_frame, text="Apply GrabCut", command=self.apply_grabcut).grid(row=2, column=0, pady=5, padx=5)
         ttk.Button(controls_frame, text="Reset Selection", command=self.reset_grabcut).grid(row=2, column=1, pady=5, padx=5)
         ttk.Button(controls_frame, text="Save Result", command=self.save_grabcut).grid(row=2, column=2, pady=5, padx=5)
+        ttk.Button(controls_frame, text="Export All", command=self.export_grabcut).grid(row=2, column=3, pady=5, padx=5)
         
         self.grabcut_canvas = tk.Canvas(self.grabcut_tab, width=600, height=400, bg='lightgray')
         self.grabcut_canvas.grid(row=1, column=0, columnspan=3, padx=5, pady=5)
+        self.grabcut_view = Viewport(600, 400)
+        ZoomPanControls(self.grabcut_canvas, self.grabcut_view, self.update_grabcut_view)
         
         self.mask_canvas = tk.Canvas(self.grabcut_tab, width=300, height=200, bg='lightgray')
         self.result_canvas = tk.Canvas(self.grabcut_tab, width=300, height=200, bg='lightgray')
@@ -458,11 +545,14 @@ class ImageProcessor:
         print(f"End: {self.rect_end}")
         print(f"Image shape: {self.original_image.shape}")
 
-        # Simple rectangle coordinates
-        x = min(self.rect_start[0], self.rect_end[0])
-        y = min(self.rect_start[1], self.rect_end[1])
-        w = abs(self.rect_end[0] - self.rect_start[0])
-        h = abs(self.rect_end[1] - self.rect_start[1])
+        # Map the rectangle from canvas to image coordinates
+        height, width = self.original_image.shape[:2]
+        start_x, start_y = self.grabcut_view.canvas_to_image(*self.rect_start)
+        end_x, end_y = self.grabcut_view.canvas_to_image(*self.rect_end)
+        x = int(max(0, min(start_x, end_x)))
+        y = int(max(0, min(start_y, end_y)))
+        w = int(min(width, max(start_x, end_x))) - x
+        h = int(min(height, max(start_y, end_y))) - y
         self.grab_rect = (x, y, w, h)
         print(f"Rect: {self.grab_rect}")
 
@@ -477,33 +567,45 @@ class ImageProcessor:
             return
         
         print(f"Rectangle coordinates: {self.grab_rect}")
-        mask = np.zeros(self.original_image.shape[:2], np.uint8)
-        bgdModel = np.zeros((1,65), np.float64)
-        fgdModel = np.zeros((1,65), np.float64)
+        self.graph.set_params(rect=self.grab_rect, iterations=self.iterations.get())
 
         try:
-            cv2.grabCut(self.original_image, mask, self.grab_rect, bgdModel, fgdModel, 
-                        self.iterations.get(), cv2.GC_INIT_WITH_RECT)
+            # Reuses the previous mask when neither the rectangle nor the iterations changed
+            mask2 = self.graph.get("grabcut_mask")
             print("GrabCut completed")
+            print(f"Near-duplicate mask reuse: {self.mask_dedup.hit_rate():.0%}")
 
-            mask2 = np.where((mask==2)|(mask==0), 0, 1).astype('uint8')
-            result = self.original_image.copy()
-            result[mask2 == 0] = [255, 255, 255]
+            result = self.graph.get("grabcut_result")
 
             self.grabcut_mask = mask2
             self.grabcut_result = result
-            self.display_image(mask2 * 255, self.mask_canvas, 300)
+            self.display_image(cv2.cvtColor(mask2 * 255, cv2.COLOR_GRAY2BGR), self.mask_canvas, 300)
             self.display_image(result, self.result_canvas, 300)
         except Exception as e:
             print(f"Error in GrabCut: {str(e)}")
 
+    def restore_grabcut(self):
+        # Show the selection and result kept for this image, if any
+        self.grab_rect = self.graph.param_values.get("rect")
+        self.grabcut_mask = self.graph.nodes["grabcut_mask"].output
+        self.grabcut_result = self.graph.nodes["grabcut_result"].output
+        if self.grabcut_result is not None:
+            self.display_image(cv2.cvtColor(self.grabcut_mask * 255, cv2.COLOR_GRAY2BGR), self.mask_canvas, 300)
+            self.display_image(self.grabcut_result, self.result_canvas, 300)
+        else:
+            clear_image(self.mask_canvas)
+            clear_image(self.result_canvas)
+
     def reset_grabcut(self):
         self.grabcut_canvas.delete("rect")
         self.grab_rect = None
+        self.graph.set_param("rect", None)
+        self.graph.clear("grabcut_mask")
+        self.graph.clear("grabcut_result")
         self.grabcut_mask = None
         self.grabcut_result = None
         if self.original_image is not None:
-            self.display_image(self.original_image, self.grabcut_canvas, 600)
+            self.update_grabcut_view()
 
     def save_grabcut(self):
         if self.grabcut_result is None:
@@ -515,6 +617,16 @@ class ImageProcessor:
         if file_path:
             cv2.imwrite(file_path, self.grabcut_result)
 
+    def export_grabcut(self):
+        # Cutout, mask, white-background image and thumbnail from the current mask
+        if self.grabcut_mask is None:
+            return
+        output_dir = filedialog.askdirectory()
+        if output_dir:
+            name = os.path.splitext(os.path.basename(self.active_path))[0]
+            for path in self.exporter.export(self.original_image, self.grabcut_mask, output_dir, name).values():
+                print(f"Saved {path}")
+
 
     
 
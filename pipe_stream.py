@@ -0,0 +1,188 @@
+import argparse
+import json
+import struct
+import sys
+import time
+
+import numpy as np
+
+from batch_pipeline import SEGMENTERS, BatchPipeline, Stage, decode
+from export_stage import OUTPUTS, ExportStage
+from mask_cache import default_cache
+
+# Every frame, in and out, is an 8-byte big-endian length followed by that many bytes
+_LENGTH = struct.Struct(">Q")
+
+
+def read_frames(stream):
+    """Yield the payloads of length-prefixed frames until end of stream."""
+    while True:
+        header = stream.read(_LENGTH.size)
+        if not header:
+            return
+        if len(header) < _LENGTH.size:
+            raise EOFError("Stream ended inside a frame header")
+        (length,) = _LENGTH.unpack(header)
+        payload = stream.read(length)
+        if len(payload) < length:
+            raise EOFError(f"Stream ended inside a {length}-byte frame")
+        yield payload
+
+
+def write_frame(stream, payload):
+    stream.write(_LENGTH.pack(len(payload)))
+    stream.write(payload)
+
+
+def read_paths(stream):
+    for line in stream:
+        path = line.decode().rstrip("\r\n")
+        if path:
+            yield path
+
+
+class PipeStream:
+    """Segment a stream of images and write the results in input order.
+
+    Inputs are submitted with submit() (encoded bytes or a path) and flow
+    through decode -> segment -> encode worker pools; a single writer
+    thread puts results back in submission order and writes one frame per
+    input to output (an empty frame when the image failed) plus one NDJSON
+    line to metadata with the stage timings, mask coverage and engine. The
+    queues are bounded, so reading, computing and writing overlap and a
+    slow reader on the other end of the pipe only stalls the writer. Once a
+    write fails (e.g. the reader closed the pipe) the stream is aborted:
+    later results are dropped, and submit() and finish() raise the error.
+    """
+
+    def __init__(self, output, metadata, engine="grabcut", result="cutout", decode_workers=2, segment_workers=1,
+                 encode_workers=2, queue_size=8, cache=None, **engine_options):
+        self.output = output
+        self.metadata = metadata
+        self.engine = engine
+        self.result = result
+        self.exporter = ExportStage(outputs=(result,))
+        self.pending = {}  # Finished items waiting for an earlier one
+        self.next_seq = 0
+        self.submitted = 0
+        self.write_error = None
+        make_segmenter = SEGMENTERS[engine]
+
+        def timed(name, func):
+            def run(item, state):
+                start = time.perf_counter()
+                item = func(item, state)
+                item["timings"][name] = round((time.perf_counter() - start) * 1000, 3)
+                return item
+            return run
+
+        def segment(item, segmenter):
+            item["mask"] = segmenter(item["image"])
+            return item
+
+        def encode(item, _):
+            item["height"], item["width"] = item["image"].shape[:2]
+            item["coverage"] = round(float(np.mean(item["mask"])), 6)
+            item["result"] = self.exporter.encode(item.pop("image"), item.pop("mask"))[result]
+            return item
+
+        self.writer = Stage("write", self._write, 1, queue_size=queue_size)
+        self.pipeline = BatchPipeline([
+            Stage("decode", timed("decode", decode), decode_workers, queue_size=queue_size),
+            Stage("segment", timed("segment", segment), segment_workers,
+                  lambda: make_segmenter(cache, None, **engine_options), queue_size=queue_size),
+            Stage("encode", timed("encode", encode), encode_workers, queue_size=queue_size),
+            self.writer,
+        ], self._failed)
+        self.writer.on_error = None  # Nothing downstream to tell when writing itself fails
+
+    def _failed(self, item, message):
+        # Failed items still get their (empty) frame, in order
+        item["error"] = message
+        self.writer.input.put(item)
+
+    def _emit(self, item):
+        write_frame(self.output, item.get("result", b""))
+        self.output.flush()
+        record = {"seq": item["seq"], "source": item["path"], "engine": self.engine, "output": self.result}
+        if "error" in item:
+            record["error"] = item["error"]
+        else:
+            record.update(width=item["width"], height=item["height"], coverage=item["coverage"],
+                          bytes=len(item["result"]))
+        record["timings_ms"] = item["timings"]
+        record["latency_ms"] = round((time.perf_counter() - item["received"]) * 1000, 3)
+        self.metadata.write(json.dumps(record) + "\n")
+        self.metadata.flush()
+
+    def _write(self, item, _):
+        self.pending[item["seq"]] = item
+        while self.next_seq in self.pending:
+            item = self.pending.pop(self.next_seq)
+            self.next_seq += 1
+            if self.write_error is not None:
+                continue  # Frames after a lost one would be out of order
+            try:
+                self._emit(item)
+            except Exception as e:
+                self.write_error = e
+        return None
+
+    def start(self):
+        self.pipeline.start()
+
+    def submit(self, data=None, path=None):
+        """Queue encoded image bytes, or a path to read; blocks while the pipeline is full."""
+        if self.write_error is not None:
+            raise self.write_error
+        item = {"seq": self.submitted, "timings": {}, "received": time.perf_counter()}
+        if data is not None:
+            item["data"] = data
+        self.submitted += 1
+        self.pipeline.submit(path or f"frame:{item['seq']}", **item)
+
+    def finish(self):
+        self.pipeline.finish()
+        if self.write_error is not None:
+            raise self.write_error
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Remove backgrounds from images streamed through a pipe",
+        epilog="Frames are an 8-byte big-endian length followed by the payload. "
+               "Results are written to stdout in input order, one frame per input (empty on failure); "
+               "one JSON line of metadata per input goes to --metadata.")
+    parser.add_argument("--input", choices=("frames", "paths"), default="frames",
+                        help="stdin holds length-prefixed image bytes, or one path per line")
+    parser.add_argument("--output", choices=sorted(OUTPUTS), default="cutout",
+                        help="Rendition written for each image (see export_stage.OUTPUTS)")
+    parser.add_argument("--metadata", default="-", help="File for the NDJSON metadata (default stderr)")
+    parser.add_argument("--engine", default="grabcut", choices=sorted(SEGMENTERS))
+    parser.add_argument("--decode-workers", type=int, default=2)
+    parser.add_argument("--segment-workers", type=int, default=1)
+    parser.add_argument("--encode-workers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+
+    metadata = sys.stderr if args.metadata == "-" else open(args.metadata, "w", buffering=1)
+    stream = PipeStream(sys.stdout.buffer, metadata, args.engine, args.output, args.decode_workers,
+                        args.segment_workers, args.encode_workers, args.queue_size,
+                        cache=None if args.no_cache else default_cache())
+    stream.start()
+    try:
+        if args.input == "frames":
+            for payload in read_frames(sys.stdin.buffer):
+                stream.submit(data=payload)
+        else:
+            for path in read_paths(sys.stdin.buffer):
+                stream.submit(path=path)
+    finally:
+        stream.finish()
+        if metadata is not sys.stderr:
+            metadata.close()
+
+
+if __name__ == "__main__":
+    main()
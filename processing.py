@@ -0,0 +1,154 @@
+import os
+
+import cv2
+import numpy as np
+
+import renditions
+
+THRESHOLD_TYPES = {
+    "Binary": cv2.THRESH_BINARY,
+    "Binary Inverted": cv2.THRESH_BINARY_INV,
+    "Truncate": cv2.THRESH_TRUNC,
+    "To Zero": cv2.THRESH_TOZERO,
+    "To Zero Inverted": cv2.THRESH_TOZERO_INV
+}
+
+
+def resize_image(image, width, height):
+    """Resize an image to (width, height), area averaging to shrink and bicubic/Lanczos to enlarge.
+
+    image may be a renditions.AreaPyramid so repeated resizes reuse its levels.
+    """
+    return renditions.resize(image, width, height)
+
+
+def threshold_image(image, threshold_value=127, max_value=255, threshold_type="Binary"):
+    """Threshold the grayscale version of an image, keeping its channel layout."""
+    if len(image.shape) == 3:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = image
+
+    _, thresholded = cv2.threshold(gray, threshold_value, max_value, THRESHOLD_TYPES[threshold_type])
+
+    if len(image.shape) == 3:
+        thresholded = cv2.cvtColor(thresholded, cv2.COLOR_GRAY2BGR)
+    return thresholded
+
+
+def _cached(cache, image, engine, version, params, compute, dedup=None, dedup_params=None):
+    """Look the mask up in the exact cache, then among near-duplicates, before computing it.
+
+    Only masks computed for these exact pixels are stored in the exact
+    cache; a mask borrowed from a near-duplicate never is. dedup_params
+    replaces params for near-duplicates when they must not depend on the
+    image size.
+    """
+    key = None
+    if cache is not None:
+        key = cache.key(image, engine, version, params)
+        mask = cache.get(key)
+        if mask is not None:
+            return mask
+
+    def compute_and_store():
+        mask = compute()
+        if key is not None:
+            cache.put(key, mask)
+        return mask
+
+    if dedup is None:
+        return compute_and_store()
+    return dedup.get_or_compute(image, engine, version, params if dedup_params is None else dedup_params,
+                                compute_and_store)
+
+
+def grabcut_mask(image, rect, iterations=5, cache=None, dedup=None):
+    """Run GrabCut inside rect and return a uint8 0/1 foreground mask.
+
+    With a MaskCache, a mask computed earlier for the same pixels and
+    parameters is returned without running GrabCut again. With a
+    MaskDeduplicator, so is the mask of a near-duplicate image (also a
+    resized one) whose rect kept the same margins to the image border, as
+    the batch rect does; it is cleared outside rect, like GrabCut's own.
+    """
+    x, y, w, h = (int(v) for v in rect)
+    height, width = image.shape[:2]
+    params = {"rect": [x, y, w, h], "iterations": iterations}
+    dedup_params = {"margins": [x, y, width - x - w, height - y - h], "iterations": iterations}
+    mask = _cached(cache, image, "grabcut", cv2.__version__, params, lambda: _grabcut(image, rect, iterations),
+                   dedup, dedup_params)
+    if dedup is not None:
+        inside = np.zeros_like(mask)
+        inside[y:y + h, x:x + w] = mask[y:y + h, x:x + w]
+        mask = inside
+    return mask
+
+
+def _grabcut(image, rect, iterations):
+    mask = np.zeros(image.shape[:2], np.uint8)
+    bgd_model = np.zeros((1, 65), np.float64)
+    fgd_model = np.zeros((1, 65), np.float64)
+    cv2.grabCut(image, mask, rect, bgd_model, fgd_model, iterations, cv2.GC_INIT_WITH_RECT)
+    return np.where((mask == 2) | (mask == 0), 0, 1).astype('uint8')
+
+
+def mediapipe_mask(image, segmenter, cache=None, model_selection=1, dedup=None):
+    """Run a MediaPipe SelfieSegmentation model and return its float32 mask.
+
+    model_selection only keys the cache and deduplicator; it must match the segmenter's.
+    """
+    def compute():
+        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return segmenter.process(image_rgb).segmentation_mask
+
+    version = None
+    if cache is not None or dedup is not None:
+        import mediapipe as mp
+        version = getattr(mp, "__version__", "unknown")
+    return _cached(cache, image, "mediapipe", version, {"model_selection": model_selection}, compute, dedup)
+
+
+def u2net_mask(image, engine, cache=None, dedup=None, batcher=None, predict=None):
+    """Run a U2NetEngine and return its float32 saliency mask.
+
+    With a U2NetBatcher for engine, the mask comes from a forward pass
+    shared with other callers, at the input shape of the image's
+    aspect-ratio bucket. predict(image), when given, replaces
+    engine.predict with an equivalent call (e.g. U2NetSelector.run, which
+    also times it).
+    """
+    params = {
+        "backend": engine.backend,
+        "weights": os.path.abspath(engine.weights_path) if engine.weights_path else None,
+        "input_size": engine.input_size,
+    }
+    predict = predict or engine.predict
+    if batcher is not None:
+        from u2net_batcher import choose_bucket
+        height, width = image.shape[:2]
+        params["input_size"] = list(choose_bucket(width, height, batcher.buckets))
+        predict = batcher.predict
+    # Random weights differ per process, so their masks are never shared
+    if engine.weights_path is None:
+        cache = None
+    else:
+        params["weights_mtime"] = os.path.getmtime(engine.weights_path)
+    return _cached(cache, image, engine.name, engine.architecture, params, lambda: predict(image), dedup)
+
+
+def replace_background(image, mask, background_color=(255, 255, 255), threshold=0.5):
+    """Keep the pixels where mask > threshold and fill the rest with a solid color.
+
+    A grayscale (2D) image is filled with the color's gray value, or with
+    background_color itself when it is a single number.
+    """
+    condition = mask > threshold
+    if image.ndim == 2:
+        if np.ndim(background_color):
+            blue, green, red = background_color
+            background_color = round(0.114 * blue + 0.587 * green + 0.299 * red)  # As cv2.COLOR_BGR2GRAY
+        return np.where(condition, image, np.asarray(background_color, image.dtype))
+    bg_image = np.zeros(image.shape, dtype=np.uint8)
+    bg_image[:] = background_color
+    return np.where(condition[:, :, None], image, bg_image)
@@ -0,0 +1,125 @@
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from tiled_resize import tiled_resize
+
+# Sources at least this large are resized in parallel strips
+TILED_RESIZE_PIXELS = 16 * 1000 * 1000
+
+
+def choose_interpolation(src_width, src_height, dst_width, dst_height):
+    """Area averaging to shrink, bicubic to enlarge up to 2x and Lanczos beyond."""
+    scale = max(dst_width / src_width, dst_height / src_height)
+    if scale <= 1:
+        return cv2.INTER_AREA
+    if scale <= 2:
+        return cv2.INTER_CUBIC
+    return cv2.INTER_LANCZOS4
+
+
+def _resize(source, width, height, interpolation):
+    if source.shape[0] * source.shape[1] >= TILED_RESIZE_PIXELS:
+        return tiled_resize(source, width, height, interpolation)
+    return cv2.resize(source, (width, height), interpolation=interpolation)
+
+
+class AreaPyramid:
+    """Successive 2x area-averaged reductions of an image, built on demand.
+
+    Each target size is resized from the smallest level that is still at
+    least as large in both dimensions, so a 10x reduction averages a few
+    pixels of a nearby level instead of the full-resolution source, and
+    every size requested from the same pyramid shares the levels.
+    """
+
+    def __init__(self, image):
+        self.levels = [image]
+
+    @property
+    def nbytes(self):
+        # Level 0 is the caller's image
+        return sum(level.nbytes for level in self.levels[1:])
+
+    def level_for(self, width, height):
+        """Return the smallest level with at least width x height pixels."""
+        level = self.levels[0]
+        index = 0
+        while level.shape[1] // 2 >= width and level.shape[0] // 2 >= height:
+            index += 1
+            if index == len(self.levels):
+                self.levels.append(_resize(level, level.shape[1] // 2, level.shape[0] // 2, cv2.INTER_AREA))
+            level = self.levels[index]
+        return level
+
+    def resize(self, width, height):
+        source = self.level_for(width, height)
+        src_height, src_width = source.shape[:2]
+        if (src_width, src_height) == (width, height):
+            return source.copy()
+        interpolation = choose_interpolation(src_width, src_height, width, height)
+        return _resize(source, width, height, interpolation)
+
+
+def resize(image, width, height):
+    """Resize with automatically chosen interpolation. image may be an AreaPyramid to reuse its levels."""
+    if isinstance(image, AreaPyramid):
+        return image.resize(width, height)
+    # A single target gains nothing from building levels first
+    interpolation = choose_interpolation(image.shape[1], image.shape[0], width, height)
+    return _resize(image, width, height, interpolation)
+
+
+def render(image, sizes):
+    """Return {(width, height): image} for every size, all derived from one pyramid."""
+    pyramid = image if isinstance(image, AreaPyramid) else AreaPyramid(image)
+    # Largest first so each level is built once, from the level above it
+    return {size: pyramid.resize(*size) for size in sorted(set(sizes), reverse=True)}
+
+
+def write_renditions(image, sizes, output_dir, name, ext=".jpg", quality=90, max_workers=None):
+    """Write output_dir/<name>_<w>x<h><ext> for every size and return {(w, h): path}."""
+    os.makedirs(output_dir, exist_ok=True)
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if ext.lower() in (".jpg", ".jpeg") else []
+
+    def write(size, rendition):
+        path = os.path.join(output_dir, f"{name}_{size[0]}x{size[1]}{ext}")
+        if not cv2.imwrite(path, rendition, params):
+            raise ValueError(f"Could not write {path}")
+        return path
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {size: pool.submit(write, size, rendition) for size, rendition in render(image, sizes).items()}
+        return {size: future.result() for size, future in futures.items()}
+
+
+def parse_size(text):
+    """'800x600' -> (800, 600); '800' -> (800, 0), where 0 means keep the aspect ratio."""
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height) if height else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write several sizes of an image from one decode")
+    parser.add_argument("image")
+    parser.add_argument("sizes", nargs="+", type=parse_size, help="WIDTHxHEIGHT, or WIDTH to keep the aspect ratio")
+    parser.add_argument("--output-dir", default="renditions")
+    parser.add_argument("--ext", default=".jpg")
+    parser.add_argument("--quality", type=int, default=90)
+    args = parser.parse_args()
+
+    image = cv2.imread(args.image)
+    if image is None:
+        parser.error(f"Could not read {args.image}")
+    height, width = image.shape[:2]
+    sizes = [(w, h or max(1, round(w * height / width))) for w, h in args.sizes]
+
+    name = os.path.splitext(os.path.basename(args.image))[0]
+    for path in write_renditions(image, sizes, args.output_dir, name, args.ext, args.quality).values():
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
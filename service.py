@@ -0,0 +1,327 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+import metrics
+from batch_pipeline import SEGMENTERS
+from export_stage import ExportStage, alpha_from_mask
+from mask_cache import default_cache
+
+# Response formats: cutout is RGBA PNG, mask an 8-bit PNG alpha, white a JPEG on white
+CONTENT_TYPES = {"cutout": "image/png", "mask": "image/png", "white": "image/jpeg"}
+
+
+class Job:
+    """One image waiting for, or being processed by, an engine worker."""
+
+    def __init__(self, image, latency_ms=None):
+        self.image = image
+        self.latency_ms = latency_ms
+        self.mask = None
+        self.error = None
+        self.cancelled = False
+        self.queued = time.perf_counter()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+
+class EnginePool:
+    """Worker threads that each keep one segmenter loaded, fed by a bounded queue.
+
+    submit() never blocks: when queue_size jobs are already waiting it
+    raises queue.Full, which the service turns into 429 Too Many Requests.
+    Jobs whose caller gave up (timed out) before a worker reached them are
+    skipped instead of segmented. slots bounds the requests admitted at
+    once (queue_size waiting plus one per worker), so a request can be
+    turned away before its body is read. A job's latency_ms budget goes
+    to the segmenter, for U2-Net with architecture "auto" (budgets).
+    """
+
+    def __init__(self, engine, workers=1, queue_size=16, cache=None, **engine_options):
+        self.engine = engine
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.slots = threading.BoundedSemaphore(queue_size + workers)
+        self.make_segmenter = lambda: SEGMENTERS[engine](cache, None, **engine_options)
+        self.budgets = engine == "u2net" and engine_options.get("architecture") == "auto"
+        self.ready = threading.Barrier(workers + 1)
+        self.errors = []
+        self.busy = 0.0
+        self.lock = threading.Lock()
+        self.created = time.perf_counter()
+        self.threads = [threading.Thread(target=self._run, name=f"{engine}-{i}", daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+        self.ready.wait()  # Every segmenter loaded before the first request
+        if self.errors:
+            raise RuntimeError(f"{engine} could not start: {self.errors[0]}")
+
+    def _run(self):
+        try:
+            segmenter = self.make_segmenter()
+        except Exception as e:
+            self.errors.append(f"{type(e).__name__}: {e}")
+            self.ready.wait()
+            return
+        self.ready.wait()
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            if job.cancelled:
+                continue
+            job.started = time.perf_counter()
+            try:
+                job.mask = segmenter(job.image) if job.latency_ms is None else segmenter(job.image, job.latency_ms)
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+            job.finished = time.perf_counter()
+            with self.lock:
+                self.busy += job.finished - job.started
+            metrics.STAGE_SECONDS.observe(job.finished - job.started, stage="segment")
+            job.done.set()
+
+    def submit(self, image, latency_ms=None):
+        job = Job(image, latency_ms)
+        self.jobs.put_nowait(job)
+        return job
+
+    def depth(self):
+        return self.jobs.qsize()
+
+    def utilisation(self):
+        """Fraction of the workers' time since startup spent segmenting."""
+        with self.lock:
+            return self.busy / (len(self.threads) * (time.perf_counter() - self.created))
+
+    def close(self):
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class BackgroundRemovalService:
+    """Decode, segment on a warm engine pool, and encode the requested output.
+
+    Decoding and encoding run on the request's own thread; only
+    segmentation goes through the engine pools, so their queues bound the
+    work admitted per engine.
+    """
+
+    def __init__(self, engines=("threshold", "grabcut"), workers=1, queue_size=16, timeout=30.0,
+                 max_body=32 * 1024 * 1024, cache=None, engine_options=None):
+        engine_options = engine_options or {}
+        self.pools = {engine: EnginePool(engine, workers, queue_size, cache, **engine_options.get(engine, {}))
+                      for engine in engines}
+        for engine, pool in self.pools.items():
+            metrics.QUEUE_DEPTH.set_function(pool.depth, queue=engine)
+            metrics.UTILISATION.set_function(pool.utilisation, stage=engine)
+        metrics.watch_caches(cache)
+        self.default_engine = engines[0]
+        self.timeout = timeout
+        self.max_body = max_body
+        self.exporters = {output: ExportStage(outputs=(output,)) for output in ("cutout", "white")}
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+
+    def status(self):
+        return {"engines": {engine: {"workers": len(pool.threads), "queued": pool.depth(),
+                                     "queue_size": pool.jobs.maxsize}
+                            for engine, pool in self.pools.items()}}
+
+    def check(self, engine, output, latency_ms=None):
+        """An error response for an unknown engine or output, or a budget the engine cannot use, else None."""
+        if engine not in self.pools:
+            return _error(400, f"Unknown engine {engine!r}, available: {sorted(self.pools)}")
+        if output not in CONTENT_TYPES:
+            return _error(400, f"Unknown output {output!r}, expected one of {sorted(CONTENT_TYPES)}")
+        if latency_ms is not None and not self.pools[engine].budgets:
+            return _error(400, f"latency_ms needs u2net served with --u2net-architecture auto, not {engine}")
+        return None
+
+    def admit(self, engine):
+        """Reserve room for one request on engine without blocking; a 429 response when it is full, else None.
+
+        Call release(engine) once an admitted request has been answered.
+        """
+        if self.pools[engine].slots.acquire(blocking=False):
+            return None
+        metrics.IMAGES.inc(engine=engine, status="rejected")
+        return _error(429, f"{engine} queue is full", {"Retry-After": "1"})
+
+    def release(self, engine):
+        self.pools[engine].slots.release()
+
+    def _encode(self, output, image, mask):
+        if output == "mask":
+            with metrics.STAGE_SECONDS.time(stage="encode"):
+                ok, encoded = cv2.imencode(".png", alpha_from_mask(mask))
+            if not ok:
+                raise ValueError("Could not encode mask")
+            return encoded.tobytes()
+        return self.exporters[output].encode(image, mask)[output]
+
+    def remove_background(self, body, engine=None, output="cutout", timeout=None, latency_ms=None):
+        """Return (HTTP status, headers, body) for one request admitted with admit()."""
+        engine = engine or self.default_engine
+        error = self.check(engine, output, latency_ms)
+        if error is not None:
+            return error
+        timeout = min(self.timeout, timeout) if timeout else self.timeout
+
+        start = time.perf_counter()
+        with metrics.STAGE_SECONDS.time(stage="decode"):
+            image = cv2.imdecode(np.frombuffer(body, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            metrics.IMAGES.inc(engine=engine, status="invalid")
+            return _error(400, "Body is not a readable image")
+        try:
+            job = self.pools[engine].submit(image, latency_ms)
+        except queue.Full:
+            metrics.IMAGES.inc(engine=engine, status="rejected")
+            return _error(429, f"{engine} queue is full", {"Retry-After": "1"})
+        if not job.done.wait(max(0.0, timeout - (time.perf_counter() - start))):
+            job.cancelled = True
+            metrics.IMAGES.inc(engine=engine, status="timeout")
+            return _error(504, f"Not finished within {timeout:g} s")
+        if job.error is not None:
+            metrics.IMAGES.inc(engine=engine, status="failed")
+            return _error(500, job.error)
+
+        try:
+            encoded = self._encode(output, image, job.mask)
+        except Exception as e:
+            metrics.IMAGES.inc(engine=engine, status="failed")
+            return _error(500, f"{type(e).__name__}: {e}")
+        metrics.IMAGES.inc(engine=engine, status="ok")
+        headers = {
+            "Content-Type": CONTENT_TYPES[output],
+            "X-Engine": engine,
+            "X-Mask-Coverage": f"{float(np.mean(job.mask)):.6f}",
+            "X-Queue-Ms": f"{(job.started - job.queued) * 1000:.1f}",
+            "X-Segment-Ms": f"{(job.finished - job.started) * 1000:.1f}",
+            "X-Total-Ms": f"{(time.perf_counter() - start) * 1000:.1f}",
+        }
+        return 200, headers, encoded
+
+
+def _error(status, message, headers=None):
+    return status, dict(headers or {}, **{"Content-Type": "application/json"}), json.dumps({"error": message}).encode()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    service = None  # Set by create_server
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, headers, body):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reject(self, response):
+        # Answered without reading the body, which would be taken for the next request: close the connection
+        status, headers, body = response
+        self._send(status, dict(headers, Connection="close"), body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send(200, {"Content-Type": "application/json"}, json.dumps(self.service.status()).encode())
+        elif path == "/metrics":
+            self._send(200, {"Content-Type": metrics.CONTENT_TYPE}, metrics.REGISTRY.render().encode())
+        else:
+            self._send(*_error(404, "Not found"))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/remove-background":
+            self._reject(_error(404, "Not found"))
+            return
+        # Everything that can turn the request away is checked before the body is read or decoded
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            self._send(*_error(411, "Send the image as the request body with a Content-Length"))
+            return
+        if length > self.service.max_body:
+            self._reject(_error(413, f"Images are limited to {self.service.max_body} bytes"))
+            return
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            timeout = float(query["timeout"]) if "timeout" in query else None
+            latency_ms = float(query["latency_ms"]) if "latency_ms" in query else None
+        except ValueError:
+            self._reject(_error(400, "timeout and latency_ms must be numbers"))
+            return
+        engine = query.get("engine") or self.service.default_engine
+        output = query.get("output", "cutout")
+        rejected = self.service.check(engine, output, latency_ms) or self.service.admit(engine)
+        if rejected is not None:
+            self._reject(rejected)
+            return
+        try:
+            body = self.rfile.read(length)
+            self._send(*self.service.remove_background(body, engine, output, timeout, latency_ms))
+        finally:
+            self.service.release(engine)
+
+    def log_message(self, format, *args):
+        pass  # One line per request is too much under load
+
+
+def create_server(service, host="127.0.0.1", port=8000):
+    handler = type("Handler", (RequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve background removal over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--engines", default="threshold,grabcut",
+                        help="Comma-separated engines to load; the first is the default")
+    parser.add_argument("--workers", type=int, default=2, help="Warm segmenters per engine")
+    parser.add_argument("--queue-size", type=int, default=16, help="Requests waiting per engine before 429")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Longest a request may take, in seconds")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--u2net-batch", type=int, default=1,
+                        help="Run up to this many concurrent U2-Net requests as one batch (at most --workers)")
+    parser.add_argument("--u2net-architecture", default="u2net",
+                        help="u2net, u2netp or auto (u2net, or u2netp when a request's ?latency_ms= is too short)")
+    args = parser.parse_args()
+
+    engines = [engine for engine in args.engines.split(",") if engine]
+    unknown = set(engines) - set(SEGMENTERS)
+    if unknown:
+        parser.error(f"Unknown engines {sorted(unknown)}, expected some of {sorted(SEGMENTERS)}")
+    service = BackgroundRemovalService(engines, args.workers, args.queue_size, args.timeout,
+                                       cache=None if args.no_cache else default_cache(),
+                                       engine_options={"u2net": {"batch_size": args.u2net_batch,
+                                                                 "architecture": args.u2net_architecture}})
+    server = create_server(service, args.host, args.port)
+    print(f"Serving {', '.join(engines)} on http://{args.host}:{args.port}/remove-background")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import io
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from image_loader import REDUCED_COLOR_FLAGS, choose_reduction, read_image_size
+from renditions import AreaPyramid
+
+
+class SessionEntry:
+    """One open image: its encoded file bytes, a thumbnail and, while resident, the decoded pixels."""
+
+    def __init__(self, path, encoded, graph):
+        self.path = path
+        self.encoded = encoded  # Compressed file contents, always kept
+        self.size = read_image_size(io.BytesIO(encoded))
+        self.thumbnail = None
+        self.image = None
+        self.graph = graph
+
+    def derived_nbytes(self):
+        return sum(_nbytes(node.output) for node in self.graph.nodes.values() if node.func is not None)
+
+    def nbytes(self):
+        return len(self.encoded) + _nbytes(self.thumbnail) + _nbytes(self.image) + self.derived_nbytes()
+
+
+class ImageSession:
+    """Keep many images open within a memory budget.
+
+    Every open image keeps its compressed file bytes and a small thumbnail.
+    Full-resolution pixels and the outputs of its processing graph are
+    dropped in least-recently-used order once the budget is exceeded and
+    rebuilt from the compressed bytes when the image is activated again.
+    The active image is never evicted.
+    """
+
+    def __init__(self, graph_factory, memory_budget=1024 * 1024 * 1024, thumbnail_size=400):
+        self.graph_factory = graph_factory
+        self.memory_budget = memory_budget
+        self.thumbnail_size = thumbnail_size
+        self.entries = OrderedDict()  # Least recently used first
+        self.active = None
+        self.evictions = 0
+
+    def open(self, path):
+        """Add an image to the session without decoding it at full resolution."""
+        if path in self.entries:
+            return self.entries[path]
+        with open(path, 'rb') as f:
+            entry = SessionEntry(path, f.read(), self.graph_factory())
+        entry.thumbnail = self._decode(entry, self.thumbnail_size)
+        self.entries[path] = entry
+        self.enforce_budget()
+        return entry
+
+    def close(self, path):
+        self.entries.pop(path, None)
+        if self.active == path:
+            self.active = None
+
+    def activate(self, path, image=None):
+        """Make an image the active one.
+
+        A full-resolution decode made elsewhere (e.g. by a background loader)
+        can be passed in; otherwise an evicted image is decoded again from
+        its compressed bytes.
+        """
+        entry = self.entries[path]
+        self.entries.move_to_end(path)
+        self.active = path
+        if image is not None and image is not entry.image:
+            entry.image = image
+            entry.graph.set_source("image", image)
+        elif entry.image is None:
+            entry.image = self._decode(entry)
+            entry.graph.set_source("image", entry.image)
+        self.enforce_budget()
+        return entry
+
+    def memory_usage(self):
+        return sum(entry.nbytes() for entry in self.entries.values())
+
+    def enforce_budget(self):
+        # Derived results are cheaper to rebuild than decodes, so they go first
+        for evict in (self._evict_derived, self._evict_image):
+            for path, entry in self.entries.items():
+                if self.memory_usage() <= self.memory_budget:
+                    return
+                if path != self.active:
+                    evict(entry)
+
+    def _evict_derived(self, entry):
+        if entry.derived_nbytes():
+            entry.graph.clear_outputs()
+            self.evictions += 1
+
+    def _evict_image(self, entry):
+        if entry.image is not None:
+            entry.image = None
+            entry.graph.set_source("image", None)
+            entry.graph.clear_outputs()
+            self.evictions += 1
+
+    def _decode(self, entry, max_size=None):
+        buffer = np.frombuffer(entry.encoded, dtype=np.uint8)
+        flags = cv2.IMREAD_COLOR
+        if max_size is not None and entry.size is not None:
+            width, height = entry.size
+            scale = min(1.0, max_size / max(width, height))
+            flags = REDUCED_COLOR_FLAGS[choose_reduction(width, height, int(width * scale), int(height * scale))]
+        return cv2.imdecode(buffer, flags)
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, AreaPyramid):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(item) for item in value)
+    return 0
@@ -0,0 +1,206 @@
+import argparse
+import glob
+import io
+import os
+import tarfile
+import threading
+import time
+
+import metrics
+from batch_pipeline import SEGMENTERS, create_pipeline
+from mask_cache import default_cache
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+INDEX_NAME = "index.tsv"
+_BLOCK = tarfile.BLOCKSIZE
+
+
+def iter_tar_images(shards, extensions=IMAGE_EXTENSIONS):
+    """Yield (shard, member name, bytes) for the images in tar shards, without extracting them.
+
+    Shards are read front to back as streams ("r|*"), so compressed shards
+    and shards on pipes or network storage are never seeked.
+    """
+    for shard in shards:
+        with tarfile.open(shard, "r|*") as tar:
+            for member in tar:
+                if member.isfile() and member.name.lower().endswith(extensions):
+                    yield shard, member.name, tar.extractfile(member).read()
+
+
+def parse_size(text):
+    """'512M', '2G' or a number of bytes."""
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    text = text.strip().upper()
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+class ShardWriter:
+    """Write results into size-capped tar shards with an index of their offsets.
+
+    Members go to <prefix>-00000.tar, then -00001.tar once a shard would
+    grow beyond max_bytes (plus the end-of-archive padding of at most
+    10 KiB). Each member is flushed to its shard before its line is
+    appended to index.tsv (name, shard, data offset, size), so after a
+    crash the index still covers everything written, and a new run starts
+    a new shard instead of reusing the unfinished one's number. Names must
+    be unique within a run. Thread-safe; members are plain uncompressed
+    tar entries, so a result is read with one seek (see read_member).
+    """
+
+    def __init__(self, output_dir, prefix="results", max_bytes=1 << 30):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.tar = None
+        self.members = 0  # In the open shard
+        self.names = set()
+        os.makedirs(output_dir, exist_ok=True)
+        self.shard = self._next_shard()
+        self.index = open(os.path.join(output_dir, INDEX_NAME), "a")
+
+    def _next_shard(self):
+        # Continue after shards written by an earlier run into the same directory
+        existing = glob.glob(os.path.join(self.output_dir, f"{self.prefix}-*.tar"))
+        return max((int(os.path.basename(path)[len(self.prefix) + 1:-4]) for path in existing), default=-1) + 1
+
+    def _shard_name(self):
+        return f"{self.prefix}-{self.shard:05d}.tar"
+
+    def _open(self):
+        path = os.path.join(self.output_dir, self._shard_name())
+        self.tar = tarfile.open(path, "w", format=tarfile.PAX_FORMAT)
+
+    def _close_shard(self):
+        if self.tar is None:
+            return
+        self.tar.close()
+        self.tar = None
+        self.members = 0
+        self.shard += 1
+
+    def add(self, name, data):
+        """Add one member; returns "<shard>:<name>"."""
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        padded = -(-len(data) // _BLOCK) * _BLOCK
+        with self.lock:
+            if name in self.names:
+                raise ValueError(f"{name} was already written in this run")
+            if self.tar is not None and self.members and self.tar.offset + _BLOCK + padded > self.max_bytes:
+                self._close_shard()
+            if self.tar is None:
+                self._open()
+            self.tar.addfile(info, io.BytesIO(data))
+            self.tar.fileobj.flush()
+            self.members += 1
+            self.names.add(name)
+            # The data ends the member, after the header (one or more blocks for long names)
+            self.index.write(f"{name}\t{self._shard_name()}\t{self.tar.offset - padded}\t{len(data)}\n")
+            self.index.flush()
+            return f"{self._shard_name()}:{name}"
+
+    def close(self):
+        with self.lock:
+            self._close_shard()
+            self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_index(output_dir):
+    """{name: (shard path, offset, size)} from the index of a ShardWriter directory."""
+    index = {}
+    with open(os.path.join(output_dir, INDEX_NAME)) as f:
+        for line in f:
+            name, shard, offset, size = line.rstrip("\n").split("\t")
+            index[name] = (os.path.join(output_dir, shard), int(offset), int(size))
+    return index
+
+
+def read_member(location):
+    """Bytes of one result, given its (shard path, offset, size) from load_index."""
+    shard, offset, size = location
+    with open(shard, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def shard_stem(shard):
+    """'in/photos-003.tar.gz' -> 'photos-003'."""
+    name = os.path.basename(shard)
+    for extension in (".tar.gz", ".tar.bz2", ".tar.xz", ".tgz", ".tar"):
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def process_shards(shards, output_dir, engine="grabcut", max_bytes=1 << 30, prefix="results", **pipeline_options):
+    """Remove the background of every image in the input shards; returns the pipeline.
+
+    Outputs are named <input shard>/<member without extension><suffix>, so
+    equal member names in different input shards do not collide.
+    """
+    with ShardWriter(output_dir, prefix, max_bytes) as writer:
+        pipeline = create_pipeline(output_dir, engine, shard_writer=writer, **pipeline_options)
+        pipeline.start()
+        try:
+            for shard, member, data in iter_tar_images(shards):
+                pipeline.submit(f"{shard}:{member}", data=data,
+                                name=f"{shard_stem(shard)}/{os.path.splitext(member)[0]}")
+        finally:
+            pipeline.finish()
+    return pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove backgrounds from images stored in tar shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Process input shards into output shards")
+    run.add_argument("shards", nargs="+")
+    run.add_argument("--output-dir", required=True)
+    run.add_argument("--engine", default="grabcut", choices=sorted(SEGMENTERS))
+    run.add_argument("--max-shard-size", type=parse_size, default="1G", help="e.g. 512M, 2G")
+    run.add_argument("--prefix", default="results")
+    run.add_argument("--decode-workers", type=int, default=2)
+    run.add_argument("--segment-workers", type=int, default=1)
+    run.add_argument("--encode-workers", type=int, default=2)
+    run.add_argument("--no-cache", action="store_true")
+    run.add_argument("--metrics-file", default=None, help="Write Prometheus-format metrics here at the end")
+
+    get = commands.add_parser("get", help="Copy one result out of the output shards")
+    get.add_argument("output_dir")
+    get.add_argument("name", help="Member name, e.g. shard-000/photos/cat_mask.mask")
+    get.add_argument("destination")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        cache = None if args.no_cache else default_cache()
+        metrics.watch_caches(cache)
+        pipeline = process_shards(args.shards, args.output_dir, args.engine, args.max_shard_size, args.prefix,
+                                  decode_workers=args.decode_workers, segment_workers=args.segment_workers,
+                                  encode_workers=args.encode_workers, cache=cache)
+        print(pipeline.report())
+        for path, error in pipeline.errors():
+            print(f"Failed {path}: {error}")
+        if args.metrics_file:
+            metrics.REGISTRY.write(args.metrics_file)
+    else:
+        location = load_index(args.output_dir).get(args.name)
+        if location is None:
+            raise SystemExit(f"{args.name} is not in the index of {args.output_dir}")
+        with open(args.destination, "wb") as f:
+            f.write(read_member(location))
+
+
+if __name__ == "__main__":
+    main()
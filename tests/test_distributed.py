@@ -0,0 +1,64 @@
+import os
+import re
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import distributed
+from export_stage import OUTPUTS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_workers_share_a_job_and_take_over_expired_leases(tmp_path):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(30):
+        path = str(tmp_path / f"image{i:02d}.png")
+        cv2.imwrite(path, rng.integers(0, 256, (24, 32, 3), np.uint8))
+        paths.append(path)
+    job_dir = str(tmp_path / "job")
+    output_dir = str(tmp_path / "out")
+    chunks = distributed.create_job(job_dir, paths, output_dir, "threshold", chunk_size=3)
+
+    # A node died holding chunk 0 an hour ago
+    lease = distributed.Lease(job_dir, 0, "dead-node")
+    assert lease.acquire()
+    os.utime(lease.path, (time.time() - 3600, time.time() - 3600))
+
+    workers = [subprocess.Popen(
+        [sys.executable, "distributed.py", "work", job_dir, "--node", f"node{i}", "--heartbeat", "0.2",
+         "--expire", "5", "--no-cache", "--decode-workers", "1", "--encode-workers", "1"],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True) for i in range(3)]
+    logs = [worker.communicate(timeout=120)[0] for worker in workers]
+    assert all(worker.returncode == 0 for worker in workers), logs
+
+    finished = [int(chunk) for log in logs for chunk in re.findall(r"chunk (\d+): \d+ images", log)]
+    assert sorted(finished) == list(range(chunks)), logs  # Every chunk completed by exactly one node
+    processed = sum(int(count) for log in logs for count in re.findall(r"node\d: (\d+) images in", log))
+    assert processed == len(paths)  # No image processed twice
+    assert any("reclaimed expired lease" in log for log in logs)
+
+    states = distributed.chunk_states(job_dir, 5, distributed.server_time(job_dir, "test"))
+    assert set(states.values()) == {"done"}
+    assert os.listdir(os.path.join(job_dir, "leases")) == []
+    assert len(os.listdir(output_dir)) == len(paths) * len(OUTPUTS)
+
+
+def test_break_lease_leaves_fresh_leases(tmp_path):
+    job_dir = str(tmp_path)
+    for sub in ("leases", "clock"):
+        os.makedirs(os.path.join(job_dir, sub))
+    lease = distributed.Lease(job_dir, 0, "node0")
+    assert lease.acquire()
+    now = distributed.server_time(job_dir, "test")
+
+    # Another node saw an expired lease, but node0 has broken it and taken the chunk since
+    assert not distributed.break_lease(lease.path, 5, now)
+    assert lease.held()
+
+    assert distributed.break_lease(lease.path, 5, now + 60)
+    assert not lease.held()
@@ -0,0 +1,162 @@
+import argparse
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+import mapped_io
+import processing
+
+
+def random_image(height, width, channels, dtype=np.uint8, seed=0):
+    shape = (height, width, channels) if channels > 1 else (height, width)
+    return np.random.default_rng(seed).integers(0, np.iinfo(dtype).max, shape, dtype, endpoint=True)
+
+
+def write_image(path, image, **options):
+    channels = image.shape[2] if image.ndim == 3 else 1
+    mapped = mapped_io.create_tiff(path, image.shape[1], image.shape[0], channels, image.dtype, **options)
+    mapped.write_rows(0, image)
+    return mapped
+
+
+def write_tiled_tiff(path, image, tile_width=16, tile_height=16):
+    """A classic little-endian, uncompressed, tiled RGB TIFF of a BGR uint8 image."""
+    height, width = image.shape[:2]
+    down, across = -(-height // tile_height), -(-width // tile_width)
+    padded = np.zeros((down * tile_height, across * tile_width, 3), np.uint8)
+    padded[:height, :width] = image[:, :, ::-1]
+    tiles = [padded[y:y + tile_height, x:x + tile_width].tobytes()
+             for y in range(0, padded.shape[0], tile_height) for x in range(0, padded.shape[1], tile_width)]
+
+    entries = [(256, 4, [width]), (257, 4, [height]), (258, 3, [8, 8, 8]), (259, 3, [1]), (262, 3, [2]),
+               (277, 3, [3]), (322, 4, [tile_width]), (323, 4, [tile_height]), (324, 4, [0] * len(tiles)),
+               (325, 4, [len(tile) for tile in tiles])]
+    extra_offset = 8 + 2 + 12 * len(entries) + 4
+    extra_size = sum({3: 2, 4: 4}[t] * len(v) for _, t, v in entries if {3: 2, 4: 4}[t] * len(v) > 4)
+    data_offset = extra_offset + extra_size
+    entries[8][2][:] = [data_offset + i * len(tiles[0]) for i in range(len(tiles))]
+
+    ifd, extra = struct.pack("<H", len(entries)), b""
+    for tag, field_type, values in entries:
+        packed = struct.pack("<" + {3: "H", 4: "I"}[field_type] * len(values), *values)
+        ifd += struct.pack("<HHI", tag, field_type, len(values))
+        if len(packed) > 4:
+            ifd += struct.pack("<I", extra_offset + len(extra))
+            extra += packed
+        else:
+            ifd += packed.ljust(4, b"\0")
+    ifd += b"\0" * 4
+    with open(path, "wb") as f:
+        f.write(struct.pack("<2sHI", b"II", 42, 8) + ifd + extra + b"".join(tiles))
+
+
+@pytest.mark.parametrize("channels, dtype, bigtiff", [
+    (3, np.uint8, False),
+    (3, np.uint8, True),
+    (1, np.uint16, False),
+    (4, np.uint8, True),
+])
+def test_create_tiff_round_trip(tmp_path, channels, dtype, bigtiff):
+    path = str(tmp_path / "image.tif")
+    image = random_image(45, 23, channels, dtype)
+    write_image(path, image, rows_per_strip=8, bigtiff=bigtiff)
+
+    mapped = mapped_io.open_tiff(path)
+    assert mapped.shape == image.shape
+    assert len(mapped.blocks) == 6
+    assert mapped.contiguous_offset is not None
+    np.testing.assert_array_equal(mapped.read_rows(0, 45), image)
+    np.testing.assert_array_equal(mapped.read_rows(10, 30), image[10:30])
+    with open(path, "rb") as f:
+        assert struct.unpack("<H", f.read(4)[2:])[0] == (43 if bigtiff else 42)
+
+
+def test_create_tiff_is_readable_by_other_readers(tmp_path):
+    path = str(tmp_path / "image.tif")
+    image = random_image(45, 23, 3)
+    write_image(path, image)
+    np.testing.assert_array_equal(cv2.imread(path), image)
+
+
+def test_open_tiled_tiff(tmp_path):
+    path = str(tmp_path / "tiled.tif")
+    image = random_image(37, 21, 3)
+    write_tiled_tiff(path, image)
+    np.testing.assert_array_equal(cv2.imread(path), image)
+
+    mapped = mapped_io.open_tiff(path)
+    assert mapped.shape == image.shape
+    assert mapped.contiguous_offset is None
+    assert len(mapped.blocks) == 3 * 2
+    np.testing.assert_array_equal(mapped.read_rows(0, 37), image)
+    np.testing.assert_array_equal(mapped.read_rows(5, 20), image[5:20])
+    with pytest.raises(ValueError):
+        mapped.write_rows(0, image)
+
+
+@pytest.mark.parametrize("planar", [False, True])
+def test_open_raw(tmp_path, planar):
+    path = str(tmp_path / "image.raw")
+    image = random_image(19, 11, 3)
+    rgb = image[:, :, ::-1]
+    header = b"header"
+    with open(path, "wb") as f:
+        f.write(header + (np.ascontiguousarray(rgb.transpose(2, 0, 1)) if planar else rgb).tobytes())
+
+    mapped = mapped_io.open_raw(path, 11, 19, planar=planar, offset=len(header))
+    assert (mapped.contiguous_offset is None) == planar
+    np.testing.assert_array_equal(mapped.read_rows(0, 19), image)
+    np.testing.assert_array_equal(mapped.read_rows(4, 9), image[4:9])
+    assert [block for _, block in mapped.strips(8)][-1].shape == (3, 11, 3)
+
+
+def test_stream_without_overlap(tmp_path):
+    image = random_image(50, 13, 3)
+    source = write_image(str(tmp_path / "source.tif"), image)
+    output = mapped_io.create_tiff(str(tmp_path / "output.tif"), 13, 50)
+    mapped_io.stream(lambda strip: 255 - strip, [source], output, rows=8)
+    np.testing.assert_array_equal(mapped_io.open_tiff(output.path).read_rows(0, 50), 255 - image)
+
+
+def test_stream_with_overlap(tmp_path):
+    image = random_image(50, 13, 3)
+    source = write_image(str(tmp_path / "source.tif"), image)
+    expected = cv2.GaussianBlur(image, (5, 5), 0)
+
+    output = mapped_io.create_tiff(str(tmp_path / "output.tif"), 13, 50)
+    mapped_io.stream(lambda strip: cv2.GaussianBlur(strip, (5, 5), 0), [source], output, rows=8, overlap=2)
+    np.testing.assert_array_equal(mapped_io.open_tiff(output.path).read_rows(0, 50), expected)
+
+    # Without the context rows the strip edges come out differently
+    mapped_io.stream(lambda strip: cv2.GaussianBlur(strip, (5, 5), 0), [source], output, rows=8)
+    assert not np.array_equal(mapped_io.open_tiff(output.path).read_rows(0, 50), expected)
+
+
+@pytest.mark.parametrize("channels", [1, 3])
+def test_threshold_file(tmp_path, channels):
+    image = random_image(40, 17, channels)
+    write_image(str(tmp_path / "input.tif"), image)
+    args = argparse.Namespace(input=str(tmp_path / "input.tif"), output=str(tmp_path / "output.tif"),
+                              value=127, max_value=255, type="Binary", rows=8)
+    mapped_io.threshold_file(args)
+
+    result = mapped_io.open_tiff(args.output).read_rows(0, 40)
+    np.testing.assert_array_equal(result, processing.threshold_image(image, 127, 255, "Binary"))
+
+
+@pytest.mark.parametrize("channels", [1, 3])
+@pytest.mark.parametrize("mask_range", ["full", "binary"])
+def test_composite_file(tmp_path, channels, mask_range):
+    image = random_image(40, 17, channels)
+    keep = random_image(40, 17, 1, seed=1) > 127
+    write_image(str(tmp_path / "input.tif"), image)
+    write_image(str(tmp_path / "mask.tif"), keep.astype(np.uint8) * (255 if mask_range == "full" else 1))
+    args = argparse.Namespace(input=str(tmp_path / "input.tif"), mask=str(tmp_path / "mask.tif"),
+                              output=str(tmp_path / "output.tif"), threshold=0.5, mask_range=mask_range, rows=8)
+    mapped_io.composite_file(args)
+
+    result = mapped_io.open_tiff(args.output).read_rows(0, 40)
+    expected = np.where(keep[:, :, None] if channels > 1 else keep, image, 255)
+    np.testing.assert_array_equal(result, expected)
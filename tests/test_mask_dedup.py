@@ -0,0 +1,41 @@
+import os
+
+import cv2
+import numpy as np
+
+import processing
+from batch_pipeline import grabcut_segmenter
+from mask_dedup import MaskDeduplicator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def bird(width):
+    image = cv2.imread(os.path.join(ROOT, "data", "bird1.jpg"))
+    return cv2.resize(image, (width, round(image.shape[0] * width / image.shape[1])), interpolation=cv2.INTER_AREA)
+
+
+def test_resized_copy_reuses_batch_grabcut_mask():
+    dedup = MaskDeduplicator()
+    segment = grabcut_segmenter(dedup=dedup)
+    original = segment(bird(320))
+    assert dedup.stats()["misses"] == 1 and original.any()
+
+    copy = bird(240)
+    mask = segment(copy)
+    assert dedup.stats()["hits"] == 1
+    assert mask.shape == copy.shape[:2] and mask.dtype == np.uint8
+    # Background outside the batch rect, as GrabCut itself leaves it
+    assert not mask[:10].any() and not mask[-10:].any() and not mask[:, :10].any() and not mask[:, -10:].any()
+    expected = cv2.resize(original, (copy.shape[1], copy.shape[0]), interpolation=cv2.INTER_NEAREST)
+    assert np.mean(mask[10:-10, 10:-10] == expected[10:-10, 10:-10]) > 0.99
+
+
+def test_other_rect_is_segmented_afresh():
+    dedup = MaskDeduplicator()
+    image = bird(320)
+    height, width = image.shape[:2]
+    processing.grabcut_mask(image, (10, 10, width - 20, height - 20), 2, dedup=dedup)
+    mask = processing.grabcut_mask(image, (60, 40, 120, 100), 2, dedup=dedup)
+    assert dedup.stats()["hits"] == 0
+    assert not mask[:40].any() and not mask[:, :60].any()
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+import mask_format
+
+
+def binary_mask(height=37, width=53, seed=0):
+    rng = np.random.default_rng(seed)
+    mask = np.zeros((height, width), np.uint8)
+    mask[5:30, 10:40] = 1
+    mask[rng.integers(0, height, 20), rng.integers(0, width, 20)] ^= 1
+    return mask
+
+
+@pytest.mark.parametrize("fmt", ["packed", "rle", None])
+def test_binary_round_trip(fmt):
+    mask = binary_mask()
+    data = mask_format.encode(mask, fmt)
+    decoded = mask_format.decode(data)
+    assert decoded.dtype == np.uint8
+    np.testing.assert_array_equal(decoded, mask)
+    if fmt is not None:
+        assert mask_format.read_header(data) == (fmt, 37, 53)
+
+
+def test_soft_round_trip_quantises_to_uint8():
+    mask = np.random.default_rng(1).random((20, 30)).astype(np.float32)
+    decoded = mask_format.decode(mask_format.encode(mask))
+    assert mask_format.read_header(mask_format.encode(mask))[0] == "soft"
+    assert decoded.dtype == np.float32
+    np.testing.assert_allclose(decoded, mask, atol=0.5 / 255 + 1e-6)
+
+
+def test_choose_format_prefers_rle_for_large_regions():
+    mask = np.zeros((200, 200), np.uint8)
+    mask[50:150, 50:150] = 1
+    assert mask_format.choose_format(mask) == "rle"
+    assert mask_format.choose_format(binary_mask()) in ("packed", "rle")
+
+
+@pytest.mark.parametrize("fmt", ["packed", "rle", "soft"])
+@pytest.mark.parametrize("roi", [(0, 0, 53, 37), (3, 4, 20, 10), (45, 30, 8, 7), (9, 0, 1, 1)])
+def test_roi_matches_full_decode(tmp_path, fmt, roi):
+    mask = binary_mask() if fmt != "soft" else np.random.default_rng(2).random((37, 53)).astype(np.float32)
+    data = mask_format.encode(mask, fmt)
+    x, y, w, h = roi
+    full = mask_format.decode(data)
+    np.testing.assert_array_equal(mask_format.decode(data, roi), full[y:y + h, x:x + w])
+
+    path = str(tmp_path / "mask.mask")
+    mask_format.save(path, mask, fmt)
+    np.testing.assert_array_equal(mask_format.load(path, roi), full[y:y + h, x:x + w])
+
+
+def test_rejects_other_data():
+    with pytest.raises(ValueError):
+        mask_format.decode(b"PNG0" + bytes(20))
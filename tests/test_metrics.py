@@ -0,0 +1,65 @@
+import pytest
+
+import metrics
+
+
+def test_counter_renders_labelled_samples():
+    counter = metrics.Counter("images_total", "Images", ("engine", "status"))
+    counter.inc(engine="grabcut", status="ok")
+    counter.inc(2, engine="grabcut", status="ok")
+    counter.inc(engine="threshold", status="failed")
+    assert counter.render() == [
+        "# HELP images_total Images",
+        "# TYPE images_total counter",
+        'images_total{engine="grabcut",status="ok"} 3',
+        'images_total{engine="threshold",status="failed"} 1',
+    ]
+
+
+def test_labels_must_match():
+    counter = metrics.Counter("c", "C", ("engine",))
+    with pytest.raises(ValueError):
+        counter.inc(stage="decode")
+
+
+def test_label_values_are_escaped():
+    gauge = metrics.Gauge("g", "G", ("queue",))
+    gauge.set(1.5, queue='a"b\\c\nd')
+    assert gauge.render()[-1] == 'g{queue="a\\"b\\\\c\\nd"} 1.5'
+
+
+def test_gauge_functions_are_read_at_render_time():
+    values = [1]
+    gauge = metrics.Gauge("depth", "Depth")
+    gauge.set_function(lambda: values[-1])
+    values.append(7)
+    assert gauge.render()[-1] == "depth 7"
+
+    gauge.set_function(lambda: 1 / 0)  # Its object has gone away: the sample is left out
+    assert gauge.render() == ["# HELP depth Depth", "# TYPE depth gauge"]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("seconds", "Seconds", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, stage="segment")
+    assert histogram.render()[2:] == [
+        'seconds_bucket{stage="segment",le="0.1"} 2',
+        'seconds_bucket{stage="segment",le="1.0"} 3',
+        'seconds_bucket{stage="segment",le="+Inf"} 4',
+        'seconds_sum{stage="segment"} 3.65',
+        'seconds_count{stage="segment"} 4',
+    ]
+
+
+def test_registry_writes_every_metric(tmp_path):
+    registry = metrics.Registry()
+    registry.register(metrics.Counter("a_total", "A")).inc()
+    with registry.register(metrics.Histogram("b_seconds", "B", buckets=(1.0,))).time():
+        pass
+    path = str(tmp_path / "run.prom")
+    registry.write(path)
+    with open(path) as f:
+        text = f.read()
+    assert text == registry.render() and text.endswith("\n")
+    assert "a_total 1\n" in text and 'b_seconds_bucket{le="1.0"} 1\n' in text and "b_seconds_count 1\n" in text
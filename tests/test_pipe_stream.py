@@ -0,0 +1,85 @@
+import io
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+import mask_format
+from pipe_stream import PipeStream, read_frames, write_frame
+
+
+def test_frames_round_trip():
+    payloads = [b"first", b"", bytes(range(256)) * 10]
+    stream = io.BytesIO()
+    for payload in payloads:
+        write_frame(stream, payload)
+    assert stream.getvalue()[:8] == b"\x00\x00\x00\x00\x00\x00\x00\x05"  # 8-byte big-endian length
+    stream.seek(0)
+    assert list(read_frames(stream)) == payloads
+
+
+def test_empty_stream_has_no_frames():
+    assert list(read_frames(io.BytesIO())) == []
+
+
+@pytest.mark.parametrize("cut", [3, 8 + 2])
+def test_truncated_stream_raises(cut):
+    stream = io.BytesIO()
+    write_frame(stream, b"payload")
+    frames = read_frames(io.BytesIO(stream.getvalue()[:cut]))
+    with pytest.raises(EOFError):
+        list(frames)
+
+
+def test_results_keep_input_order():
+    rng = np.random.default_rng(0)
+    images = [cv2.imencode(".png", rng.integers(0, 256, (20 + i, 30, 3), np.uint8))[1].tobytes() for i in range(6)]
+    output, metadata = io.BytesIO(), io.StringIO()
+    stream = PipeStream(output, metadata, "threshold", "mask", decode_workers=3, encode_workers=3)
+    stream.start()
+    for i, data in enumerate(images):
+        stream.submit(data if i != 2 else b"not an image")
+    stream.finish()
+
+    output.seek(0)
+    results = list(read_frames(output))
+    records = [json.loads(line) for line in metadata.getvalue().splitlines()]
+    assert [record["seq"] for record in records] == list(range(6))
+    assert results[2] == b"" and "error" in records[2]
+    for i in (0, 1, 3, 4, 5):
+        assert mask_format.decode(results[i]).shape == (20 + i, 30)
+        assert records[i]["height"] == 20 + i
+
+
+class BrokenPipe(io.BytesIO):
+    def __init__(self, frames):
+        super().__init__()
+        self.frames = frames  # Frames written before the reader goes away
+
+    def write(self, data):
+        if self.frames == 0:
+            raise BrokenPipeError("reader closed the pipe")
+        if len(data) != 8:
+            self.frames -= 1
+        return super().write(data)
+
+
+def test_write_failure_aborts_the_stream():
+    image = cv2.imencode(".png", np.zeros((20, 30, 3), np.uint8))[1].tobytes()
+    output, metadata = BrokenPipe(1), io.StringIO()
+    stream = PipeStream(output, metadata, "threshold", "mask", decode_workers=3, encode_workers=3)
+    stream.start()
+    with pytest.raises(BrokenPipeError):
+        try:
+            for _ in range(20):
+                stream.submit(image)
+        finally:
+            stream.finish()
+
+    # Every result still went through the writer, and nothing is left waiting
+    assert stream.pending == {}
+    assert stream.next_seq == stream.submitted
+    output.seek(0)
+    assert len(list(read_frames(output))) == 1
+    assert [json.loads(line)["seq"] for line in metadata.getvalue().splitlines()] == [0]
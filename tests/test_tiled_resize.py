@@ -0,0 +1,70 @@
+import random
+import warnings
+
+import cv2
+import numpy as np
+import pytest
+
+import tiled_resize
+
+INTERPOLATIONS = [cv2.INTER_NEAREST, cv2.INTER_NEAREST_EXACT, cv2.INTER_LINEAR, cv2.INTER_LINEAR_EXACT,
+                  cv2.INTER_CUBIC, cv2.INTER_AREA, cv2.INTER_LANCZOS4]
+
+
+def check(src_height, dst_height, interpolation, channels=3, max_strip_bytes=1):
+    shape = (src_height, 7, channels) if channels > 1 else (src_height, 7)
+    image = np.random.default_rng(src_height).integers(0, 256, shape, np.uint8)
+    expected = cv2.resize(image, (5, dst_height), interpolation=interpolation)
+    actual = tiled_resize.tiled_resize(image, 5, dst_height, interpolation, max_strip_bytes=max_strip_bytes)
+    np.testing.assert_array_equal(actual, expected)
+
+
+@pytest.mark.filterwarnings("ignore:Resizing")
+@pytest.mark.parametrize("src_height, dst_height, interpolation", [
+    (3042, 1404, cv2.INTER_NEAREST),
+    (2310, 6006, cv2.INTER_AREA),
+    (5173, 7390, cv2.INTER_AREA),
+    (696, 304, cv2.INTER_AREA),
+    (1144, 1444, cv2.INTER_CUBIC),
+])
+def test_matches_cv2_on_unaligned_sizes(src_height, dst_height, interpolation):
+    check(src_height, dst_height, interpolation)
+
+
+@pytest.mark.filterwarnings("ignore:Resizing")
+def test_matches_cv2_on_random_sizes():
+    rng = random.Random(0)
+    tiled = 0
+    for _ in range(300):
+        src_height = rng.randint(2, 4000)
+        dst_height = rng.choice([rng.randint(2, 4000), src_height * 2, max(1, src_height // 2),
+                                 max(1, src_height * rng.randint(1, 8) // rng.choice([1, 2, 4, 8]))])
+        interpolation = rng.choice(INTERPOLATIONS)
+        if tiled_resize.can_tile(src_height, dst_height, interpolation):
+            tiled += 1
+        check(src_height, dst_height, interpolation, channels=rng.choice([1, 3]),
+              max_strip_bytes=rng.choice([1, 4096]))
+    assert tiled > 100  # Most cases really went through strips
+
+
+def test_writes_into_memmap(tmp_path):
+    image = np.random.default_rng(1).integers(0, 256, (1024, 40, 3), np.uint8)
+    out = np.memmap(str(tmp_path / "out.raw"), np.uint8, "w+", shape=(512, 20, 3))
+    result = tiled_resize.tiled_resize(image, 20, 512, cv2.INTER_AREA, out=out, max_strip_bytes=4096)
+    assert result is out
+    np.testing.assert_array_equal(out, cv2.resize(image, (20, 512), interpolation=cv2.INTER_AREA))
+
+
+def test_rejects_wrong_out_shape():
+    with pytest.raises(ValueError):
+        tiled_resize.tiled_resize(np.zeros((10, 10), np.uint8), 5, 5, out=np.zeros((4, 5), np.uint8))
+
+
+def test_warns_when_it_cannot_split():
+    image = np.zeros((696, 7, 3), np.uint8)
+    with pytest.warns(UserWarning, match="cannot be split exactly"):
+        tiled_resize.tiled_resize(image, 5, 304, cv2.INTER_AREA, max_strip_bytes=1024)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        tiled_resize.tiled_resize(image, 5, 348, cv2.INTER_AREA, max_strip_bytes=1024)  # Exact 2x: split
+        tiled_resize.tiled_resize(image, 5, 304, cv2.INTER_AREA)  # Fits in one strip anyway
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+import torch
+
+from u2net_engine import OnnxU2NetEngine, U2NetEngine, U2NetSelector
+
+INPUT_SIZE = 64
+
+
+@pytest.fixture(scope="module")
+def engine():
+    torch.manual_seed(0)
+    return U2NetEngine(None, INPUT_SIZE, architecture="u2netp")
+
+
+def test_predict_shape_and_range(engine):
+    image = np.random.default_rng(0).integers(0, 256, (90, 130, 3), dtype=np.uint8)
+    mask = engine.predict(image)
+    assert mask.shape == (90, 130)
+    assert mask.dtype == np.float32
+    assert mask.min() >= 0 and mask.max() <= 1
+
+
+def test_infer_normalises_each_image(engine):
+    batch = torch.cat([engine.preprocess(np.full((40, 40, 3), value, np.uint8)) for value in (30, 200)])
+    saliency = engine.infer(batch)
+    assert saliency.shape == (2, INPUT_SIZE, INPUT_SIZE)
+    for single in saliency:
+        assert single.min() == pytest.approx(0, abs=1e-6)
+        assert single.max() == pytest.approx(1, abs=1e-3)
+
+
+def test_onnx_matches_torch(engine, tmp_path):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("onnx")
+    from u2net_export import export_onnx
+
+    onnx_path = str(tmp_path / "u2netp.onnx")
+    export_onnx(engine.model, onnx_path, INPUT_SIZE)
+    onnx_engine = OnnxU2NetEngine(onnx_path, INPUT_SIZE, architecture="u2netp")
+
+    image = np.random.default_rng(1).integers(0, 256, (70, 50, 3), dtype=np.uint8)
+    batch = engine.preprocess(image)
+    np.testing.assert_allclose(onnx_engine.forward(batch), engine.forward(batch), atol=1e-4)
+    np.testing.assert_allclose(onnx_engine.predict(image), engine.predict(image), atol=1e-3)
+
+
+def test_selector_uses_full_model_without_budget():
+    selector = U2NetSelector()
+    assert selector.choose((480, 640)) == "u2net"
+    assert selector.choose((480, 640), latency_budget_ms=10_000) == "u2net"
+    assert selector.choose((480, 640), latency_budget_ms=100) == "u2netp"
+    # Larger images cost more pre- and post-processing
+    assert selector.estimate("u2net", (4000, 6000)) > selector.estimate("u2net", (480, 640))
+
+
+def test_selector_estimates_follow_observed_latency():
+    selector = U2NetSelector(smoothing=0.5)
+    selector.observe("u2net", (1000, 1000), network_ms=200.0, io_ms=5.0)
+    assert selector.network_ms["u2net"] == pytest.approx((600.0 + 200.0) / 2)
+    assert selector.ms_per_megapixel == pytest.approx((15.0 + 5.0) / 2)
+    assert selector.network_ms["u2netp"] == 60.0
+    for _ in range(30):
+        selector.observe("u2net", (1000, 1000), network_ms=200.0, io_ms=5.0)
+    assert selector.estimate("u2net", (1000, 1000)) == pytest.approx(205.0, abs=0.1)
+    assert selector.choose((1000, 1000), latency_budget_ms=250) == "u2net"
+
+
+def test_auto_segmenter_picks_per_image(monkeypatch, engine):
+    import batch_pipeline
+    import u2net_engine
+
+    small = U2NetEngine(None, INPUT_SIZE, architecture="u2netp")
+    monkeypatch.setattr(u2net_engine, "get_engine",
+                        lambda weights, input_size, threads, backend, architecture:
+                        engine if architecture == "u2net" else small)
+    segment = batch_pipeline.u2net_segmenter(architecture="auto", latency_budget_ms=1.0)
+    image = np.random.default_rng(1).integers(0, 256, (40, 50, 3), dtype=np.uint8)
+    np.testing.assert_allclose(segment(image), small.predict(image), atol=1e-6)
+    np.testing.assert_allclose(segment(image, None), engine.predict(image), atol=1e-6)
@@ -0,0 +1,116 @@
+import threading
+import time
+
+import numpy as np
+import torch
+
+import processing
+from u2net_batcher import DEFAULT_BUCKETS, U2NetBatcher, choose_bucket
+from u2net_engine import U2NetEngine
+
+
+class FakeEngine:
+    """Marks each image with its top-left pixel value and records the batches it ran."""
+
+    def __init__(self, delay=0.0):
+        self.batches = []
+        self.delay = delay
+
+    def preprocess(self, image, size):
+        return torch.full((1, 3, size[1], size[0]), float(image[0, 0, 0]))
+
+    def infer(self, batch):
+        time.sleep(self.delay)
+        self.batches.append(tuple(batch.shape))
+        return batch[:, 0].numpy()
+
+
+def image(value, height=30, width=30):
+    return np.full((height, width, 3), value, np.uint8)
+
+
+def test_choose_bucket_by_aspect_ratio():
+    assert choose_bucket(1000, 1000) == (320, 320)
+    assert choose_bucket(1920, 1080) == (448, 256)
+    assert choose_bucket(600, 800) == (288, 384)
+
+
+def test_masks_go_back_to_their_callers():
+    engine = FakeEngine(delay=0.01)
+    batcher = U2NetBatcher(engine, max_batch=4, max_wait=0.05)
+    shapes = [(30, 30), (40, 70), (70, 40), (25, 33), (90, 50)]
+    results = {}
+
+    def call(i):
+        height, width = shapes[i % len(shapes)]
+        results[i] = batcher.predict(image(i, height, width))
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    for i, mask in results.items():
+        assert mask.shape == shapes[i % len(shapes)]
+        assert np.all(mask == i)
+    assert len(results) == 20
+    assert sum(shape[0] for shape in engine.batches) == 20
+    assert all(shape[0] <= 4 for shape in engine.batches)
+    # Every batch holds a single bucket's input shape
+    assert {shape[2:] for shape in engine.batches} <= {(height, width) for width, height in DEFAULT_BUCKETS}
+
+
+def test_full_batch_runs_without_waiting():
+    engine = FakeEngine()
+    batcher = U2NetBatcher(engine, max_batch=3, max_wait=30.0)
+    start = time.monotonic()
+    futures = [batcher.submit(image(i)) for i in range(3)]
+    assert [future.result(timeout=5).mean() for future in futures] == [0, 1, 2]
+    assert time.monotonic() - start < 5
+    assert engine.batches == [(3, 3, 320, 320)]
+    batcher.close()
+
+
+def test_partial_batch_runs_after_max_wait():
+    engine = FakeEngine()
+    batcher = U2NetBatcher(engine, max_batch=8, max_wait=0.1)
+    start = time.monotonic()
+    future = batcher.submit(image(5))
+    assert future.result(timeout=5).mean() == 5
+    assert time.monotonic() - start >= 0.1
+    assert engine.batches == [(1, 3, 320, 320)]
+    assert batcher.stats()["batch_fill"] == 1 / 8
+    batcher.close()
+
+
+def test_close_runs_pending_requests():
+    engine = FakeEngine()
+    batcher = U2NetBatcher(engine, max_batch=8, max_wait=60.0)
+    futures = [batcher.submit(image(i, 30, 60)) for i in range(3)]
+    start = time.monotonic()
+    batcher.close()
+    assert time.monotonic() - start < 5
+    assert [future.result(timeout=0).mean() for future in futures] == [0, 1, 2]
+
+
+def test_errors_reach_every_caller_in_the_batch():
+    engine = FakeEngine()
+    engine.infer = lambda batch: 1 / 0
+    batcher = U2NetBatcher(engine, max_batch=2, max_wait=30.0)
+    futures = [batcher.submit(image(i)) for i in range(2)]
+    for future in futures:
+        assert isinstance(future.exception(timeout=5), ZeroDivisionError)
+    batcher.close()
+
+
+def test_u2net_mask_through_a_batcher():
+    torch.manual_seed(0)
+    engine = U2NetEngine(None, architecture="u2netp")
+    batcher = U2NetBatcher(engine, max_batch=2, max_wait=0.01)
+    rgb = np.random.default_rng(0).integers(0, 256, (60, 100, 3), np.uint8)
+    mask = processing.u2net_mask(rgb, engine, batcher=batcher)
+    batcher.close()
+    assert mask.shape == (60, 100) and mask.dtype == np.float32
+    assert 0 <= mask.min() and mask.max() <= 1
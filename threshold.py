@@ -1,7 +1,7 @@
 import tkinter as tk
 from tkinter import filedialog, ttk
 import cv2
-from PIL import Image, ImageTk
+from canvas_view import show_image, show_line
 import numpy as np
 
 class ImageProcessor:
@@ -179,14 +179,12 @@ class ImageProcessor:
         combined = np.copy(original_display)
         combined[:, split_position:] = thresholded_display[:, split_position:]
         
-        # Convert to PhotoImage and display
-        photo = ImageTk.PhotoImage(Image.fromarray(combined))
-        self.comparison_canvas.delete("all")
-        self.comparison_canvas.create_image(canvas_width//2, canvas_height//2, image=photo, anchor=tk.CENTER)
-        self.comparison_canvas.image = photo
+        # Update the comparison view in place
+        show_image(self.comparison_canvas, combined, canvas_width//2, canvas_height//2)
         
         # Draw slider line
-        self.comparison_canvas.create_line(
+        show_line(
+            self.comparison_canvas, "split",
             split_position, 0,
             split_position, canvas_height,
             fill='white',
@@ -0,0 +1,89 @@
+import math
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# Source rows a destination row reads on each side, per interpolation
+KERNEL_RADIUS = {
+    cv2.INTER_NEAREST: 1,
+    cv2.INTER_NEAREST_EXACT: 1,
+    cv2.INTER_LINEAR: 1,
+    cv2.INTER_LINEAR_EXACT: 1,
+    cv2.INTER_CUBIC: 2,
+    cv2.INTER_AREA: 1,
+    cv2.INTER_LANCZOS4: 4,
+}
+
+# Only the fixed-point INTER_LINEAR_EXACT computes its row positions exactly.
+# The others compute them in floating point from the row index (INTER_AREA
+# also when it enlarges or shrinks by a non-integer factor), so a strip
+# only reproduces the whole-image rows when the positions are exact binary
+# fractions
+POSITION_EXACT = (cv2.INTER_LINEAR_EXACT,)
+
+
+def row_alignment(src_height, dst_height):
+    """(source rows, destination rows) of the smallest block that maps onto whole rows."""
+    g = math.gcd(src_height, dst_height)
+    return src_height // g, dst_height // g
+
+
+def can_tile(src_height, dst_height, interpolation):
+    """True when strips resized on their own are bit-identical to one whole-image resize."""
+    if interpolation not in KERNEL_RADIUS:
+        return False
+    _, dst_step = row_alignment(src_height, dst_height)
+    if interpolation in POSITION_EXACT:
+        return True
+    return dst_step & (dst_step - 1) == 0  # Power of two
+
+
+def tiled_resize(image, width, height, interpolation=cv2.INTER_AREA, out=None,
+                 max_strip_bytes=64 * 1024 * 1024, max_workers=None):
+    """cv2.resize in horizontal strips on a thread pool, writing into out.
+
+    Strips start on rows where source and destination line up exactly and
+    carry enough extra source rows for the interpolation kernel, so the
+    result is bit-identical to cv2.resize on the whole image. Only one
+    strip per worker is resident at a time: image may be a np.memmap and
+    out a preallocated array or np.memmap (a new array by default).
+    max_strip_bytes bounds the source rows per strip; combinations that
+    cannot be split exactly (see can_tile) fall back to a single call,
+    which reads the whole source into memory and warns when it is larger
+    than max_strip_bytes.
+    """
+    src_height, src_width = image.shape[:2]
+    if out is None:
+        out = np.empty((height, width) + image.shape[2:], dtype=image.dtype)
+    if out.shape[:2] != (height, width):
+        raise ValueError(f"out has shape {out.shape}, expected {height}x{width}")
+
+    src_step, dst_step = row_alignment(src_height, height)
+    row_bytes = image.nbytes // src_height
+    strip_steps = max(1, max_strip_bytes // (row_bytes * src_step))
+    strip = strip_steps * dst_step
+    if strip >= height or not can_tile(src_height, height, interpolation):
+        if strip < height:
+            warnings.warn(f"Resizing {src_height} to {height} rows with interpolation {interpolation} cannot be "
+                          f"split exactly; reading all {image.nbytes} bytes of the source at once",
+                          stacklevel=2)
+        out[:] = cv2.resize(np.asarray(image), (width, height), interpolation=interpolation)
+        return out
+
+    # Kernel radius plus the source rows one destination row spans, rounded up to whole blocks
+    margin_rows = KERNEL_RADIUS[interpolation] + math.ceil(src_height / height) + 1
+    margin = math.ceil(margin_rows / src_step) * dst_step
+
+    def resize_strip(y0):
+        y1 = min(y0 + strip, height)
+        top = max(0, y0 - margin)
+        bottom = min(height, y1 + margin)
+        source = np.asarray(image[top * src_step // dst_step:bottom * src_step // dst_step])
+        resized = cv2.resize(source, (width, bottom - top), interpolation=interpolation)
+        out[y0:y1] = resized[y0 - top:y1 - top]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        list(pool.map(resize_strip, range(0, height, strip)))
+    return out
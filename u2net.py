@@ -0,0 +1,162 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class REBNCONV(nn.Module):
+    """3x3 (dilated) convolution, batch norm and ReLU."""
+
+    def __init__(self, in_ch=3, out_ch=3, dirate=1):
+        super().__init__()
+        self.conv_s1 = nn.Conv2d(in_ch, out_ch, 3, padding=dirate, dilation=dirate)
+        self.bn_s1 = nn.BatchNorm2d(out_ch)
+        self.relu_s1 = nn.ReLU(inplace=True)
+
+    def forward(self, x):
+        return self.relu_s1(self.bn_s1(self.conv_s1(x)))
+
+
+def _upsample_like(src, tar):
+    return F.interpolate(src, size=tar.shape[2:], mode='bilinear', align_corners=False)
+
+
+class RSU(nn.Module):
+    """Residual U-block of the given height (RSU-7 ... RSU-4).
+
+    Layer names follow the reference implementation so that the published
+    checkpoints load unchanged.
+    """
+
+    def __init__(self, height, in_ch=3, mid_ch=12, out_ch=3):
+        super().__init__()
+        self.height = height
+        self.rebnconvin = REBNCONV(in_ch, out_ch, dirate=1)
+        self.rebnconv1 = REBNCONV(out_ch, mid_ch, dirate=1)
+        for i in range(1, height - 1):
+            setattr(self, f'pool{i}', nn.MaxPool2d(2, stride=2, ceil_mode=True))
+            setattr(self, f'rebnconv{i + 1}', REBNCONV(mid_ch, mid_ch, dirate=1))
+        setattr(self, f'rebnconv{height}', REBNCONV(mid_ch, mid_ch, dirate=2))
+        for i in range(height - 1, 1, -1):
+            setattr(self, f'rebnconv{i}d', REBNCONV(mid_ch * 2, mid_ch, dirate=1))
+        self.rebnconv1d = REBNCONV(mid_ch * 2, out_ch, dirate=1)
+
+    def forward(self, x):
+        hxin = self.rebnconvin(x)
+
+        # Encoder
+        encoded = [self.rebnconv1(hxin)]
+        for i in range(1, self.height - 1):
+            hx = getattr(self, f'pool{i}')(encoded[-1])
+            encoded.append(getattr(self, f'rebnconv{i + 1}')(hx))
+        hx = getattr(self, f'rebnconv{self.height}')(encoded[-1])
+
+        # Decoder
+        for i in range(self.height - 1, 0, -1):
+            hx = getattr(self, f'rebnconv{i}d')(torch.cat((hx, encoded[i - 1]), 1))
+            if i > 1:
+                hx = _upsample_like(hx, encoded[i - 2])
+
+        return hx + hxin
+
+
+class RSU4F(nn.Module):
+    """Residual U-block that uses dilation instead of pooling."""
+
+    def __init__(self, in_ch=3, mid_ch=12, out_ch=3):
+        super().__init__()
+        self.rebnconvin = REBNCONV(in_ch, out_ch, dirate=1)
+        self.rebnconv1 = REBNCONV(out_ch, mid_ch, dirate=1)
+        self.rebnconv2 = REBNCONV(mid_ch, mid_ch, dirate=2)
+        self.rebnconv3 = REBNCONV(mid_ch, mid_ch, dirate=4)
+        self.rebnconv4 = REBNCONV(mid_ch, mid_ch, dirate=8)
+        self.rebnconv3d = REBNCONV(mid_ch * 2, mid_ch, dirate=4)
+        self.rebnconv2d = REBNCONV(mid_ch * 2, mid_ch, dirate=2)
+        self.rebnconv1d = REBNCONV(mid_ch * 2, out_ch, dirate=1)
+
+    def forward(self, x):
+        hxin = self.rebnconvin(x)
+        hx1 = self.rebnconv1(hxin)
+        hx2 = self.rebnconv2(hx1)
+        hx3 = self.rebnconv3(hx2)
+        hx4 = self.rebnconv4(hx3)
+        hx3d = self.rebnconv3d(torch.cat((hx4, hx3), 1))
+        hx2d = self.rebnconv2d(torch.cat((hx3d, hx2), 1))
+        hx1d = self.rebnconv1d(torch.cat((hx2d, hx1), 1))
+        return hx1d + hxin
+
+
+def _block(height, in_ch, mid_ch, out_ch):
+    if height == 'F':
+        return RSU4F(in_ch, mid_ch, out_ch)
+    return RSU(height, in_ch, mid_ch, out_ch)
+
+
+# (block height, in, mid, out) for the encoder stages 1-6 and decoder stages 5d-1d
+U2NET_CONFIG = {
+    'encoder': [(7, 3, 32, 64), (6, 64, 32, 128), (5, 128, 64, 256),
+                (4, 256, 128, 512), ('F', 512, 256, 512), ('F', 512, 256, 512)],
+    'decoder': [('F', 1024, 256, 512), (4, 1024, 128, 256), (5, 512, 64, 128),
+                (6, 256, 32, 64), (7, 128, 16, 64)],
+    'side': [64, 64, 128, 256, 512, 512],
+}
+
+# Small variant: same topology with 16 mid / 64 out channels everywhere
+U2NETP_CONFIG = {
+    'encoder': [(7, 3, 16, 64), (6, 64, 16, 64), (5, 64, 16, 64),
+                (4, 64, 16, 64), ('F', 64, 16, 64), ('F', 64, 16, 64)],
+    'decoder': [('F', 128, 16, 64), (4, 128, 16, 64), (5, 128, 16, 64),
+                (6, 128, 16, 64), (7, 128, 16, 64)],
+    'side': [64, 64, 64, 64, 64, 64],
+}
+
+
+class U2NET(nn.Module):
+    """U^2-Net salient object detection network."""
+
+    def __init__(self, in_ch=3, out_ch=1, config=U2NET_CONFIG):
+        super().__init__()
+        encoder = [(h, in_ch if i == 0 else i_ch, m, o) for i, (h, i_ch, m, o) in enumerate(config['encoder'])]
+        for i, (height, block_in, mid, block_out) in enumerate(encoder, start=1):
+            setattr(self, f'stage{i}', _block(height, block_in, mid, block_out))
+            if i < len(encoder):
+                setattr(self, f'pool{i}{i + 1}', nn.MaxPool2d(2, stride=2, ceil_mode=True))
+        for i, (height, block_in, mid, block_out) in zip(range(5, 0, -1), config['decoder']):
+            setattr(self, f'stage{i}d', _block(height, block_in, mid, block_out))
+        for i, side_in in enumerate(config['side'], start=1):
+            setattr(self, f'side{i}', nn.Conv2d(side_in, out_ch, 3, padding=1))
+        self.outconv = nn.Conv2d(6 * out_ch, out_ch, 1)
+
+    def forward(self, x):
+        # Encoder
+        encoded = []
+        hx = x
+        for i in range(1, 7):
+            if i > 1:
+                hx = getattr(self, f'pool{i - 1}{i}')(hx)
+            hx = getattr(self, f'stage{i}')(hx)
+            encoded.append(hx)
+
+        # Decoder
+        decoded = [encoded[5]]
+        hx = _upsample_like(encoded[5], encoded[4])
+        for i in range(5, 0, -1):
+            hx = getattr(self, f'stage{i}d')(torch.cat((hx, encoded[i - 1]), 1))
+            decoded.append(hx)
+            if i > 1:
+                hx = _upsample_like(hx, encoded[i - 2])
+
+        # Side outputs: decoded holds hx6, hx5d, ..., hx1d
+        d1 = self.side1(decoded[5])
+        sides = [d1]
+        for i in range(2, 7):
+            sides.append(_upsample_like(getattr(self, f'side{i}')(decoded[6 - i]), d1))
+        d0 = self.outconv(torch.cat(sides, 1))
+
+        return tuple(torch.sigmoid(d) for d in [d0] + sides)
+
+
+class U2NETP(U2NET):
+    """Lightweight U^2-Net (about 1.1M parameters instead of 44M)."""
+
+    def __init__(self, in_ch=3, out_ch=1):
+        super().__init__(in_ch, out_ch, U2NETP_CONFIG)
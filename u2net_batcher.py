@@ -0,0 +1,132 @@
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import cv2
+import torch
+
+# Network input (width, height) per aspect-ratio bucket, all multiples of 32
+DEFAULT_BUCKETS = [
+    (320, 320),  # ~1:1
+    (384, 288),  # ~4:3 landscape
+    (288, 384),  # ~3:4 portrait
+    (448, 256),  # ~16:9 landscape
+    (256, 448),  # ~9:16 portrait
+]
+
+
+def choose_bucket(width, height, buckets=DEFAULT_BUCKETS):
+    """Return the bucket whose aspect ratio is closest to width / height."""
+    ratio = math.log(width / height)
+    return min(buckets, key=lambda bucket: abs(math.log(bucket[0] / bucket[1]) - ratio))
+
+
+class U2NetBatcher:
+    """Group concurrent U2-Net requests into batches that share one forward pass.
+
+    Images are routed to the bucket with the nearest aspect ratio and resized
+    to that bucket's fixed input shape. A bucket is run as soon as it holds
+    max_batch images or its oldest request has waited max_wait seconds, and
+    every caller gets its own mask back at its original size.
+    """
+
+    def __init__(self, engine, max_batch=8, max_wait=0.02, buckets=DEFAULT_BUCKETS):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.buckets = list(buckets)
+        self.pending = {bucket: deque() for bucket in self.buckets}
+        self.condition = threading.Condition()
+        self.closed = False
+
+        # Batch fill statistics
+        self.batches = 0
+        self.images = 0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, image):
+        """Queue a BGR image and return a Future for its float32 mask."""
+        height, width = image.shape[:2]
+        bucket = choose_bucket(width, height, self.buckets)
+        # Preprocessing runs on the caller's thread, in parallel with inference
+        tensor = self.engine.preprocess(image, bucket)
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Batcher is closed")
+            self.pending[bucket].append((time.monotonic(), tensor, (width, height), future))
+            self.condition.notify()
+        return future
+
+    def predict(self, image):
+        return self.submit(image).result()
+
+    def close(self):
+        """Run what is still queued, then stop the worker thread."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+    def batch_fill(self):
+        """Average fraction of max_batch used by the batches run so far."""
+        if not self.batches:
+            return 0.0
+        return self.images / (self.batches * self.max_batch)
+
+    def stats(self):
+        return {"batches": self.batches, "images": self.images, "batch_fill": self.batch_fill()}
+
+    def _next_batch(self):
+        """Pop a ready batch, or return (None, seconds until the next deadline)."""
+        now = time.monotonic()
+        wait = None
+        for bucket, queue in self.pending.items():
+            if not queue:
+                continue
+            deadline = queue[0][0] + self.max_wait
+            if len(queue) >= self.max_batch or deadline <= now or self.closed:
+                count = min(len(queue), self.max_batch)
+                return [queue.popleft() for _ in range(count)], None
+            wait = deadline - now if wait is None else min(wait, deadline - now)
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self.condition:
+                batch, wait = self._next_batch()
+                while batch is None:
+                    if self.closed:
+                        return
+                    self.condition.wait(wait)
+                    batch, wait = self._next_batch()
+
+            self.batches += 1
+            self.images += len(batch)
+            try:
+                saliency = self.engine.infer(torch.cat([tensor for _, tensor, _, _ in batch]))
+            except Exception as e:
+                for _, _, _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            # Scatter each mask back at its caller's size
+            for mask, (_, _, size, future) in zip(saliency, batch):
+                future.set_result(cv2.resize(mask, size, interpolation=cv2.INTER_LINEAR))
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(engine, max_batch=8, max_wait=0.02):
+    """Return the batcher shared by every caller of engine, so their requests batch together."""
+    key = (id(engine), max_batch, max_wait)
+    with _batchers_lock:
+        if key not in _batchers:
+            _batchers[key] = U2NetBatcher(engine, max_batch, max_wait)
+        return _batchers[key]
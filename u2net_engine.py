@@ -0,0 +1,207 @@
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from u2net import U2NET, U2NETP
+
+DEFAULT_WEIGHTS = os.path.join('.', 'saved_models', 'u2net_portrait', 'u2net_portrait.pth')
+U2NETP_WEIGHTS = os.path.join('.', 'saved_models', 'u2netp', 'u2netp.pth')
+
+# Architecture name -> (network class, default weights)
+ARCHITECTURES = {
+    'u2net': (U2NET, DEFAULT_WEIGHTS),
+    'u2netp': (U2NETP, U2NETP_WEIGHTS),
+}
+
+# Selectable inference backends and the artefact each one loads
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+# ImageNet statistics used when the published models were trained (RGB order)
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+class U2NetEngine:
+    """CPU inference for U^2-Net saliency masks.
+
+    The weights are loaded once when the engine is created. Pass
+    weights_path=None to use randomly initialised weights (tests and
+    benchmarks without the model download).
+    """
+
+    name = "u2net"
+    backend = "torch"
+
+    def __init__(self, weights_path=DEFAULT_WEIGHTS, input_size=320, num_threads=None, architecture='u2net'):
+        self.weights_path = weights_path
+        self.input_size = input_size
+        self.architecture = architecture
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+
+        self.model = ARCHITECTURES[architecture][0](3, 1)
+        if weights_path is not None:
+            if not os.path.exists(weights_path):
+                raise FileNotFoundError(
+                    f"{architecture} weights not found at {weights_path}. "
+                    "Download them as described in the README."
+                )
+            self.model.load_state_dict(torch.load(weights_path, map_location='cpu'))
+        self.model.eval()
+
+    def preprocess(self, image, size=None):
+        """Resize a BGR image to the network input and normalise it into a 1x3xHxW tensor.
+
+        size is the (width, height) of the network input, square input_size by default.
+        """
+        if size is None:
+            size = (self.input_size, self.input_size)
+        interpolation = cv2.INTER_AREA if image.shape[1] > size[0] else cv2.INTER_LINEAR
+        resized = cv2.resize(image, size, interpolation=interpolation)
+
+        rgb = resized[:, :, ::-1].astype(np.float32)
+        rgb /= max(float(rgb.max()), 1e-6)
+        rgb -= MEAN
+        rgb /= STD
+        return torch.from_numpy(np.ascontiguousarray(rgb.transpose(2, 0, 1)))[None]
+
+    def forward(self, batch):
+        """Run the network on an Nx3xHxW tensor and return the fused output as an NxHxW array."""
+        with torch.inference_mode():
+            return self.model(batch)[0][:, 0].numpy()
+
+    def infer(self, batch):
+        """Run the network on an Nx3xHxW tensor and return N min-max normalised saliency maps."""
+        d0 = self.forward(batch)
+        low = d0.min(axis=(1, 2), keepdims=True)
+        high = d0.max(axis=(1, 2), keepdims=True)
+        return (d0 - low) / np.maximum(high - low, 1e-6)
+
+    def predict(self, image):
+        """Return a float32 saliency mask in [0, 1] with the same height and width as image."""
+        saliency = self.infer(self.preprocess(image))[0]
+        height, width = image.shape[:2]
+        return cv2.resize(saliency, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+class OnnxU2NetEngine(U2NetEngine):
+    """U^2-Net exported to ONNX and run with ONNX Runtime (float32 or int8 graph)."""
+
+    backend = "onnx"
+
+    def __init__(self, onnx_path, input_size=320, num_threads=None, architecture='u2net'):
+        import onnxruntime as ort
+
+        if not os.path.exists(onnx_path):
+            raise FileNotFoundError(f"{onnx_path} not found. Create it with: python u2net_export.py export")
+        self.weights_path = onnx_path
+        self.input_size = input_size
+        self.architecture = architecture
+        options = ort.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def forward(self, batch):
+        return self.session.run(None, {self.input_name: batch.numpy()})[0][:, 0]
+
+
+def backend_path(backend, weights_path=DEFAULT_WEIGHTS):
+    """Artefact a backend loads, derived from the PyTorch weights path."""
+    root, _ = os.path.splitext(weights_path)
+    return {'torch': weights_path, 'onnx': root + '.onnx', 'onnx-int8': root + '.int8.onnx'}[backend]
+
+
+def create_engine(backend='torch', weights_path=DEFAULT_WEIGHTS, input_size=320, num_threads=None,
+                  architecture='u2net'):
+    """Create an engine for one of BACKENDS."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+    if backend == 'torch':
+        return U2NetEngine(weights_path, input_size, num_threads, architecture)
+    engine = OnnxU2NetEngine(backend_path(backend, weights_path), input_size, num_threads, architecture)
+    engine.backend = backend
+    return engine
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(weights_path=DEFAULT_WEIGHTS, input_size=320, num_threads=None, backend='torch',
+               architecture='u2net'):
+    """Return a shared engine so the weights are only loaded once per process."""
+    key = (architecture, backend, weights_path, input_size)
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = create_engine(backend, weights_path, input_size, num_threads, architecture)
+        return _engines[key]
+
+
+class U2NetSelector:
+    """Choose between full U2-Net and U2-Netp per request from a latency budget.
+
+    Latency is estimated as a fixed network cost per model plus a pre- and
+    post-processing cost proportional to the image's megapixels. Both start
+    from rough priors and are refined with an exponential moving average of
+    observed timings. Requests without a budget get the full model. Engines
+    are created on first use and shared through get_engine().
+    """
+
+    # Rough CPU priors in milliseconds for a 320x320 input
+    DEFAULT_NETWORK_MS = {'u2net': 600.0, 'u2netp': 60.0}
+    DEFAULT_MS_PER_MEGAPIXEL = 15.0
+
+    def __init__(self, weights=None, input_size=320, num_threads=None, backend='torch', smoothing=0.2):
+        self.weights = weights or {name: default for name, (_, default) in ARCHITECTURES.items()}
+        self.input_size = input_size
+        self.num_threads = num_threads
+        self.backend = backend
+        self.smoothing = smoothing
+        self.network_ms = dict(self.DEFAULT_NETWORK_MS)
+        self.ms_per_megapixel = self.DEFAULT_MS_PER_MEGAPIXEL
+        self.lock = threading.Lock()
+
+    def estimate(self, architecture, image_shape):
+        megapixels = image_shape[0] * image_shape[1] / 1e6
+        return self.network_ms[architecture] + self.ms_per_megapixel * megapixels
+
+    def choose(self, image_shape, latency_budget_ms=None):
+        """Return 'u2net' if it fits the budget (or there is none), otherwise 'u2netp'."""
+        if latency_budget_ms is None or self.estimate('u2net', image_shape) <= latency_budget_ms:
+            return 'u2net'
+        return 'u2netp'
+
+    def engine(self, architecture):
+        return get_engine(self.weights[architecture], self.input_size, self.num_threads, self.backend, architecture)
+
+    def predict(self, image, latency_budget_ms=None):
+        """Return (mask, architecture used) for a BGR image."""
+        architecture = self.choose(image.shape, latency_budget_ms)
+        return self.run(image, architecture), architecture
+
+    def run(self, image, architecture):
+        """The mask of one architecture's engine.predict, timed to refine the estimates."""
+        engine = self.engine(architecture)
+        start = time.perf_counter()
+        batch = engine.preprocess(image)
+        prepared = time.perf_counter()
+        saliency = engine.infer(batch)[0]
+        inferred = time.perf_counter()
+        mask = cv2.resize(saliency, (image.shape[1], image.shape[0]), interpolation=cv2.INTER_LINEAR)
+        done = time.perf_counter()
+        self.observe(architecture, image.shape, (inferred - prepared) * 1000,
+                     ((prepared - start) + (done - inferred)) * 1000)
+        return mask
+
+    def observe(self, architecture, image_shape, network_ms, io_ms):
+        """Move the estimates towards what one request actually cost."""
+        megapixels = max(image_shape[0] * image_shape[1] / 1e6, 1e-3)
+        with self.lock:
+            self.network_ms[architecture] += self.smoothing * (network_ms - self.network_ms[architecture])
+            self.ms_per_megapixel += self.smoothing * (io_ms / megapixels - self.ms_per_megapixel)
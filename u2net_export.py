@@ -0,0 +1,127 @@
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from u2net_engine import ARCHITECTURES, BACKENDS, DEFAULT_WEIGHTS, U2NetEngine, backend_path, create_engine
+
+
+class _FusedOutput(torch.nn.Module):
+    """Expose only the fused d0 output so the exported graph stays small."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model(x)[0]
+
+
+def export_onnx(model, onnx_path, input_size=320, opset=17):
+    """Export a U2NET model to ONNX with dynamic batch and spatial dimensions."""
+    dummy = torch.zeros(1, 3, input_size, input_size)
+    # The exporter restores the wrapper's training flag on every submodule afterwards,
+    # so the wrapper itself must be in eval mode or model is left in training mode
+    torch.onnx.export(
+        _FusedOutput(model).eval(), dummy, onnx_path,
+        input_names=['input'], output_names=['d0'], opset_version=opset,
+        dynamic_axes={'input': {0: 'batch', 2: 'height', 3: 'width'}, 'd0': {0: 'batch', 2: 'height', 3: 'width'}},
+        dynamo=False
+    )
+
+
+def quantize_int8(onnx_path, int8_path):
+    """Dynamically quantize an ONNX graph's weights to int8 (Conv included)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+
+
+def mask_iou(reference, mask, threshold=0.5):
+    reference = reference > threshold
+    mask = mask > threshold
+    union = np.logical_or(reference, mask).sum()
+    if union == 0:
+        return 1.0
+    return float(np.logical_and(reference, mask).sum() / union)
+
+
+def parity(reference, engine, images):
+    """Compare an engine against the float32 reference; returns per-image (iou, mae) and ms/image."""
+    results = []
+    elapsed = 0.0
+    for image in images:
+        expected = reference.predict(image)
+        start = time.perf_counter()
+        mask = engine.predict(image)
+        elapsed += time.perf_counter() - start
+        results.append((mask_iou(expected, mask), float(np.abs(expected - mask).mean())))
+    return results, elapsed * 1000 / len(images)
+
+
+def export(args):
+    if args.random:
+        # Randomly initialised checkpoint for trying the pipeline without the download
+        os.makedirs(os.path.dirname(args.weights) or '.', exist_ok=True)
+        torch.save(U2NetEngine(None, architecture=args.architecture).model.state_dict(), args.weights)
+        print(f"Wrote random weights to {args.weights}")
+
+    engine = U2NetEngine(args.weights, args.input_size, architecture=args.architecture)
+    onnx_path = backend_path('onnx', args.weights)
+    int8_path = backend_path('onnx-int8', args.weights)
+    export_onnx(engine.model, onnx_path, args.input_size)
+    print(f"Exported {onnx_path}")
+    quantize_int8(onnx_path, int8_path)
+    print(f"Quantized {int8_path}")
+
+
+def check_parity(args):
+    images = [cv2.imread(path) for path in args.images]
+    images = [image for image in images if image is not None]
+    reference = U2NetEngine(args.weights, args.input_size, args.threads, args.architecture)
+
+    candidates = []
+    for backend in args.backends:
+        engine = create_engine(backend, args.weights, args.input_size, args.threads, args.architecture)
+        results, ms = parity(reference, engine, images)
+        iou = np.mean([r[0] for r in results])
+        mae = np.mean([r[1] for r in results])
+        ok = iou >= args.min_iou and mae <= args.max_mae
+        print(f"{backend:10s} IoU {iou:.4f}  MAE {mae:.4f}  {ms:8.1f} ms/image  {'ok' if ok else 'outside tolerance'}")
+        if ok:
+            candidates.append((ms, backend))
+
+    if candidates:
+        print(f"Fastest backend within tolerance: {min(candidates)[1]}")
+    else:
+        print("No backend within tolerance")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and check U2-Net inference backends")
+    parser.add_argument("--weights", default=DEFAULT_WEIGHTS)
+    parser.add_argument("--input-size", type=int, default=320)
+    parser.add_argument("--architecture", default="u2net", choices=sorted(ARCHITECTURES))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Write the ONNX and int8 ONNX artefacts next to the weights")
+    export_parser.add_argument("--random", action="store_true", help="Write random weights first")
+    export_parser.set_defaults(func=export)
+
+    parity_parser = subparsers.add_parser("parity", help="Compare backends against float32 PyTorch")
+    parity_parser.add_argument("images", nargs="*", default=sorted(glob.glob(os.path.join("data", "*"))))
+    parity_parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parity_parser.add_argument("--threads", type=int, default=None)
+    parity_parser.add_argument("--min-iou", type=float, default=0.95)
+    parity_parser.add_argument("--max-mae", type=float, default=0.02)
+    parity_parser.set_defaults(func=check_parity)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
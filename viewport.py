@@ -0,0 +1,204 @@
+import math
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+class TilePyramid:
+    """Multi-resolution view of an image, computed tile by tile on demand.
+
+    Level 0 is the image itself, level n is downscaled by 2**n. Tiles are
+    resampled from the full-resolution image with area averaging the first
+    time they are requested and kept in an LRU cache.
+    """
+
+    def __init__(self, image, tile_size=256, max_tiles=256):
+        self.image = image
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        self.height, self.width = image.shape[:2]
+        self.levels = int(math.log2(max(self.width, self.height))) + 1
+        self.tiles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def level_size(self, level):
+        scale = 2 ** level
+        return int(math.ceil(self.width / scale)), int(math.ceil(self.height / scale))
+
+    def tile(self, level, tx, ty):
+        """Return tile (tx, ty) of a level, resampling it only on a cache miss."""
+        key = (level, tx, ty)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+        self.misses += 1
+
+        level_width, level_height = self.level_size(level)
+        x0 = tx * self.tile_size
+        y0 = ty * self.tile_size
+        x1 = min(x0 + self.tile_size, level_width)
+        y1 = min(y0 + self.tile_size, level_height)
+
+        # Matching region of the full-resolution image
+        scale = 2 ** level
+        source = self.image[y0 * scale:min(y1 * scale, self.height), x0 * scale:min(x1 * scale, self.width)]
+        if level == 0:
+            tile = source
+        else:
+            tile = cv2.resize(source, (x1 - x0, y1 - y0), interpolation=cv2.INTER_AREA)
+
+        self.tiles[key] = tile
+        if len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        return tile
+
+    def region(self, level, x0, y0, x1, y1):
+        """Assemble the level pixels in [x0, x1) x [y0, y1) from the tiles that cover them."""
+        size = self.tile_size
+        shape = (y1 - y0, x1 - x0) + self.image.shape[2:]
+        region = np.empty(shape, dtype=self.image.dtype)
+        for ty in range(y0 // size, (y1 - 1) // size + 1):
+            for tx in range(x0 // size, (x1 - 1) // size + 1):
+                tile = self.tile(level, tx, ty)
+                # Overlap between this tile and the requested region
+                tile_x, tile_y = tx * size, ty * size
+                ox0, oy0 = max(x0, tile_x), max(y0, tile_y)
+                ox1, oy1 = min(x1, tile_x + tile.shape[1]), min(y1, tile_y + tile.shape[0])
+                region[oy0 - y0:oy1 - y0, ox0 - x0:ox1 - x0] = tile[oy0 - tile_y:oy1 - tile_y, ox0 - tile_x:ox1 - tile_x]
+        return region
+
+
+class Viewport:
+    """Zoom and pan state for a fixed-size canvas showing a TilePyramid."""
+
+    def __init__(self, width, height, min_zoom=None, max_zoom=16.0):
+        self.width = width
+        self.height = height
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.zoom = 1.0
+        self.center_x = 0.0
+        self.center_y = 0.0
+        self.image_width = 0
+        self.image_height = 0
+
+    def fit(self, image_width, image_height):
+        """Show the whole image centred in the canvas."""
+        self.image_width = image_width
+        self.image_height = image_height
+        self.zoom = min(self.width / image_width, self.height / image_height)
+        self.center_x = image_width / 2
+        self.center_y = image_height / 2
+
+    def canvas_to_image(self, x, y):
+        return (self.center_x + (x - self.width / 2) / self.zoom,
+                self.center_y + (y - self.height / 2) / self.zoom)
+
+    def image_to_canvas(self, x, y):
+        return ((x - self.center_x) * self.zoom + self.width / 2,
+                (y - self.center_y) * self.zoom + self.height / 2)
+
+    def zoom_at(self, factor, x, y):
+        """Zoom by a factor while keeping the image point under (x, y) fixed."""
+        if not self.image_width:
+            return
+        fit_zoom = min(self.width / self.image_width, self.height / self.image_height)
+        min_zoom = self.min_zoom if self.min_zoom is not None else fit_zoom / 2
+        new_zoom = max(min_zoom, min(self.max_zoom, self.zoom * factor))
+        image_x, image_y = self.canvas_to_image(x, y)
+        self.zoom = new_zoom
+        self.center_x = image_x - (x - self.width / 2) / self.zoom
+        self.center_y = image_y - (y - self.height / 2) / self.zoom
+
+    def pan(self, dx, dy):
+        """Move the view by a canvas-pixel offset."""
+        self.center_x -= dx / self.zoom
+        self.center_y -= dy / self.zoom
+
+    def render(self, pyramid):
+        """Return a canvas-sized array showing the visible part of the pyramid."""
+        display = np.zeros((self.height, self.width) + pyramid.image.shape[2:], dtype=pyramid.image.dtype)
+
+        # Pick the coarsest level that still has at least one pixel per screen pixel
+        level = 0
+        if self.zoom < 1:
+            level = min(int(math.floor(math.log2(1 / self.zoom))), pyramid.levels - 1)
+        level_scale = 2 ** -level
+        residual = self.zoom / level_scale
+        level_width, level_height = pyramid.level_size(level)
+
+        # Visible rectangle in level coordinates, clipped to the level
+        left, top = self.canvas_to_image(0, 0)
+        left, top = left * level_scale, top * level_scale
+        x0 = max(0, int(math.floor(left)))
+        y0 = max(0, int(math.floor(top)))
+        x1 = min(level_width, int(math.ceil(left + self.width / residual)))
+        y1 = min(level_height, int(math.ceil(top + self.height / residual)))
+        if x1 <= x0 or y1 <= y0:
+            return display
+
+        region = pyramid.region(level, x0, y0, x1, y1)
+
+        # Place the region on the canvas with a single resample
+        dest_x0 = int(round((x0 - left) * residual))
+        dest_y0 = int(round((y0 - top) * residual))
+        dest_x1 = int(round((x1 - left) * residual))
+        dest_y1 = int(round((y1 - top) * residual))
+        if dest_x1 <= dest_x0 or dest_y1 <= dest_y0:
+            return display
+        # Show individual pixels when zoomed far in so mask edges stay crisp
+        if residual >= 4:
+            interpolation = cv2.INTER_NEAREST
+        elif residual < 1:
+            interpolation = cv2.INTER_AREA
+        else:
+            interpolation = cv2.INTER_LINEAR
+        scaled = cv2.resize(region, (dest_x1 - dest_x0, dest_y1 - dest_y0), interpolation=interpolation)
+
+        cx0, cy0 = max(0, dest_x0), max(0, dest_y0)
+        cx1, cy1 = min(self.width, dest_x1), min(self.height, dest_y1)
+        display[cy0:cy1, cx0:cx1] = scaled[cy0 - dest_y0:cy1 - dest_y0, cx0 - dest_x0:cx1 - dest_x0]
+        return display
+
+
+class ZoomPanControls:
+    """Bind mouse wheel zoom and right-button drag pan on a canvas to a Viewport."""
+
+    def __init__(self, canvas, viewport, redraw, zoom_step=1.25):
+        self.canvas = canvas
+        self.viewport = viewport
+        self.redraw = redraw
+        self.zoom_step = zoom_step
+        self.last_drag = None
+
+        canvas.bind('<MouseWheel>', self.on_wheel)
+        canvas.bind('<Button-4>', self.on_wheel)
+        canvas.bind('<Button-5>', self.on_wheel)
+        canvas.bind('<ButtonPress-3>', self.on_pan_start)
+        canvas.bind('<B3-Motion>', self.on_pan)
+        canvas.bind('<Double-Button-3>', self.on_reset)
+
+    def on_wheel(self, event):
+        zoom_in = event.num == 4 or getattr(event, 'delta', 0) > 0
+        factor = self.zoom_step if zoom_in else 1 / self.zoom_step
+        self.viewport.zoom_at(factor, event.x, event.y)
+        self.redraw()
+
+    def on_pan_start(self, event):
+        self.last_drag = (event.x, event.y)
+
+    def on_pan(self, event):
+        if self.last_drag is None:
+            return
+        self.viewport.pan(event.x - self.last_drag[0], event.y - self.last_drag[1])
+        self.last_drag = (event.x, event.y)
+        self.redraw()
+
+    def on_reset(self, event):
+        if self.viewport.image_width:
+            self.viewport.fit(self.viewport.image_width, self.viewport.image_height)
+            self.redraw()